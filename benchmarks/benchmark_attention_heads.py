@@ -0,0 +1,117 @@
+import argparse
+import logging
+import os
+import sys
+import time
+from collections import OrderedDict
+
+import pandas as pd
+import torch
+import torch.nn as nn
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from models.attention import LIN_OUTPUT, OUTPUT_BIAS, OUTPUT_WEIGHT, convert_lin_output_state_dict
+
+'''
+Micro-benchmark of MultiHeadAttention output layers
+
+Compares the per-tag output layers applied in a Python loop (as in
+checkpoints saved before batching) to the batched einsum over the stacked
+weights, across tag counts and batch sizes. Weights for the batched layer
+are produced with convert_lin_output_state_dict, so the comparison also
+checks checkpoint conversion.
+
+Run:
+python benchmarks/benchmark_attention_heads.py --tags 2 8 32 --batch_sizes 1 16 64 --destination benchmarks/results/
+'''
+
+
+def loop_output(lin_output, attended):
+    logits = []
+    for i, x in enumerate(attended.split(1, -1)):
+        logits.append(lin_output[str(i)](x.squeeze(-1)).unsqueeze(1))
+    return torch.cat(logits, dim=1)
+
+
+def batched_output(weight, bias, attended):
+    return torch.einsum('bht,toh->bto', attended, weight) + bias
+
+
+def time_fn(fn, repeat, warmup=3):
+
+    with torch.no_grad():
+        for _ in range(warmup):
+            fn()
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            fn()
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+
+    return (time.perf_counter() - t0)/repeat
+
+
+def main(args):
+
+    device = torch.device(args.device)
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+
+    rows = []
+    for num_tags in args.tags:
+
+        # legacy per-tag layers and converted state dict
+        lin_output = nn.ModuleDict(OrderedDict())
+        for i in range(num_tags):
+            lin_output[str(i)] = nn.Linear(args.input_dim, args.output_dim, bias=True)
+        lin_output.to(device)
+
+        state_dict = OrderedDict([(f'{LIN_OUTPUT}.{k}', v) for k, v in lin_output.state_dict().items()])
+        convert_lin_output_state_dict(state_dict, '', num_tags)
+        weight = state_dict[OUTPUT_WEIGHT]
+        bias = state_dict[OUTPUT_BIAS]
+
+        for batch_size in args.batch_sizes:
+
+            attended = torch.randn(batch_size, args.input_dim, num_tags, device=device)
+
+            with torch.no_grad():
+                diff = (loop_output(lin_output, attended) - batched_output(weight, bias, attended)).abs().max().item()
+
+            t_loop = time_fn(lambda: loop_output(lin_output, attended), args.repeat)
+            t_batched = time_fn(lambda: batched_output(weight, bias, attended), args.repeat)
+
+            rows.append((num_tags, batch_size, t_loop*1e3, t_batched*1e3, t_loop/t_batched, diff))
+            logging.info(f"tags={num_tags}, batch={batch_size}: loop={t_loop*1e3:.3f}ms, batched={t_batched*1e3:.3f}ms, max diff={diff:.2e}")
+
+    df = pd.DataFrame(rows, columns=["num_tags", "batch_size", "loop_ms", "batched_ms", "speedup", "max_abs_diff"])
+    logging.info(f"Output layer benchmark:\n{df}")
+
+    if args.destination is not None:
+        if not os.path.exists(args.destination):
+            os.makedirs(args.destination)
+        f = os.path.join(args.destination, "benchmark_attention_heads.csv")
+        df.to_csv(f, index=False)
+        logging.info(f"Results saved: {f}")
+
+    return 0
+
+
+if __name__ == '__main__':
+
+    logging.basicConfig(level=logging.INFO)
+
+    arg_parser = argparse.ArgumentParser(description='benchmark per-tag vs batched attention output layers')
+    arg_parser.add_argument('--tags', type=int, default=[2, 4, 8, 16, 32, 64], nargs='+', help="tag counts")
+    arg_parser.add_argument('--batch_sizes', type=int, default=[1, 8, 32, 128], nargs='+', help="batch sizes")
+    arg_parser.add_argument('--input_dim', type=int, default=768, help="attended input dimensionality")
+    arg_parser.add_argument('--output_dim', type=int, default=2, help="output dimensionality per tag")
+    arg_parser.add_argument('--repeat', type=int, default=100, help="timing repetitions")
+    arg_parser.add_argument('--threads', type=int, default=None, help="intra-op threads. None will use the torch default")
+    arg_parser.add_argument('--device', type=str, default='cpu', help="torch device")
+    arg_parser.add_argument('--destination', type=str, default=None, help="path to output directory")
+    args = arg_parser.parse_args()
+
+    sys.exit(main(args))
@@ -0,0 +1,200 @@
+import argparse
+import logging
+import os
+import sys
+import time
+
+import pandas as pd
+import torch
+import torch.optim as optim
+import torch.utils.data as data_utils
+from torch.utils.data import Dataset
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import config.constants as C
+from corpus.brat import get_brat_files
+from corpus.document_brat import tokenize_document
+from corpus.tokenization import get_pipeline
+from models.batching import BucketBatchSampler, trim_collate
+from models.crf import MultitaskCRF
+from models.recurrent import Recurrent
+from models.utils import create_mask
+
+'''
+Training throughput with and without length-bucketed batches
+
+Sentence lengths are taken from the bundled mtsamples social history
+corpus (regex tokenizer, plus start and end tokens, truncated to max_len).
+A recurrent encoder and the multitask CRF heads from MultitaskModel are
+trained on random embeddings, once with the previous shuffled DataLoader
+(every batch padded to max_len) and once with BucketBatchSampler and
+trim_collate. Throughput is reported as unpadded tokens per second.
+
+Run:
+python benchmarks/benchmark_bucket_batches.py --destination benchmarks/results/
+'''
+
+SOURCE_DIR = os.path.join(os.path.dirname(__file__), '..', 'output', 'social_history_mtsamples')
+
+PADDED = "padded"
+BUCKETED = "bucketed"
+
+
+class RandomEmbeddingDataset(Dataset):
+    '''
+    Random embeddings and all-outside sequence tags for given sentence lengths
+    '''
+
+    def __init__(self, lengths, max_len, embed_size, event_types):
+        self.lengths = [min(n, max_len) for n in lengths]
+        self.max_len = max_len
+        self.embed_size = embed_size
+        self.event_types = event_types
+        self.mask = create_mask(self.lengths, max_len)
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def __getitem__(self, index):
+        X = torch.randn(self.max_len, self.embed_size)
+        mask = torch.from_numpy(self.mask[index])
+        y = {C.ENTITY: {t: torch.zeros(self.max_len, dtype=torch.long) for t in self.event_types}}
+        return (X, mask, y)
+
+
+class Encoder(torch.nn.Module):
+
+    def __init__(self, embed_size, hidden_size, event_types, num_tags):
+        super(Encoder, self).__init__()
+        self.rnn = Recurrent(input_size=embed_size, output_size=hidden_size)
+        self.crf = MultitaskCRF(event_types=event_types, num_tags=num_tags, embed_size=self.rnn.output_size)
+
+    def forward(self, X, mask, y):
+        H = self.rnn(X, mask)
+        _, _, loss = self.crf(H, y=y[C.ENTITY], mask=mask)
+        return loss
+
+
+def get_lengths(source_dir, max_len, sample_count=None):
+
+    text_files, _ = get_brat_files(source_dir)
+    if sample_count is not None:
+        text_files = text_files[:sample_count]
+
+    tokenizer = get_pipeline(C.REGEX_TOKENIZER)
+
+    lengths = []
+    for fn in text_files:
+        with open(fn, 'r', encoding=C.ENCODING) as f:
+            tokens, _ = tokenize_document(f.read(), tokenizer)
+        # start and end tokens
+        lengths.extend([min(len(sent) + 2, max_len) for sent in tokens])
+
+    return lengths
+
+
+def run_epoch(model, dataloader, optimizer, device):
+
+    model.train()
+    token_count = 0
+    padded_count = 0
+    t0 = time.perf_counter()
+    for X, mask, y in dataloader:
+        X = X.to(device)
+        mask = mask.to(device)
+        y = {K: {k: v.to(device) for k, v in V.items()} for K, V in y.items()}
+
+        optimizer.zero_grad()
+        loss = model(X, mask, y)
+        loss.backward()
+        optimizer.step()
+
+        token_count += int(mask.sum())
+        padded_count += mask.numel()
+
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+    return (time.perf_counter() - t0, token_count, padded_count)
+
+
+def main(args):
+
+    device = torch.device(args.device)
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    torch.manual_seed(args.seed)
+
+    lengths = get_lengths(args.source_dir, args.max_len, sample_count=args.sample_count)
+    logging.info(f"Sentences: {len(lengths)}, mean length: {sum(lengths)/len(lengths):.1f}, max_len: {args.max_len}")
+
+    label_map = C.MULTITASK_LABEL_DEF[C.ENTITY][C.LAB_MAP]
+    event_types = list(label_map)
+    num_tags = {t: 2*len(m) - 1 for t, m in label_map.items()}
+
+    dataset = RandomEmbeddingDataset(lengths, args.max_len, args.embed_size, event_types)
+
+    dataloaders = {}
+    dataloaders[PADDED] = data_utils.DataLoader(dataset, \
+                                batch_size = args.batch_size,
+                                shuffle = True)
+    dataloaders[BUCKETED] = data_utils.DataLoader(dataset, \
+                                batch_sampler = BucketBatchSampler( \
+                                        lengths = dataset.mask.sum(1),
+                                        batch_size = args.batch_size,
+                                        bucket_size = args.bucket_size,
+                                        seed = args.seed),
+                                collate_fn = trim_collate)
+
+    rows = []
+    for name, dataloader in dataloaders.items():
+
+        torch.manual_seed(args.seed)
+        model = Encoder(args.embed_size, args.hidden_size, event_types, num_tags).to(device)
+        optimizer = optim.Adam(model.parameters(), lr=0.001)
+
+        for epoch in range(args.epochs):
+            elapsed, token_count, padded_count = run_epoch(model, dataloader, optimizer, device)
+            rows.append((name, epoch, len(dataloader), token_count, padded_count, \
+                                1 - token_count/padded_count, elapsed, token_count/elapsed))
+            logging.info(f"{name}, epoch {epoch}: {token_count/elapsed:.0f} tokens/sec, padding={1 - token_count/padded_count:.3f}")
+
+    df = pd.DataFrame(rows, columns=["batching", "epoch", "batches", "tokens", "padded_tokens", "padding", "seconds", "tokens_per_sec"])
+    summary = df.groupby("batching", sort=False)[["padding", "seconds", "tokens_per_sec"]].mean().reset_index()
+    summary["speedup"] = summary["tokens_per_sec"]/summary.loc[summary["batching"] == PADDED, "tokens_per_sec"].iloc[0]
+
+    logging.info(f"Throughput by epoch:\n{df}")
+    logging.info(f"Throughput summary:\n{summary}")
+
+    if args.destination is not None:
+        if not os.path.exists(args.destination):
+            os.makedirs(args.destination)
+        f = os.path.join(args.destination, "bucket_batches_by_epoch.csv")
+        df.to_csv(f, index=False)
+        f = os.path.join(args.destination, "bucket_batches_summary.csv")
+        summary.to_csv(f, index=False)
+        logging.info(f"Results saved: {args.destination}")
+
+    return 0
+
+
+if __name__ == '__main__':
+
+    logging.basicConfig(level=logging.INFO)
+
+    arg_parser = argparse.ArgumentParser(description='compare padded and length-bucketed training throughput')
+    arg_parser.add_argument('--source_dir', type=str, default=SOURCE_DIR, help="path to BRAT corpus")
+    arg_parser.add_argument('--destination', type=str, default=None, help="path to output directory")
+    arg_parser.add_argument('--sample_count', type=int, default=None, help="number of documents. None will use all documents")
+    arg_parser.add_argument('--max_len', type=int, default=50, help="maximum sequence length")
+    arg_parser.add_argument('--batch_size', type=int, default=50, help="batch size")
+    arg_parser.add_argument('--bucket_size', type=int, default=50, help="batches per length bucket")
+    arg_parser.add_argument('--embed_size', type=int, default=768, help="input embedding size")
+    arg_parser.add_argument('--hidden_size', type=int, default=100, help="recurrent hidden size")
+    arg_parser.add_argument('--epochs', type=int, default=2, help="epochs per configuration")
+    arg_parser.add_argument('--seed', type=int, default=1, help="random seed")
+    arg_parser.add_argument('--threads', type=int, default=None, help="intra-op threads. None will use the torch default")
+    arg_parser.add_argument('--device', type=str, default='cpu', help="torch device")
+    args = arg_parser.parse_args()
+
+    sys.exit(main(args))
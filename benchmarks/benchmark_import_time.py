@@ -0,0 +1,120 @@
+import argparse
+import json
+import logging
+import os
+import re
+import subprocess
+import sys
+from collections import OrderedDict
+
+'''
+Import-time guard for command line entry points
+
+Each module is imported in a fresh interpreter with python -X importtime.
+The guard fails if any heavy dependency is loaded at import time, or if
+the cumulative import time exceeds the budget.
+
+Run:
+python benchmarks/benchmark_import_time.py
+python benchmarks/benchmark_import_time.py --budget_ms 300 --output benchmarks/results/import_time.json
+'''
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# modules imported by the command line entry points before any real work
+MODULES = [
+    'config.constants',
+    'corpus.labels',
+    'corpus.tokenization',
+    'corpus.corpus_brat',
+    'spert_utils.spert_io',
+    'scoring.scoring',
+    ]
+
+# dependencies that must only load on first use
+HEAVY = ['spacy', 'pandas', 'matplotlib', 'torch', 'transformers', 'sklearn']
+
+BUDGET_MS = 500.0
+
+IMPORT_TIME_RE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$')
+
+
+def import_time(module, python=sys.executable):
+    '''
+    Import module in a fresh interpreter and parse the -X importtime report
+
+    returns dict of top-level package -> cumulative import time (ms)
+    and the cumulative time of module itself (ms)
+    '''
+
+    p = subprocess.run([python, '-X', 'importtime', '-c', f'import {module}'], \
+                        cwd = ROOT,
+                        stdout = subprocess.PIPE,
+                        stderr = subprocess.PIPE,
+                        universal_newlines = True)
+    if p.returncode != 0:
+        raise ValueError(f"Could not import {module}:\n{p.stderr[-2000:]}")
+
+    packages = OrderedDict()
+    total = 0.0
+    for line in p.stderr.splitlines():
+        m = IMPORT_TIME_RE.match(line)
+        if m is None:
+            continue
+        cumulative = int(m.group(2))/1000.0
+        name = m.group(4)
+        top = name.split('.')[0]
+        packages[top] = max(packages.get(top, 0.0), cumulative)
+        if name == module:
+            total = cumulative
+
+    return (packages, total)
+
+
+def main(args):
+
+    results = OrderedDict()
+    failed = []
+    for module in args.modules:
+
+        packages, total = import_time(module)
+        heavy = [h for h in args.heavy if h in packages]
+
+        results[module] = OrderedDict([ \
+                        ("total_ms", total),
+                        ("heavy", heavy),
+                        ("slowest", sorted(packages.items(), key=lambda x: -x[1])[:5]),
+                        ])
+
+        status = 'ok'
+        if len(heavy) > 0:
+            status = f"FAIL heavy imports: {heavy}"
+        elif total > args.budget_ms:
+            status = f"FAIL over budget ({args.budget_ms:.0f}ms)"
+        if status != 'ok':
+            failed.append(module)
+
+        logging.info(f"{module:<28} {total:>8.1f}ms  {status}")
+
+    if args.output is not None:
+        d = os.path.dirname(args.output)
+        if d and not os.path.exists(d):
+            os.makedirs(d)
+        json.dump(results, open(args.output, 'w'), indent=4)
+        logging.info(f"Import times: {args.output}")
+
+    return 1 if len(failed) > 0 else 0
+
+
+if __name__ == '__main__':
+
+    logging.basicConfig(level=logging.INFO)
+
+    arg_parser = argparse.ArgumentParser(description='guard import time of command line entry points')
+    arg_parser.add_argument('--modules', type=str, default=MODULES, nargs='+', help="modules to import")
+    arg_parser.add_argument('--heavy', type=str, default=HEAVY, nargs='+', help="packages that must not load at import time")
+    arg_parser.add_argument('--budget_ms', type=float, default=BUDGET_MS, help="maximum cumulative import time per module")
+    arg_parser.add_argument('--output', type=str, default=None, help="path to output json")
+    args = arg_parser.parse_args()
+
+    sys.exit(main(args))
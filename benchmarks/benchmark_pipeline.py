@@ -0,0 +1,301 @@
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import OrderedDict
+
+import psutil
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import config.constants as C
+from corpus.brat import get_annotations, get_brat_files
+from corpus.corpus_brat import CorpusBrat
+from corpus.document_brat import tokenize_document
+from corpus.labels import brat2events, tb2entities
+from corpus.tokenization import get_tokenizer
+from scoring.scoring import score_docs
+from spert_utils.spert_io import spert2doc_dict, spert_doc2brat_dicts_multi
+from train_mspert import get_label_definition
+
+'''
+Benchmark suite for the corpus, scoring, and SpERT conversion stages
+
+Uses the bundled social history corpus, optionally replicated to larger
+scales, and writes per-stage wall time, CPU time, peak traced memory,
+RSS, and item counts to JSON.
+
+Run:
+python benchmarks/benchmark_pipeline.py run --output benchmarks/results/current.json --scales 1 10 100
+
+Compare against a stored baseline:
+python benchmarks/benchmark_pipeline.py compare benchmarks/results/baseline.json benchmarks/results/current.json
+'''
+
+SOURCE_DIR = os.path.join(os.path.dirname(__file__), '..', 'output', 'social_history_mtsamples')
+SCALE_DIR = os.path.join(tempfile.gettempdir(), 'sdoh_benchmark')
+SCALES = [1, 10, 100, 1000]
+
+WALL = "wall_sec"
+CPU = "cpu_sec"
+PEAK = "peak_mb"
+RSS = "rss_mb"
+ITEMS = "items"
+ITEMS_PER_SEC = "items_per_sec"
+
+REGRESSION_THRESHOLD = 0.10
+
+
+def scale_corpus(source_dir, factor, dest_dir=SCALE_DIR):
+    '''
+    Replicate BRAT corpus factor times, with unique file names per copy
+
+    Scaled corpora are reused across runs if already generated
+    '''
+
+    if factor == 1:
+        return os.path.abspath(source_dir)
+
+    dest = os.path.join(dest_dir, f'scale_{factor}')
+    done = os.path.join(dest, '.complete')
+    if os.path.exists(done):
+        return dest
+
+    if os.path.exists(dest):
+        shutil.rmtree(dest)
+
+    text_files, ann_files = get_brat_files(source_dir)
+    for fn_txt, fn_ann in zip(text_files, ann_files):
+        rel = os.path.splitext(os.path.relpath(fn_txt, source_dir))[0]
+        for k in range(factor):
+            out = os.path.join(dest, f'{rel}_rep{k}')
+            d = os.path.dirname(out)
+            if not os.path.exists(d):
+                os.makedirs(d)
+            shutil.copyfile(fn_txt, f'{out}.{C.TEXT_FILE_EXT}')
+            shutil.copyfile(fn_ann, f'{out}.{C.ANN_FILE_EXT}')
+
+    open(done, 'w').close()
+
+    return dest
+
+
+def measure(fn, memory=True):
+    '''
+    Run fn and measure wall time, CPU time, peak traced memory, and RSS
+
+    fn returns (output, item count)
+    '''
+
+    gc.collect()
+    process = psutil.Process()
+
+    if memory:
+        tracemalloc.start()
+
+    t0 = time.perf_counter()
+    c0 = time.process_time()
+    output, items = fn()
+    c1 = time.process_time()
+    t1 = time.perf_counter()
+
+    peak = 0
+    if memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    wall = t1 - t0
+
+    result = OrderedDict()
+    result[WALL] = wall
+    result[CPU] = c1 - c0
+    result[PEAK] = peak/2**20
+    result[RSS] = process.memory_info().rss/2**20
+    result[ITEMS] = items
+    result[ITEMS_PER_SEC] = items/wall if wall > 0 else 0.0
+
+    return (output, result)
+
+
+def run_stages(path, tokenizer, label_definition, memory=True):
+    '''
+    Benchmark each pipeline stage on the BRAT directory at path
+    '''
+
+    results = OrderedDict()
+
+    text_files, ann_files = get_brat_files(path)
+    texts = []
+    anns = []
+    for fn_txt, fn_ann in zip(text_files, ann_files):
+        with open(fn_txt, 'r', encoding=C.ENCODING) as f:
+            texts.append(f.read())
+        with open(fn_ann, 'r', encoding=C.ENCODING) as f:
+            anns.append(f.read())
+
+    # BRAT parsing
+    def stage():
+        return ([get_annotations(ann) for ann in anns], len(anns))
+    _, results["brat_parse"] = measure(stage, memory)
+
+    # spaCy tokenization
+    def stage():
+        tokenized = [tokenize_document(text, tokenizer) for text in texts]
+        return (tokenized, sum([len(tokens) for tokens, _ in tokenized]))
+    _, results["tokenization"] = measure(stage, memory)
+
+    # corpus import (parsing + tokenization + document construction)
+    def stage():
+        corpus = CorpusBrat()
+        corpus.import_dir(path)
+        return (corpus, corpus.doc_count())
+    corpus, results["import_dir"] = measure(stage, memory)
+    docs = corpus.docs(as_dict=False)
+
+    def stage():
+        entities = [tb2entities(doc.tb_dict, doc.attr_dict, tokens=doc.tokens, token_offsets=doc.token_offsets) for doc in docs]
+        return (entities, sum([len(x) for x in entities]))
+    _, results["tb2entities"] = measure(stage, memory)
+
+    def stage():
+        events = [brat2events(doc.event_dict, doc.tb_dict, doc.attr_dict, tokens=doc.tokens, token_offsets=doc.token_offsets) for doc in docs]
+        return (events, sum([len(x) for x in events]))
+    _, results["brat2events"] = measure(stage, memory)
+
+    tmp = tempfile.mkdtemp()
+    spert_file = os.path.join(tmp, 'data.json')
+
+    def stage():
+        y = corpus.events2spert_multi( \
+                    entity_types = label_definition["entity_types"],
+                    subtype_layers = label_definition["subtype_layers"],
+                    subtype_default = label_definition["subtype_default"],
+                    include_doc_text = True,
+                    path = spert_file)
+        return (y, len(y))
+    _, results["events2spert_multi"] = measure(stage, memory)
+
+    # gold SpERT encoding is used as predictions
+    spert_docs = spert2doc_dict(spert_file)
+    def stage():
+        brat_dicts = [spert_doc2brat_dicts_multi( \
+                                spert_doc = spert_doc,
+                                subtype_default = label_definition["subtype_default"],
+                                event_types = label_definition["event_types"],
+                                swapped_spans = label_definition["swapped_spans"]) \
+                                for spert_doc in spert_docs.values()]
+        return (brat_dicts, len(brat_dicts))
+    _, results["spert_doc2brat_dicts_multi"] = measure(stage, memory)
+
+    gold_docs = corpus.docs(as_dict=True)
+    def stage():
+        df = score_docs(gold_docs, gold_docs, labeled_args=label_definition["score_labeled_args"])
+        return (df, len(gold_docs))
+    _, results["score_docs"] = measure(stage, memory)
+
+    def stage():
+        corpus.write_brat(os.path.join(tmp, 'brat'))
+        return (None, len(gold_docs))
+    _, results["write_brat"] = measure(stage, memory)
+
+    shutil.rmtree(tmp)
+
+    return results
+
+
+def run(args):
+
+    tokenizer = get_tokenizer()
+    label_definition = get_label_definition()
+
+    output = OrderedDict()
+    output["meta"] = OrderedDict([ \
+                    ("source_dir", os.path.abspath(args.source_dir)),
+                    ("python", platform.python_version()),
+                    ("platform", platform.platform()),
+                    ("cpu_count", os.cpu_count()),
+                    ("memory", args.memory),
+                    ("time", time.strftime('%Y-%m-%d %H:%M:%S')),
+                    ])
+    output["results"] = OrderedDict()
+
+    for scale in args.scales:
+        path = scale_corpus(args.source_dir, scale, dest_dir=args.scale_dir)
+        logging.info(f"Benchmark scale {scale}x: {path}")
+
+        output["results"][str(scale)] = run_stages(path, tokenizer, label_definition, memory=args.memory)
+
+        for stage, result in output["results"][str(scale)].items():
+            logging.info(f"{scale}x {stage:<28} wall={result[WALL]:.3f}s cpu={result[CPU]:.3f}s peak={result[PEAK]:.1f}MB items={result[ITEMS]}")
+
+    d = os.path.dirname(args.output)
+    if d and not os.path.exists(d):
+        os.makedirs(d)
+    json.dump(output, open(args.output, 'w'), indent=4)
+    logging.info(f"Benchmark results: {args.output}")
+
+    return 0
+
+
+def compare(args):
+    '''
+    Compare benchmark results to baseline, returning 1 if any stage regressed
+    '''
+
+    baseline = json.load(open(args.baseline, 'r'))["results"]
+    current = json.load(open(args.current, 'r'))["results"]
+
+    regressed = False
+    print(f"{'scale':>6} {'stage':<28} {'metric':<8} {'baseline':>10} {'current':>10} {'ratio':>7}")
+    for scale, stages in current.items():
+        if scale not in baseline:
+            continue
+        for stage, result in stages.items():
+            if stage not in baseline[scale]:
+                continue
+            for metric in [WALL, PEAK]:
+                b = baseline[scale][stage][metric]
+                c = result[metric]
+                if b <= 0:
+                    continue
+                ratio = c/b
+                flag = ''
+                if ratio > 1 + args.threshold:
+                    flag = ' REGRESSION'
+                    regressed = True
+                print(f"{scale:>6} {stage:<28} {metric:<8} {b:>10.3f} {c:>10.3f} {ratio:>7.2f}{flag}")
+
+    return 1 if regressed else 0
+
+
+if __name__ == '__main__':
+
+    logging.basicConfig(level=logging.INFO)
+
+    arg_parser = argparse.ArgumentParser(description='benchmark corpus, scoring, and spert conversion stages')
+    subparsers = arg_parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help="run benchmarks and save results as json")
+    run_parser.add_argument('--output', type=str, required=True, help="path to output json")
+    run_parser.add_argument('--source_dir', type=str, default=SOURCE_DIR, help="path to BRAT corpus")
+    run_parser.add_argument('--scale_dir', type=str, default=SCALE_DIR, help="path for replicated corpora")
+    run_parser.add_argument('--scales', type=int, default=SCALES, nargs='+', help="corpus replication factors")
+    run_parser.add_argument('--no_memory', dest='memory', default=True, action='store_false', help="skip tracemalloc (lower timing overhead)")
+    run_parser.set_defaults(fn=run)
+
+    compare_parser = subparsers.add_parser('compare', help="compare results to a baseline")
+    compare_parser.add_argument('baseline', type=str, help="path to baseline json")
+    compare_parser.add_argument('current', type=str, help="path to current json")
+    compare_parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD, help="relative increase flagged as regression")
+    compare_parser.set_defaults(fn=compare)
+
+    args = arg_parser.parse_args()
+
+    sys.exit(args.fn(args))
@@ -0,0 +1,124 @@
+import argparse
+import logging
+import os
+import pickle
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import joblib
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config.constants import LABELED_ARGUMENTS, REQUIRED_ARGUMENTS
+from corpus.corpus_brat import quality_check_doc, quality_check_docs
+from corpus.document_brat import DocumentBrat
+
+'''
+Serial and multi-process annotation quality checks
+
+Times the serial quality_check_docs over the bundled corpus, replicated to
+larger scales, against process pools sending either whole documents or only
+the attributes read by the checks (QC_FIELDS), along with the pickled
+payload size of each. On the bundled corpus, the checks take ~15 us per
+document, so both pools are 10-60x slower than serial (1 core; 361 docs:
+serial 0.006 s, pools 0.10-0.33 s; 3610 docs: serial 0.05 s, pools
+0.41-0.65 s), which is why quality_check_docs is serial.
+
+Run:
+python benchmarks/benchmark_quality_check.py --scales 1 10 --n_jobs 2 4
+'''
+
+CORPUS_FILE = os.path.join(os.path.dirname(__file__), '..', 'output', 'corpus.pkl')
+
+SERIAL = "serial"
+POOL_FIELDS = "pool_fields"
+POOL_DOCS = "pool_docs"
+
+
+# document attributes read by DocumentBrat.quality_check_rows
+QC_FIELDS = ["id", "text", "tb_dict", "event_dict", "attr_dict"]
+
+
+def check_fields(fields):
+    doc = DocumentBrat.__new__(DocumentBrat)
+    for k, v in zip(QC_FIELDS, fields):
+        setattr(doc, k, v)
+    return quality_check_doc(doc, None, LABELED_ARGUMENTS, REQUIRED_ARGUMENTS)
+
+def check_pool_fields(docs, n_jobs, chunksize=16):
+    fields = [[getattr(doc, k) for k in QC_FIELDS] for doc in docs]
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        return list(executor.map(check_fields, fields, chunksize = chunksize))
+
+def check_pool_docs(docs, n_jobs, chunksize=16):
+    n = len(docs)
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        return list(executor.map(quality_check_doc, docs, \
+                                    [None]*n, [LABELED_ARGUMENTS]*n, [REQUIRED_ARGUMENTS]*n,
+                                    chunksize = chunksize))
+
+def check_serial(docs):
+    return list(quality_check_docs(docs, \
+                    labeled_arguments = LABELED_ARGUMENTS,
+                    required_arguments = REQUIRED_ARGUMENTS))
+
+def timed(fn, *args):
+    t0 = time.perf_counter()
+    out = fn(*args)
+    return (out, time.perf_counter() - t0)
+
+
+def main(args):
+
+    corpus = joblib.load(args.corpus_file)
+    base = corpus.docs(as_dict=False)
+
+    field_bytes = len(pickle.dumps([[getattr(doc, k) for k in QC_FIELDS] for doc in base]))/len(base)
+    doc_bytes = len(pickle.dumps(base))/len(base)
+    logging.info(f"CPU cores: {os.cpu_count()}")
+    logging.info(f"Pickled bytes per document, fields: {field_bytes:.0f}, whole document: {doc_bytes:.0f}")
+
+    rows = []
+    for scale in args.scales:
+
+        docs = base*scale
+
+        reference, elapsed = timed(check_serial, docs)
+        rows.append((scale, len(docs), SERIAL, 1, elapsed))
+
+        for n_jobs in args.n_jobs:
+            for mode, fn in [(POOL_FIELDS, check_pool_fields), (POOL_DOCS, check_pool_docs)]:
+                out, elapsed = timed(fn, docs, n_jobs)
+                assert out == reference
+                rows.append((scale, len(docs), mode, n_jobs, elapsed))
+
+    df = pd.DataFrame(rows, columns=["scale", "docs", "mode", "n_jobs", "seconds"])
+    serial = df[df["mode"] == SERIAL].set_index("scale")["seconds"]
+    df["speedup"] = df["scale"].map(serial)/df["seconds"]
+
+    logging.info(f"Quality check timing:\n{df}")
+
+    if args.destination is not None:
+        if not os.path.exists(args.destination):
+            os.makedirs(args.destination)
+        f = os.path.join(args.destination, "quality_check_timing.csv")
+        df.to_csv(f, index=False)
+        logging.info(f"Results saved: {f}")
+
+    return 0
+
+
+if __name__ == '__main__':
+
+    logging.basicConfig(level=logging.INFO)
+
+    arg_parser = argparse.ArgumentParser(description='serial and multi-process quality check timing')
+    arg_parser.add_argument('--corpus_file', type=str, default=CORPUS_FILE, help="pickled CorpusBrat")
+    arg_parser.add_argument('--destination', type=str, default=None, help="path to output directory")
+    arg_parser.add_argument('--scales', type=int, nargs='+', default=[1, 10], help="corpus replication factors")
+    arg_parser.add_argument('--n_jobs', type=int, nargs='+', default=[2, 4], help="process counts")
+    args = arg_parser.parse_args()
+
+    sys.exit(main(args))
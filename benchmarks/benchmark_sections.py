@@ -0,0 +1,138 @@
+import argparse
+import logging
+import os
+import sys
+from collections import OrderedDict
+
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import config.constants as C
+from corpus.brat import get_annotations, get_brat_files
+from corpus.sections import FALLBACK_DROP, FALLBACK_FULL, GOLD_SPANS_KEPT, SectionLocator
+
+'''
+Gold annotation recall of social history section extraction
+
+Runs the section locator over the bundled social history corpus and reports
+the characters dropped along with the fraction of gold textbounds that fall
+inside the kept text. As the bundled notes are social history sections
+only, each note is also embedded in a full note (other sections before and
+after, with all caps, title case, and inline headers), where the kept text
+from the surrounding note is also reported. Documents with textbounds
+outside the kept text are listed, for reviewing header rules.
+
+Run:
+python benchmarks/benchmark_sections.py --destination benchmarks/results/
+'''
+
+SOURCE_DIR = os.path.join(os.path.dirname(__file__), '..', 'output', 'social_history_mtsamples')
+
+ORIGINAL = "original"
+EMBEDDED = "embedded"
+
+NOTE_BEFORE = \
+    "CHIEF COMPLAINT: Low back pain.\n\n" + \
+    "HISTORY OF PRESENT ILLNESS: The patient is a 54-year-old with low back pain for 2 weeks. " + \
+    "Work: lifting boxes at a warehouse makes the pain worse. Denies fever or weight loss.\n\n" + \
+    "Past Medical History: Hypertension.\n" + \
+    "Past Surgical History: Appendectomy.\n\n"
+
+NOTE_AFTER = \
+    "\n\nFamily History: Father with coronary artery disease.\n" + \
+    "Medications: Lisinopril 10 mg daily.\n" + \
+    "Allergies: No known drug allergies.\n\n" + \
+    "PHYSICAL EXAMINATION:\n" + \
+    "Vitals: Stable.\n" + \
+    "Back: Paraspinal tenderness.\n\n" + \
+    "ASSESSMENT AND PLAN: Lumbar strain. Physical therapy.\n"
+
+
+def overlap(spans, start, end):
+    return sum([max(0, min(e, end) - max(s, start)) for s, e in spans])
+
+
+def main(args):
+
+    text_files, ann_files = get_brat_files(args.source_dir)
+
+    notes = []
+    for fn_txt, fn_ann in zip(text_files, ann_files):
+
+        with open(fn_txt, 'r', encoding=C.ENCODING) as f:
+            text = f.read()
+        with open(fn_ann, 'r', encoding=C.ENCODING) as f:
+            ann = f.read()
+
+        _, _, textbounds, _ = get_annotations(ann)
+        gold_spans = [(tb.start, tb.end) for tb in textbounds.values()]
+
+        notes.append((os.path.relpath(fn_txt, args.source_dir), text, gold_spans))
+
+    summaries = OrderedDict()
+    rows = []
+    for setting in [ORIGINAL, EMBEDDED]:
+
+        locator = SectionLocator(fallback=args.fallback)
+        outside_chars = 0
+        outside_kept = 0
+
+        for fn, text, gold_spans in notes:
+
+            if setting == EMBEDDED:
+                n = len(NOTE_BEFORE)
+                gold_spans = [(s + n, e + n) for s, e in gold_spans]
+                text = NOTE_BEFORE + text + NOTE_AFTER
+
+                # kept text from the surrounding note
+                spans = locator.locate(text)
+                outside_chars += len(NOTE_BEFORE) + len(NOTE_AFTER)
+                if spans:
+                    outside_kept += overlap(spans, 0, len(NOTE_BEFORE)) + \
+                                    overlap(spans, len(text) - len(NOTE_AFTER), len(text))
+                elif args.fallback == FALLBACK_FULL:
+                    outside_kept += len(NOTE_BEFORE) + len(NOTE_AFTER)
+
+            kept = locator.stats[GOLD_SPANS_KEPT]
+            locator.extract(text, gold_spans=gold_spans)
+            kept = locator.stats[GOLD_SPANS_KEPT] - kept
+
+            if kept < len(gold_spans):
+                rows.append((setting, fn, len(gold_spans), len(gold_spans) - kept))
+
+        summary = locator.summary()
+        if setting == EMBEDDED:
+            summary["surrounding_chars"] = outside_chars
+            summary["surrounding_chars_kept"] = outside_kept
+        summaries[setting] = summary
+
+    df = pd.DataFrame(summaries)
+    missed = pd.DataFrame(rows, columns=["setting", "file", "gold_spans", "gold_spans_dropped"])
+
+    logging.info(f"Section extraction:\n{df}")
+    logging.info(f"Documents with dropped gold spans:\n{missed}")
+
+    if args.destination is not None:
+        if not os.path.exists(args.destination):
+            os.makedirs(args.destination)
+        f = os.path.join(args.destination, "section_recall.csv")
+        df.to_csv(f)
+        f = os.path.join(args.destination, "section_recall_docs.csv")
+        missed.to_csv(f, index=False)
+        logging.info(f"Results saved: {args.destination}")
+
+    return 0
+
+
+if __name__ == '__main__':
+
+    logging.basicConfig(level=logging.INFO)
+
+    arg_parser = argparse.ArgumentParser(description='gold annotation recall of section extraction')
+    arg_parser.add_argument('--source_dir', type=str, default=SOURCE_DIR, help="path to BRAT corpus")
+    arg_parser.add_argument('--destination', type=str, default=None, help="path to output directory")
+    arg_parser.add_argument('--fallback', type=str, default=FALLBACK_FULL, choices=[FALLBACK_FULL, FALLBACK_DROP], help="handling of documents without a social history section")
+    args = arg_parser.parse_args()
+
+    sys.exit(main(args))
@@ -0,0 +1,151 @@
+import argparse
+import logging
+import os
+import sys
+import time
+
+import pandas as pd
+import torch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import config.constants as C
+from models.crf import MultitaskSpanExtractor
+
+'''
+Micro-benchmark of MultitaskSpanExtractor span heads
+
+Compares the per-event span extractors (projection, CRF, and endpoint
+extractor applied in a loop over events) to the fused forward, which stacks
+the projections, runs the CRF loss and Viterbi decoding for all events as
+batched tensor ops, and extracts spans for all events at once. Both use the
+same parameters, so predicted paths and spans are compared for equality
+and losses for agreement.
+
+Run:
+python benchmarks/benchmark_span_heads.py --events 4 8 --batch_sizes 8 32 --destination benchmarks/results/
+'''
+
+ENTITY = "Trigger"
+
+
+def get_id_to_label(span_types):
+
+    id_to_label = {0: (C.OUTSIDE, C.OUTSIDE)}
+    for t in span_types:
+        id_to_label[len(id_to_label)] = (C.BEGIN, t)
+        id_to_label[len(id_to_label)] = (C.INSIDE, t)
+
+    return id_to_label
+
+
+def get_model(event_count, span_types, embed_size):
+
+    events = [f"Event{i}" for i in range(event_count)]
+
+    # vary span type count across events, so tags are padded
+    id_to_label = {}
+    num_tags = {}
+    for i, event in enumerate(events):
+        n = 1 + i % span_types
+        id_to_label[event] = {ENTITY: get_id_to_label([f"Type{j}" for j in range(n)])}
+        num_tags[event] = {ENTITY: len(id_to_label[event][ENTITY])}
+
+    model = MultitaskSpanExtractor( \
+                        events = events,
+                        entity = ENTITY,
+                        num_tags = num_tags,
+                        embed_size = embed_size,
+                        id_to_label = id_to_label)
+
+    return (model, events, num_tags)
+
+
+def time_fn(fn, repeat, warmup=2):
+
+    with torch.no_grad():
+        for _ in range(warmup):
+            fn()
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            fn()
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+
+    return (time.perf_counter() - t0)/repeat
+
+
+def run(model, X, y, mask, fused):
+    model.fused = fused
+    return model(X, y=y, mask=mask)
+
+
+def main(args):
+
+    device = torch.device(args.device)
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    torch.manual_seed(args.seed)
+
+    rows = []
+    for event_count in args.events:
+
+        model, events, num_tags = get_model(event_count, args.span_types, args.embed_size)
+        model.to(device)
+        model.eval()
+
+        for batch_size in args.batch_sizes:
+
+            X = torch.randn(batch_size, args.seq_len, args.embed_size, device=device)
+            lengths = torch.randint(1, args.seq_len + 1, (batch_size,), device=device)
+            mask = torch.arange(args.seq_len, device=device).unsqueeze(0) < lengths.unsqueeze(1)
+            y = {event: {ENTITY: torch.randint(0, num_tags[event][ENTITY], (batch_size, args.seq_len), device=device)} \
+                                                                            for event in events}
+
+            with torch.no_grad():
+                loss_loop, pred_loop, spans_loop, _ = run(model, X, y, mask, fused=False)
+                loss_fused, pred_fused, spans_fused, _ = run(model, X, y, mask, fused=True)
+
+            paths_equal = all([pred_loop[event] == pred_fused[event] for event in events])
+            spans_equal = all([spans_loop[event] == spans_fused[event] for event in events])
+            loss_diff = max([abs(loss_loop[event].item() - loss_fused[event].item()) for event in events])
+
+            t_loop = time_fn(lambda: run(model, X, y, mask, fused=False), args.repeat)
+            t_fused = time_fn(lambda: run(model, X, y, mask, fused=True), args.repeat)
+
+            rows.append((event_count, batch_size, t_loop*1e3, t_fused*1e3, t_loop/t_fused, paths_equal, spans_equal, loss_diff))
+            logging.info(f"events={event_count}, batch={batch_size}: loop={t_loop*1e3:.2f}ms, fused={t_fused*1e3:.2f}ms, " + \
+                         f"paths equal={paths_equal}, spans equal={spans_equal}, max loss diff={loss_diff:.2e}")
+
+    df = pd.DataFrame(rows, columns=["events", "batch_size", "loop_ms", "fused_ms", "speedup", "paths_equal", "spans_equal", "max_loss_diff"])
+    logging.info(f"Span head benchmark:\n{df}")
+
+    if args.destination is not None:
+        if not os.path.exists(args.destination):
+            os.makedirs(args.destination)
+        f = os.path.join(args.destination, "benchmark_span_heads.csv")
+        df.to_csv(f, index=False)
+        logging.info(f"Results saved: {f}")
+
+    return 0
+
+
+if __name__ == '__main__':
+
+    logging.basicConfig(level=logging.INFO)
+
+    arg_parser = argparse.ArgumentParser(description='benchmark per-event vs fused multitask span heads')
+    arg_parser.add_argument('--events', type=int, default=[2, 4, 8], nargs='+', help="event counts")
+    arg_parser.add_argument('--batch_sizes', type=int, default=[1, 8, 32], nargs='+', help="batch sizes")
+    arg_parser.add_argument('--span_types', type=int, default=4, help="maximum span types per event")
+    arg_parser.add_argument('--seq_len', type=int, default=60, help="sequence length")
+    arg_parser.add_argument('--embed_size', type=int, default=768, help="input embedding size")
+    arg_parser.add_argument('--repeat', type=int, default=20, help="timing repetitions")
+    arg_parser.add_argument('--seed', type=int, default=1, help="random seed")
+    arg_parser.add_argument('--threads', type=int, default=None, help="intra-op threads. None will use the torch default")
+    arg_parser.add_argument('--device', type=str, default='cpu', help="torch device")
+    arg_parser.add_argument('--destination', type=str, default=None, help="path to output directory")
+    args = arg_parser.parse_args()
+
+    sys.exit(main(args))
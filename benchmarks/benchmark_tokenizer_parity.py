@@ -0,0 +1,134 @@
+import argparse
+import logging
+import os
+import sys
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import config.constants as C
+from corpus.brat import get_brat_files
+from corpus.document_brat import tokenize_document
+from corpus.tokenization import get_pipeline
+
+'''
+Parity and throughput of the regex tokenizer relative to spaCy
+
+Both engines tokenize the bundled social history corpus. Token and sentence
+agreement are reported as precision, recall, and F1 of the regex offsets
+against the spaCy offsets, along with the fraction of documents tokenized
+identically and the throughput of each engine.
+
+Run:
+python benchmarks/benchmark_tokenizer_parity.py --destination benchmarks/results/
+'''
+
+SOURCE_DIR = os.path.join(os.path.dirname(__file__), '..', 'output', 'social_history_mtsamples')
+
+TOKENS = "tokens"
+SENTENCES = "sentences"
+
+
+def prf(reference, candidate):
+
+    tp = len(reference & candidate)
+    p = tp/len(candidate) if len(candidate) > 0 else 0.0
+    r = tp/len(reference) if len(reference) > 0 else 0.0
+    f1 = 2*p*r/(p + r) if (p + r) > 0 else 0.0
+
+    return (p, r, f1)
+
+
+def run_engine(texts, tokenizer, repeat=1):
+    '''
+    Tokenize texts, returning (token offsets, sentence starts, seconds)
+    '''
+
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        output = [tokenize_document(text, tokenizer) for text in texts]
+    elapsed = (time.perf_counter() - t0)/repeat
+
+    token_offsets = []
+    sent_starts = []
+    for _, offsets in output:
+        token_offsets.append(set([o for sent in offsets for o in sent]))
+        sent_starts.append(set([sent[0][0] for sent in offsets if len(sent) > 0]))
+
+    return (token_offsets, sent_starts, elapsed)
+
+
+def main(args):
+
+    text_files, _ = get_brat_files(args.source_dir)
+    if args.sample_count is not None:
+        text_files = text_files[:args.sample_count]
+
+    texts = []
+    for fn in text_files:
+        with open(fn, 'r', encoding=C.ENCODING) as f:
+            texts.append(f.read())
+    char_count = sum([len(text) for text in texts])
+    logging.info(f"Documents: {len(texts)}, characters: {char_count}")
+
+    results = OrderedDict()
+    for name in [args.spacy_model, C.REGEX_TOKENIZER]:
+        tokenizer = get_pipeline(name)
+        # warm up
+        tokenize_document(texts[0], tokenizer)
+        results[name] = run_engine(texts, tokenizer, repeat=args.repeat)
+
+    ref_tokens, ref_sents, ref_time = results[args.spacy_model]
+    tokens, sents, regex_time = results[C.REGEX_TOKENIZER]
+
+    rows = []
+    for level, ref, cand in [(TOKENS, ref_tokens, tokens), (SENTENCES, ref_sents, sents)]:
+
+        # micro average over documents, with offsets made unique by document index
+        ref_all = set([(i, o) for i, offsets in enumerate(ref) for o in offsets])
+        cand_all = set([(i, o) for i, offsets in enumerate(cand) for o in offsets])
+        p, r, f1 = prf(ref_all, cand_all)
+
+        identical = sum([a == b for a, b in zip(ref, cand)])/len(texts)
+
+        rows.append((level, len(ref_all), len(cand_all), p, r, f1, identical))
+
+    df = pd.DataFrame(rows, columns=["level", "spacy_count", "regex_count", "precision", "recall", "f1", "doc_identical"])
+
+    speed = pd.DataFrame([ \
+            (args.spacy_model, ref_time, len(texts)/ref_time, char_count/ref_time),
+            (C.REGEX_TOKENIZER, regex_time, len(texts)/regex_time, char_count/regex_time),
+            ], columns=["engine", "seconds", "docs_per_sec", "chars_per_sec"])
+    speed["speedup"] = ref_time/speed["seconds"]
+
+    logging.info(f"Agreement with {args.spacy_model}:\n{df}")
+    logging.info(f"Throughput:\n{speed}")
+
+    if args.destination is not None:
+        if not os.path.exists(args.destination):
+            os.makedirs(args.destination)
+        f = os.path.join(args.destination, "tokenizer_parity.csv")
+        df.to_csv(f, index=False)
+        f = os.path.join(args.destination, "tokenizer_throughput.csv")
+        speed.to_csv(f, index=False)
+        logging.info(f"Results saved: {args.destination}")
+
+    return 0
+
+
+if __name__ == '__main__':
+
+    logging.basicConfig(level=logging.INFO)
+
+    arg_parser = argparse.ArgumentParser(description='compare regex tokenizer to spaCy')
+    arg_parser.add_argument('--source_dir', type=str, default=SOURCE_DIR, help="path to BRAT corpus")
+    arg_parser.add_argument('--destination', type=str, default=None, help="path to output directory")
+    arg_parser.add_argument('--spacy_model', type=str, default=C.SPACY_MODEL, help="spaCy model")
+    arg_parser.add_argument('--sample_count', type=int, default=None, help="number of documents. None will use all documents")
+    arg_parser.add_argument('--repeat', type=int, default=3, help="timing repetitions")
+    args = arg_parser.parse_args()
+
+    sys.exit(main(args))
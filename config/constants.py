@@ -1,5 +1,4 @@
 from collections import OrderedDict
-import numpy as np
 
 
 def ATTR_TYPE_MAP(x):
@@ -9,6 +8,7 @@ def ATTR_TYPE_MAP(x):
 OVERALL = "OVERALL"
 
 LABEL_DEFINITION_FILE = "label_definition.pkl"
+TRIGGER_LEXICON_FILE = "trigger_lexicon.json"
 
 UW = "uw"
 MIMIC = "mimic"
@@ -299,20 +299,23 @@ PARAMS_FILE = "parameters.pkl"
 STATE_DICT = "state_dict.pt"
 PREDICTIONS_FILE = "predictions.pkl"
 PREDICTIONS_JSON = "predictions.json"
+PREDICTION_CACHE_FILE = "prediction_cache.pkl"
+PREDICTION_CACHE_SUMMARY = "prediction_cache_summary.csv"
 
 SUBTYPE_DEFAULT = "None"
 
 
 SPACY_MODEL = "en_core_web_sm"
+REGEX_TOKENIZER = "regex"
 
 MIMIC = "mimic"
 
-DARK_RED = tuple(np.array([184, 84, 80]) / 255)
-DARK_BLUE = tuple(np.array([108, 142, 191]) / 255)
-DARK_GOLD = tuple(np.array([224, 172, 46]) / 255)
-DARK_GREEN = tuple(np.array([127, 177, 98]) / 255)
-DARK_GRAY = tuple(np.array([102, 102, 102]) / 255)
-DARK_ORANGE = tuple(np.array([215, 155, 0]) / 255)
+DARK_RED = tuple(c/255 for c in (184, 84, 80))
+DARK_BLUE = tuple(c/255 for c in (108, 142, 191))
+DARK_GOLD = tuple(c/255 for c in (224, 172, 46))
+DARK_GREEN = tuple(c/255 for c in (127, 177, 98))
+DARK_GRAY = tuple(c/255 for c in (102, 102, 102))
+DARK_ORANGE = tuple(c/255 for c in (215, 155, 0))
 
 
 """
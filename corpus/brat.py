@@ -747,3 +747,33 @@ def get_next_index(d):
         last = max(ids)
 
     return last + 1
+
+
+class IdAllocator(object):
+    '''
+    Monotonic allocator of new annotation IDs (e.g. T12, E3, A7, R2) for a document
+
+    The next index for each prefix is found with a single scan of the
+    corresponding annotation dictionary on first use and incremented
+    afterwards, so adding n annotations takes linear, not quadratic, time.
+
+    Parameters
+    ----------
+    dicts: dictionary of annotation dictionaries by ID prefix, e.g. {'T': tb_dict, 'A': attr_dict}
+    '''
+
+    def __init__(self, dicts):
+        self.dicts = dicts
+        self.indices = {}
+
+    def next(self, prefix):
+        '''
+        Allocate the next unused ID with prefix
+        '''
+        if prefix not in self.indices:
+            self.indices[prefix] = get_next_index(self.dicts[prefix])
+
+        index = self.indices[prefix]
+        self.indices[prefix] = index + 1
+
+        return f'{prefix}{index}'
@@ -0,0 +1,339 @@
+import bisect
+import importlib.util
+import os
+from collections import OrderedDict
+
+from corpus.statistics import LABEL_COLUMNS
+from utils.lazy_import import lazy_import
+
+pa = lazy_import('pyarrow')
+pq = lazy_import('pyarrow.parquet')
+pd = lazy_import('pandas')
+
+'''
+Columnar (Arrow/Parquet) export of BRAT corpora
+
+Flattens the documents of a CorpusBrat into tables of documents, sentences,
+textbounds, attributes, events, event arguments, and relations, with
+dictionary-encoded type columns and character and token offsets, so
+analyses can run as vectorized DataFrame operations over memory-mapped
+Parquet files, rather than deserializing the corpus and looping over
+annotation objects.
+
+Requires pyarrow, which is imported on first use.
+
+Usage:
+    corpus.to_parquet(path)    # or write_parquet(corpus.docs(), path)
+    tables = read_parquet(path)
+    df = span_histogram(tables[TEXTBOUNDS], entity_types=["Tobacco"])
+'''
+
+DOCUMENTS = "documents"
+SENTENCES = "sentences"
+TEXTBOUNDS = "textbounds"
+ATTRIBUTES = "attributes"
+EVENTS = "events"
+EVENT_ARGUMENTS = "event_arguments"
+RELATIONS = "relations"
+
+TABLES = [DOCUMENTS, SENTENCES, TEXTBOUNDS, ATTRIBUTES, EVENTS, EVENT_ARGUMENTS, RELATIONS]
+
+PARQUET_EXT = "parquet"
+
+
+def check_pyarrow():
+    '''
+    Fail early with an install hint, as pyarrow is only imported on first use
+    '''
+    if importlib.util.find_spec('pyarrow') is None:
+        raise ImportError("Parquet export requires pyarrow (see requirements.txt): pip install pyarrow")
+
+
+def dictionary_type():
+    return pa.dictionary(pa.int32(), pa.string())
+
+def get_schemas():
+    '''
+    Table schemas by table name. Type, role, and label columns are dictionary encoded
+    '''
+
+    d = dictionary_type()
+    i = pa.int32()
+    s = pa.string()
+
+    schemas = OrderedDict()
+    schemas[DOCUMENTS] = pa.schema([ \
+                ("doc_id", s), ("text", s), ("tags", pa.list_(s)),
+                ("char_count", i), ("sentence_count", i), ("token_count", i)])
+    schemas[SENTENCES] = pa.schema([ \
+                ("doc_id", s), ("sent_index", i),
+                ("char_start", i), ("char_end", i),
+                ("token_start", i), ("token_end", i), ("tokens", pa.list_(s))])
+    schemas[TEXTBOUNDS] = pa.schema([ \
+                ("doc_id", s), ("tb_id", s), ("type", d), ("subtype", d),
+                ("char_start", i), ("char_end", i), ("text", s),
+                ("sent_index", i), ("token_start", i), ("token_end", i)])
+    schemas[ATTRIBUTES] = pa.schema([ \
+                ("doc_id", s), ("attr_id", s), ("tb_id", s), ("type", d), ("value", d)])
+    schemas[EVENTS] = pa.schema([ \
+                ("doc_id", s), ("event_id", s), ("type", d), ("trigger_tb_id", s), ("argument_count", i)])
+    schemas[EVENT_ARGUMENTS] = pa.schema([ \
+                ("doc_id", s), ("event_id", s), ("event_type", d), ("arg_index", i),
+                ("role", d), ("tb_id", s), ("type", d), ("subtype", d)])
+    schemas[RELATIONS] = pa.schema([ \
+                ("doc_id", s), ("relation_id", s), ("role", d),
+                ("arg1_tb_id", s), ("arg2_tb_id", s), ("arg1_type", d), ("arg2_type", d)])
+
+    return schemas
+
+
+class TokenIndex(object):
+    '''
+    Maps character spans to document-level token indices and sentence indices
+    by bisection over the token offsets of a document
+    '''
+
+    def __init__(self, token_offsets):
+
+        self.starts = []
+        self.ends = []
+        self.sent_starts = []
+        for sent in token_offsets:
+            self.sent_starts.append(len(self.starts))
+            for start, end in sent:
+                self.starts.append(start)
+                self.ends.append(end)
+
+    def span(self, char_start, char_end):
+        '''
+        (sent_index, token_start, token_end) of the tokens overlapping span,
+        with token_end exclusive, or Nones if span does not overlap any token
+        '''
+
+        # first token ending after start and first token starting at or after end
+        token_start = bisect.bisect_right(self.ends, char_start)
+        token_end = bisect.bisect_left(self.starts, char_end)
+
+        if token_start >= token_end:
+            return (None, None, None)
+
+        sent_index = bisect.bisect_right(self.sent_starts, token_start) - 1
+
+        return (sent_index, token_start, token_end)
+
+
+def add_row(table, **values):
+    for k, v in values.items():
+        table[k].append(v)
+
+def doc_rows(doc, tables):
+    '''
+    Append rows for document doc to tables (dictionary of column lists by table)
+    '''
+
+    id = doc.id
+
+    tokens = getattr(doc, "tokens", None)
+    token_offsets = getattr(doc, "token_offsets", None)
+    if (tokens is None) or (token_offsets is None):
+        tokens = []
+        token_offsets = []
+        token_index = None
+    else:
+        token_index = TokenIndex(token_offsets)
+
+    add_row(tables[DOCUMENTS],
+                doc_id = id,
+                text = doc.text,
+                tags = sorted(doc.tags),
+                char_count = len(doc.text),
+                sentence_count = len(tokens),
+                token_count = sum(map(len, tokens)))
+
+    token_start = 0
+    for i, (sent, offsets) in enumerate(zip(tokens, token_offsets)):
+        add_row(tables[SENTENCES],
+                doc_id = id,
+                sent_index = i,
+                char_start = offsets[0][0] if offsets else None,
+                char_end = offsets[-1][1] if offsets else None,
+                token_start = token_start,
+                token_end = token_start + len(sent),
+                tokens = list(sent))
+        token_start += len(sent)
+
+    for tb_id, tb in doc.tb_dict.items():
+
+        attr = doc.attr_dict.get(tb_id)
+
+        if token_index is None:
+            sent_index, start, end = (None, None, None)
+        else:
+            sent_index, start, end = token_index.span(tb.start, tb.end)
+
+        add_row(tables[TEXTBOUNDS],
+                doc_id = id,
+                tb_id = tb_id,
+                type = tb.type_,
+                subtype = None if attr is None else attr.value,
+                char_start = tb.start,
+                char_end = tb.end,
+                text = tb.text,
+                sent_index = sent_index,
+                token_start = start,
+                token_end = end)
+
+    for tb_id, attr in doc.attr_dict.items():
+        add_row(tables[ATTRIBUTES],
+                doc_id = id,
+                attr_id = attr.id,
+                tb_id = attr.textbound,
+                type = attr.type_,
+                value = attr.value)
+
+    for event_id, event in doc.event_dict.items():
+
+        _, trigger_tb_id = event.get_trigger()
+        add_row(tables[EVENTS],
+                doc_id = id,
+                event_id = event_id,
+                type = event.type_,
+                trigger_tb_id = trigger_tb_id,
+                argument_count = len(event.arguments))
+
+        for i, (role, tb_id) in enumerate(event.arguments.items()):
+            tb = doc.tb_dict[tb_id]
+            attr = doc.attr_dict.get(tb_id)
+            add_row(tables[EVENT_ARGUMENTS],
+                doc_id = id,
+                event_id = event_id,
+                event_type = event.type_,
+                arg_index = i,
+                role = role,
+                tb_id = tb_id,
+                type = tb.type_,
+                subtype = None if attr is None else attr.value)
+
+    for relation_id, relation in doc.relation_dict.items():
+        add_row(tables[RELATIONS],
+                doc_id = id,
+                relation_id = relation.id,
+                role = relation.role,
+                arg1_tb_id = relation.arg1,
+                arg2_tb_id = relation.arg2,
+                arg1_type = doc.tb_dict[relation.arg1].type_,
+                arg2_type = doc.tb_dict[relation.arg2].type_)
+
+def corpus_tables(docs):
+    '''
+    Flatten documents into Arrow tables
+
+    returns dictionary of pyarrow.Table by table name (see TABLES)
+    '''
+
+    check_pyarrow()
+
+    schemas = get_schemas()
+
+    tables = OrderedDict()
+    for name, schema in schemas.items():
+        tables[name] = OrderedDict([(field.name, []) for field in schema])
+
+    for doc in docs:
+        doc_rows(doc, tables)
+
+    for name, schema in schemas.items():
+        tables[name] = pa.Table.from_pydict(tables[name], schema=schema)
+
+    return tables
+
+def write_parquet(docs, path, compression='zstd'):
+    '''
+    Write documents as Parquet files, one per table, to directory path
+
+    returns dictionary of file names by table name
+    '''
+
+    if not os.path.exists(path):
+        os.makedirs(path)
+
+    files = OrderedDict()
+    for name, table in corpus_tables(docs).items():
+        f = os.path.join(path, f"{name}.{PARQUET_EXT}")
+        pq.write_table(table, f, compression=compression)
+        files[name] = f
+
+    return files
+
+def read_parquet(path, tables=None, columns=None, memory_map=True):
+    '''
+    Read Parquet tables written by write_parquet as DataFrames
+
+    Dictionary-encoded columns are read as pandas categoricals.
+
+    Parameters
+    ----------
+    tables: list of table names. None will read all tables
+    columns: dictionary of column lists by table name, to read a subset of columns
+    '''
+
+    check_pyarrow()
+
+    if tables is None:
+        tables = TABLES
+    if columns is None:
+        columns = {}
+
+    dfs = OrderedDict()
+    for name in tables:
+        if name not in TABLES:
+            raise ValueError(f"Invalid table: {name}. Valid tables: {TABLES}")
+        f = os.path.join(path, f"{name}.{PARQUET_EXT}")
+        table = pq.read_table(f, columns=columns.get(name), memory_map=memory_map)
+        dfs[name] = table.to_pandas()
+
+    return dfs
+
+
+def as_object(x):
+    '''
+    Categorical or string column as objects, with missing values as None
+    '''
+    return x.astype(object).where(x.notna(), None)
+
+def count_rows(df, columns):
+    df = pd.DataFrame(OrderedDict([(c, as_object(df[c])) for c in columns]))
+    return df.groupby(columns, sort=False, dropna=False).size().reset_index(name="count")
+
+def span_histogram(textbounds, entity_types=None):
+    '''
+    Span histogram (as CorpusBrat.span_histogram) from the textbounds table
+    '''
+
+    df = textbounds
+    if entity_types is not None:
+        df = df[df["type"].isin(entity_types)]
+
+    df = df.assign(text=df["text"].str.lower())
+    df = count_rows(df, ["type", "subtype", "text"])
+    df.sort_values('count', ascending=False, inplace=True)
+
+    return df
+
+def label_summary(tables):
+    '''
+    Label summary (as CorpusBrat.label_summary) from the textbounds,
+    relations, and event_arguments tables
+    '''
+
+    sources = [(TEXTBOUNDS, ["type", "subtype"]),
+               (RELATIONS, ["arg1_type", "arg2_type", "role"]),
+               (EVENT_ARGUMENTS, ["event_type", "type", "subtype"])]
+
+    dfs = OrderedDict()
+    for (k, columns), (table, source_columns) in zip(LABEL_COLUMNS.items(), sources):
+        df = count_rows(tables[table], source_columns)
+        df.columns = columns
+        dfs[k] = df
+
+    return dfs
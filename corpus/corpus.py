@@ -4,15 +4,17 @@ import os
 import traceback
 from collections import Counter, OrderedDict
 
-import pandas as pd
-from sklearn.model_selection import train_test_split
-
 from config.constants import DEV, ENCODING, ID, SUBSET, TEST, TRAIN
 from corpus.brat import write_ann, write_txt
 from corpus.document import Document
 from corpus.tokenization import get_tokens
+from utils.lazy_import import lazy_import
 from utils.random_sample import random_sample
 
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+model_selection = lazy_import('sklearn.model_selection')
+
 
 def batch_documents(doc):
     '''
@@ -36,6 +38,20 @@ def batch_documents(doc):
         raise e
 
 
+def length_histogram(lengths, name):
+    '''
+    Histogram of lengths as data frame with columns name and "count",
+    including only observed lengths, sorted by length
+    '''
+
+    counts = np.bincount(np.asarray(lengths, dtype=np.int64))
+    values = np.flatnonzero(counts)
+
+    df = pd.DataFrame({name: values, "count": counts[values]})
+
+    return df
+
+
 def include_keep(tags, include):
 
     # assume keep is true by default
@@ -240,22 +256,29 @@ class Corpus:
 
         return df
 
-    def histogram(self, tokenizer, path=None, include=None, exclude=None):
+    def histogram(self, tokenizer=None, path=None, include=None, exclude=None):
+        '''
+        Sentence and document length histograms
+
+        Lengths are taken from the tokens stored on documents (e.g. DocumentBrat
+        imported with a tokenizer). tokenizer is only needed for documents
+        without stored tokens, which are tokenized on the fly.
+        '''
 
-        sent_lengths = Counter()
-        doc_lengths = Counter()
+        sent_lengths = []
+        doc_lengths = []
         for doc in self.docs(as_dict=False, include=include, exclude=exclude):
-            tokens = get_tokens(doc.text, tokenizer)
 
-            for sent in tokens:
-                sent_lengths[len(sent)] += 1
-            doc_lengths[len(tokens)] += 1
+            tokens = getattr(doc, "tokens", None)
+            if tokens is None:
+                assert tokenizer is not None, f"tokenizer needed for document without tokens: {doc.id}"
+                tokens = get_tokens(doc.text, tokenizer)
 
-        df_sent = pd.DataFrame(sent_lengths.items(), columns=["sentence_length", "count"])
-        df_sent.sort_values("sentence_length", ascending=True, inplace=True)
+            sent_lengths.extend(map(len, tokens))
+            doc_lengths.append(len(tokens))
 
-        df_doc = pd.DataFrame(doc_lengths.items(), columns=["document_length", "count"])
-        df_doc.sort_values("document_length", ascending=True, inplace=True)
+        df_sent = length_histogram(sent_lengths, "sentence_length")
+        df_doc = length_histogram(doc_lengths, "document_length")
 
         if path is not None:
             f = os.path.join(path, "sentence_lengths.csv")
@@ -289,12 +312,12 @@ class Corpus:
             assert total_size == 1.0, total_size
 
 
-            ids_train, ids_dev_test = train_test_split(ids, \
+            ids_train, ids_dev_test = model_selection.train_test_split(ids, \
                                         test_size = 1 - train_size,
                                         random_state = random_state,
                                         shuffle = shuffle)
 
-            ids_dev, ids_test = train_test_split(ids_dev_test, \
+            ids_dev, ids_test = model_selection.train_test_split(ids_dev_test, \
                                         test_size = test_size/(test_size + dev_size),
                                         random_state = random_state,
                                         shuffle = shuffle)
@@ -1,13 +1,12 @@
 
 
-import pandas as pd
 from tqdm import tqdm
 import os
 import re
 from collections import OrderedDict, Counter
+import csv
 import logging
 import json
-import spacy
 import string
 
 # import matplotlib as mpl
@@ -19,26 +18,54 @@ from spert_utils.spert_io import spert2doc_dict, spert_doc2brat_dicts, spert_doc
 from config.constants import ENCODING, ARG_1, ARG_2, ROLE, TYPE, SUBTYPE, EVENT_TYPE, ENTITIES, COUNT, RELATIONS, EVENTS
 from config.constants import SPACY_MODEL
 from corpus.corpus import Corpus
-from corpus.document_brat import DocumentBrat
+from corpus.document_brat import DocumentBrat, QC_COLUMNS, get_annotator
 from corpus.brat import get_brat_files, get_unique_arg, get_files, TEXT_FILE_EXT
+from corpus.columnar import write_parquet
+from corpus.statistics import (
+    ANNOTATION_SUMMARY,
+    LABEL_SUMMARY,
+    SPAN_HISTOGRAM,
+    SPAN_HISTOGRAM_FILE,
+    corpus_statistics,
+    counter2df,
+)
+from corpus.tokenization import get_pipeline
 from utils.proj_setup import make_and_clear
+from utils.lazy_import import lazy_import
 
+pd = lazy_import('pandas')
 
 
-def counter2df(counter, columns=None):
 
-    X = []
+def quality_check_doc(doc, annotator_position=None, labeled_arguments=None,
+                    required_arguments=None):
+    '''
+    Quality check rows for a single document, sorted by line
+    '''
 
-    for k, counts in counter.items():
-        if isinstance(k, (list, tuple)):
-            k = list(k)
-        else:
-            k = [k]
-        X.append(k + [counts])
+    rows = doc.quality_check_rows( \
+                    annotator_position = annotator_position,
+                    labeled_arguments = labeled_arguments,
+                    required_arguments = required_arguments)
+
+    # stable sort, so checks on the same line keep their order
+    rows.sort(key=lambda row: row[2])
+
+    return rows
 
-    df = pd.DataFrame(X, columns=columns)
+def quality_check_docs(docs, annotator_position=None, labeled_arguments=None,
+                    required_arguments=None):
+    '''
+    Generate quality check rows by document, in the order of docs
+
+    Documents are checked serially, as the checks are cheap relative to
+    process startup and pickling documents to worker processes
+    (see benchmarks/benchmark_quality_check.py)
+    '''
+
+    for doc in docs:
+        yield quality_check_doc(doc, annotator_position, labeled_arguments, required_arguments)
 
-    return df
 
 class CorpusBrat(Corpus):
 
@@ -47,6 +74,9 @@ class CorpusBrat(Corpus):
         self.document_class = document_class
         self.spacy_model = spacy_model
 
+        # original text and offset map by document id, for section extraction
+        self.section_maps = OrderedDict()
+
         Corpus.__init__(self)
 
 
@@ -56,7 +86,7 @@ class CorpusBrat(Corpus):
                         ann_map = None,
                         tag_function = None):
 
-        tokenizer = spacy.load(self.spacy_model)
+        tokenizer = get_pipeline(self.spacy_model)
 
         '''
         Import BRAT directory
@@ -127,12 +157,17 @@ class CorpusBrat(Corpus):
         pbar.close()
 
     def import_text_dir(self, path, \
-                        n = None):
+                        n = None,
+                        section_locator = None):
 
-        tokenizer = spacy.load(self.spacy_model)
+        tokenizer = get_pipeline(self.spacy_model)
 
         '''
-        Import BRAT directory
+        Import directory of text files
+
+        section_locator: SectionLocator for keeping only matching sections
+            (e.g. social history). The original text and offset map of each
+            document are saved in section_maps, for map_to_original
         '''
 
         # Find text and annotation files
@@ -167,6 +202,15 @@ class CorpusBrat(Corpus):
             # Use filename as ID
             id = os.path.splitext(os.path.relpath(fn_txt, path))[0]
 
+            # extract sections
+            if section_locator is not None:
+                section_text, offset_map = section_locator.extract(text)
+                if section_text is None:
+                    pbar.update(1)
+                    continue
+                self.section_maps[id] = (text, offset_map)
+                text = section_text
+
             # create document
             doc = self.document_class( \
                 id = id,
@@ -184,6 +228,25 @@ class CorpusBrat(Corpus):
 
         pbar.close()
 
+    def map_to_original(self, section_maps):
+        '''
+        Map documents created from extracted sections back to original text
+
+        section_maps: dict of document id -> (original text, OffsetMap),
+            i.e. section_maps of the corpus created with import_text_dir
+        '''
+
+        count = 0
+        for doc in self.docs():
+            if doc.id in section_maps:
+                original_text, offset_map = section_maps[doc.id]
+                doc.map_to_original(original_text, offset_map)
+                count += 1
+
+        logging.info(f"Mapped {count} of {self.doc_count()} documents to original text")
+
+        return count
+
     def sentence_count(self, include=None, exclude=None):
 
         count = 0
@@ -300,90 +363,132 @@ class CorpusBrat(Corpus):
     def quality_check(self, path=None, annotator_position=None,
                     labeled_arguments=None, required_arguments=None,
                     id_pattern=None,
-                    include=None, exclude=None):
-
-        dfs = []
-        for doc in self.docs(as_dict=False, include=include, exclude=exclude):
-            df = doc.quality_check( \
-                            annotator_position = annotator_position,
-                            labeled_arguments = labeled_arguments,
-                            required_arguments = required_arguments)
+                    include=None, exclude=None,
+                    return_df=True):
+        '''
+        Check annotations for unconnected arguments, missing labels, and missing
+        required arguments
 
-            dfs.append(df)
+        Documents are checked in order of annotator and id, and rows are streamed to quality_check_all.csv and, one
+        annotator at a time, to quality_check_<annotator>.xlsx, so only the
+        rows of the current annotator are held in memory unless return_df is True.
+        '''
 
-        df = pd.concat(dfs, axis=0)
-        df = df.sort_values(["annotator", "id", "line"], ascending=True)
+        docs = self.docs(as_dict=False, include=include, exclude=exclude)
 
+        # id pattern only depends on document id, so filter before checking
         if id_pattern is not None:
-            df["keep"] = df["id"].apply(lambda x: bool(re.search(id_pattern, x)))
-            df = df[df["keep"]]
-            del df["keep"]
+            docs = [doc for doc in docs if re.search(id_pattern, doc.id)]
 
+        # sort documents, so rows are ordered by annotator, id, and line
+        docs = sorted(docs, key=lambda doc: (get_annotator(doc.id, annotator_position), doc.id))
 
+        all_rows = []
+        annotator_rows = []
+        annotator = None
 
+        csv_file = None
+        csv_writer = None
         if path is not None:
             f = os.path.join(path, "quality_check_all.csv")
-            df.to_csv(f, index=False)
+            csv_file = open(f, 'w', newline='', encoding=ENCODING)
+            csv_writer = csv.writer(csv_file, lineterminator='\n')
+            csv_writer.writerow(QC_COLUMNS)
 
-            annotators = df["annotator"].unique()
-            for annotator in annotators:
-                df_temp = df[df["annotator"] == annotator]
+        def write_annotator(annotator, rows):
+            if (path is not None) and rows:
                 #f = os.path.join(path, f"quality_check_{annotator}.csv")
                 #df_temp.to_csv(f, index=False)
 
+                df_temp = pd.DataFrame(rows, columns=QC_COLUMNS)
                 f = os.path.join(path, f"quality_check_{annotator}.xlsx")
                 df_temp.to_excel(f, engine='openpyxl',
                             index=False,
                             freeze_panes=(1,1))
 
+        try:
+            for doc, rows in zip(docs, quality_check_docs(docs, \
+                                        annotator_position = annotator_position,
+                                        labeled_arguments = labeled_arguments,
+                                        required_arguments = required_arguments)):
+
+                doc_annotator = get_annotator(doc.id, annotator_position)
+                if doc_annotator != annotator:
+                    write_annotator(annotator, annotator_rows)
+                    annotator = doc_annotator
+                    annotator_rows = []
+
+                if csv_writer is not None:
+                    csv_writer.writerows(rows)
+                annotator_rows.extend(rows)
+                if return_df:
+                    all_rows.extend(rows)
+
+            write_annotator(annotator, annotator_rows)
+
+        finally:
+            if csv_file is not None:
+                csv_file.close()
+
+        if return_df:
+            return pd.DataFrame(all_rows, columns=QC_COLUMNS)
+        return None
+
+    def statistics(self, path=None, statistics=None, entity_types=None, \
+                            span_filename=SPAN_HISTOGRAM_FILE, n_jobs=1,
+                            include=None, exclude=None):
+        '''
+        Compute any subset of the annotation summary, label summary, tag summary,
+        span histogram, word count, and sentence count in a single pass over the
+        documents, optionally sharded across n_jobs processes
 
-        return df
+        Parameters
+        ----------
+        statistics: list of statistics from corpus.statistics.STATISTICS. None will compute all
+        entity_types: entity types to include in the span histogram
 
-    def annotation_summary(self, path=None, include=None, exclude=None):
+        returns dictionary of statistics by name. CSV outputs are written to path,
+        with the same file names as the individual methods
+        '''
 
-        counter = Counter()
-        for doc in self.docs(as_dict=False, include=include, exclude=exclude):
-            counter += doc.annotation_summary()
+        stats = corpus_statistics( \
+                        docs = self.docs(as_dict=False, include=include, exclude=exclude),
+                        statistics = statistics,
+                        entity_types = entity_types,
+                        n_jobs = n_jobs)
 
-        df = counter2df(counter)
+        results = stats.results()
 
         if path is not None:
-            f = os.path.join(path, "annotation_summary.csv")
-            df.to_csv(f)
+            stats.write(path, results=results, span_filename=span_filename)
 
-        return df
+        return results
 
-    def label_summary(self, path=None, include=None, exclude=None):
+    def to_parquet(self, path, compression='zstd', include=None, exclude=None):
+        '''
+        Export documents, sentences, textbounds, attributes, events, event arguments,
+        and relations as Parquet tables (requires pyarrow). See corpus.columnar
+        '''
 
-        counters = OrderedDict()
-        for doc in self.docs(as_dict=False, include=include, exclude=exclude):
-            counters_doc = doc.label_summary()
-
-            for k, v in counters_doc.items():
-                if k not in counters:
-                    counters[k] = Counter()
-                counters[k] += v
-
-        dfs = OrderedDict()
-        for k, v in counters.items():
-            if k == ENTITIES:
-                columns = [TYPE, SUBTYPE, COUNT]
-            elif k == RELATIONS:
-                columns = [ARG_1, ARG_2, ROLE, COUNT]
-            elif k == EVENTS:
-                columns = [EVENT_TYPE, TYPE, SUBTYPE, COUNT]
-            else:
-                columns = None
+        files = write_parquet(self.docs(as_dict=False, include=include, exclude=exclude), path, \
+                                                    compression = compression)
+        logging.info(f"Parquet tables saved: {path}")
 
-            dfs[k] = counter2df(v, columns=columns)
+        return files
 
+    def annotation_summary(self, path=None, include=None, exclude=None):
 
-        if path is not None:
-            for k, df in dfs.items():
-                f = os.path.join(path, f"label_summary_{k}.csv")
-                df.to_csv(f)
+        results = self.statistics(path=path, statistics=[ANNOTATION_SUMMARY], \
+                                                include=include, exclude=exclude)
 
-        return dfs
+        return results[ANNOTATION_SUMMARY]
+
+    def label_summary(self, path=None, include=None, exclude=None):
+
+        results = self.statistics(path=path, statistics=[LABEL_SUMMARY], \
+                                                include=include, exclude=exclude)
+
+        return results[LABEL_SUMMARY]
 
     def write_brat(self, path, include=None, exclude=None, \
                                 event_types=None, argument_types=None):
@@ -469,27 +574,16 @@ class CorpusBrat(Corpus):
 
         return df
 
-    def span_histogram(self, path=None, filename="span_histogram.csv", entity_types=None):
-
-        entities = self.entities(entity_types=entity_types)
+    def span_histogram(self, path=None, filename=SPAN_HISTOGRAM_FILE, entity_types=None, \
+                                include=None, exclude=None):
 
-        counter = Counter()
-        for doc in entities:
-            for entity in doc:
-                assert (entity_types is None) or (entity.type_ in entity_types)
-                text = entity.text.lower()
-                counter[(entity.type_, entity.subtype, text)] += 1
+        results = self.statistics(path=path, statistics=[SPAN_HISTOGRAM], \
+                                                entity_types = entity_types,
+                                                span_filename = filename,
+                                                include = include,
+                                                exclude = exclude)
 
-        counts = [(type, subtype, text, count) for (type, subtype, text), count in counter.items()]
-        df = pd.DataFrame(counts, columns=["type", "subtype", "text", "count"])
-
-        df.sort_values('count', ascending=False, inplace=True)
-
-        fn = os.path.join(path, filename)
-        df.to_csv(fn)
-
-
-        return df
+        return results[SPAN_HISTOGRAM]
 
     def transfer_subtype_value(self, argument_pairs, include=None, exclude=None, path=None):
 
@@ -513,7 +607,7 @@ class CorpusBrat(Corpus):
 
 
 
-        tokenizer = spacy.load(self.spacy_model)
+        tokenizer = get_pipeline(self.spacy_model)
 
 
         spert_doc_dict = spert2doc_dict(path)
@@ -574,7 +668,7 @@ class CorpusBrat(Corpus):
 
 
 
-        tokenizer = spacy.load(self.spacy_model)
+        tokenizer = get_pipeline(self.spacy_model)
 
 
         spert_doc_dict = spert2doc_dict(path)
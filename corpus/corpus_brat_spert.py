@@ -1,8 +1,7 @@
-import spacy
-
 from corpus.corpus_brat import CorpusBrat
 from corpus.document_brat_spert import DocumentBratSpert
 from spert_utils.spert_io import spert2doc_dict, spert_doc2brat_dicts
+from corpus.tokenization import get_pipeline
 from config.constants import SPACY_MODEL
 
 class CorpusBratSpert(CorpusBrat):
@@ -17,7 +16,7 @@ class CorpusBratSpert(CorpusBrat):
 
 
 
-        tokenizer = spacy.load(self.spacy_model)
+        tokenizer = get_pipeline(self.spacy_model)
 
 
         spert_doc_dict = spert2doc_dict(path)
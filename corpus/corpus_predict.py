@@ -1,9 +1,6 @@
 from collections import OrderedDict
 
 
-import matplotlib as mpl
-mpl.use('Agg')
-
 
 
 class CorpusPredict():
@@ -1,10 +1,10 @@
+import bisect
 import logging
 import os
+import re
 import string
 from collections import Counter, OrderedDict
 
-import pandas as pd
-
 from config.constants import (
     ARGUMENTS,
     ATTRIBUTE,
@@ -18,10 +18,9 @@ from config.constants import (
 )
 from corpus.brat import (
     Attribute,
+    IdAllocator,
     Textbound,
     get_annotations,
-    get_max_id,
-    get_next_index,
     get_unique_arg,
     write_ann,
     write_txt,
@@ -30,6 +29,9 @@ from corpus.document import Document
 from corpus.labels import brat2events, tb2entities, tb2relations
 from corpus.tokenization import remove_white_space_at_ends
 from spert_utils.spert_io import doc2spert, doc2spert_multi
+from utils.lazy_import import lazy_import
+
+pd = lazy_import('pandas')
 
 #from spert_utils.convert_brat import
 
@@ -67,11 +69,34 @@ def non_white_space_check(x, y):
     assert x == y, '''"{}" vs "{}"'''.format(x, y)
 
 
-def get_line(index, text):
-    return  1 + text[:index].count('\n')
+QC_COLUMNS = ["annotator", "id", "line", "argument", "text", "message"]
+
+
+def get_line_index(text):
+    '''
+    Character offsets of the newlines in text, for resolving line numbers with get_line
+    '''
+    return [m.start() for m in re.finditer('\n', text)]
+
+def get_line(index, text, line_index=None):
+    '''
+    Line number (1-based) of character index in text
+
+    If line_index (from get_line_index) is provided, the line is found by
+    bisection instead of scanning the text prefix
+    '''
+    if line_index is None:
+        return  1 + text[:index].count('\n')
+    return 1 + bisect.bisect_left(line_index, index)
+
+def get_annotator(id, annotator_position=None):
+    if annotator_position is None:
+        return "unknown"
+    return id.split(os.sep)[annotator_position]
 
 def find_tb_not_in_events(tb_dict, event_dict, text, id, annotator,
-                                message = 'Argument not connected to an event'):
+                                message = 'Argument not connected to an event',
+                                line_index = None):
 
 
     # get a set of all tb in events
@@ -88,20 +113,21 @@ def find_tb_not_in_events(tb_dict, event_dict, text, id, annotator,
     output = []
     for tb_id in not_found:
         tb = tb_dict[tb_id]
-        line_number = get_line(tb.start, text)
+        line_number = get_line(tb.start, text, line_index)
         output.append((annotator, id, line_number, tb.type_, tb.text, message))
 
     return output
 
 def find_missing_arguments(tb_dict, event_dict, text, required_arguments, id, annotator,
-                                message = 'Event is missing required argument'):
+                                message = 'Event is missing required argument',
+                                line_index = None):
 
     output = []
     for event in event_dict.values():
         if event.type_ in required_arguments:
             _, tb_id = event.get_trigger()
             tb = tb_dict[tb_id]
-            line_number = get_line(tb.start, text)
+            line_number = get_line(tb.start, text, line_index)
             for argument in required_arguments[event.type_]:
                 if argument not in event.arguments:
                     output.append((annotator, id, line_number, argument, '--', message))
@@ -110,7 +136,8 @@ def find_missing_arguments(tb_dict, event_dict, text, required_arguments, id, an
 
 
 def find_missing_labels(tb_dict, attr_dict, text, labeled_arguments, id, annotator,
-                                message = 'Argument missing a label'):
+                                message = 'Argument missing a label',
+                                line_index = None):
     if labeled_arguments is None:
         return []
 
@@ -122,7 +149,7 @@ def find_missing_labels(tb_dict, attr_dict, text, labeled_arguments, id, annotat
     output = []
     for tb_id in not_found:
         tb = tb_dict[tb_id]
-        line_number = get_line(tb.start, text)
+        line_number = get_line(tb.start, text, line_index)
         output.append((annotator, id, line_number, tb.type_, tb.text, message))
 
     return output
@@ -234,6 +261,23 @@ class DocumentBrat(Document):
             self.tb_dict = tb_dict
             self.attr_dict = attr_dict
 
+        self.id_allocator = None
+
+
+    def next_id(self, prefix):
+        '''
+        Allocate a new annotation ID with prefix (T, E, A, or R)
+        '''
+
+        # documents pickled before allocators were added lack the attribute
+        if getattr(self, 'id_allocator', None) is None:
+            self.id_allocator = IdAllocator({ \
+                                    'T': self.tb_dict,
+                                    'E': self.event_dict,
+                                    'A': self.attr_dict,
+                                    'R': self.relation_dict})
+
+        return self.id_allocator.next(prefix)
 
     def sentence_count(self):
         return len(self.tokens)
@@ -388,21 +432,26 @@ class DocumentBrat(Document):
 
         return (fn_text, fn_ann)
 
-    def quality_check(self, annotator_position=None, labeled_arguments=None,
+    def quality_check_rows(self, annotator_position=None, labeled_arguments=None,
                     required_arguments=None):
-        rows = []
+        '''
+        Quality check rows (annotator, id, line, argument, text, message)
+        '''
 
-        if annotator_position is None:
-            annotator = "unknown"
-        else:
-            annotator = self.id.split(os.sep)[annotator_position]
+        annotator = get_annotator(self.id, annotator_position)
+
+        # newline offsets, so line numbers are found by bisection
+        line_index = get_line_index(self.text)
+
+        rows = []
 
         r = find_tb_not_in_events( \
                         tb_dict = self.tb_dict,
                         event_dict = self.event_dict,
                         text = self.text,
                         id = self.id,
-                        annotator = annotator)
+                        annotator = annotator,
+                        line_index = line_index)
         rows.extend(r)
 
         r = find_missing_labels( \
@@ -411,7 +460,8 @@ class DocumentBrat(Document):
                         text = self.text,
                         labeled_arguments = labeled_arguments,
                         id = self.id,
-                        annotator = annotator)
+                        annotator = annotator,
+                        line_index = line_index)
         rows.extend(r)
 
         r = find_missing_arguments( \
@@ -420,11 +470,21 @@ class DocumentBrat(Document):
                         text = self.text,
                         required_arguments = required_arguments,
                         id = self.id,
-                        annotator = annotator)
+                        annotator = annotator,
+                        line_index = line_index)
         rows.extend(r)
 
-        columns = ["annotator", "id", "line", "argument", "text", "message"]
-        df = pd.DataFrame(rows, columns=columns)
+        return rows
+
+    def quality_check(self, annotator_position=None, labeled_arguments=None,
+                    required_arguments=None):
+
+        rows = self.quality_check_rows( \
+                        annotator_position = annotator_position,
+                        labeled_arguments = labeled_arguments,
+                        required_arguments = required_arguments)
+
+        df = pd.DataFrame(rows, columns=QC_COLUMNS)
 
         return df
 
@@ -471,6 +531,21 @@ class DocumentBrat(Document):
         return counters
 
 
+    def map_to_original(self, original_text, offset_map):
+        '''
+        Map text bounds and token offsets from extracted section text to original text
+        '''
+
+        for tb in self.tb_dict.values():
+            tb.start, tb.end = offset_map.map_span(tb.start, tb.end)
+            tb.text = original_text[tb.start:tb.end]
+
+        if self.token_offsets is not None:
+            self.token_offsets = [[offset_map.map_span(start, end) for start, end in sent] \
+                                                        for sent in self.token_offsets]
+
+        self.text = original_text
+
     def snap_textbounds(self):
         '''
         Snap the textbound indices to the starts and ends of the associated tokens.
@@ -624,9 +699,6 @@ class DocumentBrat(Document):
         # iterate over events
         counter = Counter()
 
-        tb_index = get_next_index(self.tb_dict)
-        attr_index = get_next_index(self.attr_dict)
-
         tb_to_remove = set([])
 
         for event_id, event in self.event_dict.items():
@@ -677,8 +749,7 @@ class DocumentBrat(Document):
                 source_tb = self.tb_dict[source_tb_id]
                 target_tb = self.tb_dict[target_tb_id]
 
-                new_tb_id = f'T{tb_index}'
-                tb_index += 1
+                new_tb_id = self.next_id('T')
 
                 new_tb = Textbound( \
                                 id =     new_tb_id,
@@ -699,8 +770,7 @@ class DocumentBrat(Document):
                 if source_tb_id in self.attr_dict:
                     source_attr = self.attr_dict[source_tb_id]
 
-                    new_attr_id = f'A{attr_index}'
-                    attr_index += 1
+                    new_attr_id = self.next_id('A')
 
                     new_attr = Attribute( \
                                 id =        new_attr_id,
@@ -725,19 +795,22 @@ class DocumentBrat(Document):
 
         assert isinstance(argument_pairs, dict)
 
+        # dictionary map between argument types and textbound ids for each event,
+        # built once and shared across argument pairs
+        arg_type_to_tb_ids = OrderedDict()
+        for event_id, event in self.event_dict.items():
+            arg_type_to_tb_id = OrderedDict()
+            for arg_role, tb_id in event.arguments.items():
+                arg_type = self.tb_dict[tb_id].type_
+                arg_type_to_tb_id[arg_type] = tb_id
+            arg_type_to_tb_ids[event_id] = arg_type_to_tb_id
+
         # iterate over source - target arguments type pairs
         counts = Counter()
         for target_arg, source_arg in argument_pairs.items():
 
             # iterate over all events in document
-            for event_id, event in self.event_dict.items():
-
-                # to get dictionary map between argument types and textbound ids
-                arguments = event.arguments
-                arg_type_to_tb_id = OrderedDict()
-                for arg_role, tb_id in arguments.items():
-                    arg_type = self.tb_dict[tb_id].type_
-                    arg_type_to_tb_id[arg_type] = tb_id
+            for event_id, arg_type_to_tb_id in arg_type_to_tb_ids.items():
 
                 # check if both the source and target are present
                 if (source_arg in arg_type_to_tb_id) and \
@@ -752,8 +825,7 @@ class DocumentBrat(Document):
                         source_attr = self.attr_dict[source_tb]
                         source_value = source_attr.value
 
-                        attr_id = get_max_id(self.attr_dict)+1
-                        attr_id = f"A{attr_id}"
+                        attr_id = self.next_id('A')
 
                         attr_ob = Attribute( \
                                 id =        attr_id,
@@ -762,7 +834,7 @@ class DocumentBrat(Document):
                                 value =     source_value)
 
                         if target_tb in self.attr_dict:
-                            logging.warn(f"target text bound in attr_dict: {target_tb} in {self.attr_dict.keys()}")
+                            logging.warn(f"target text bound in attr_dict: {target_tb}")
                         self.attr_dict[target_tb] = attr_ob
 
                         counts[(target_arg, source_value)] += 1
@@ -2,14 +2,18 @@ import copy
 import logging
 from collections import OrderedDict
 
-import pandas as pd
-
 from config.constants import TRIGGER
 from corpus.utils import remove_white_space_at_ends
+from utils.lazy_import import when_loaded
+
+
+def set_display_options(pd):
+    pd.set_option('display.max_rows', 500)
+    pd.set_option('display.max_columns', 500)
+    pd.set_option('display.width', 1000)
 
-pd.set_option('display.max_rows', 500)
-pd.set_option('display.max_columns', 500)
-pd.set_option('display.width', 1000)
+# pandas imported lazily, so display options are applied on first use
+when_loaded('pandas', set_display_options)
 
 class Entity(object):
     '''
@@ -0,0 +1,312 @@
+import re
+
+'''
+Compiled-regex tokenizer and rule-based clinical sentence splitter
+
+A lightweight alternative to the spaCy pipeline for predict-only workloads.
+RegexTokenizer follows the spaCy tokenization scheme (whitespace split, then
+prefix/suffix/infix rules and special cases) and returns a Doc-like object
+exposing the attributes used by the tokenization functions in this
+repository (doc.sents, sent.text, sent.start_char, sent.end_char, token.text,
+token.idx), so it can be passed anywhere a spaCy tokenizer is expected:
+
+    tokenizer = RegexTokenizer()
+    sentences, offsets = tokenize_document(text, tokenizer)
+
+Sentence boundaries are placed:
+    - after sentence final punctuation followed by an upper case letter,
+      digit, or opening bracket/quote (on the same or the next line)
+    - at blank lines
+    - at line breaks preceding a section header (all caps or title case) or
+      list item, or following a line ending in a colon
+    - after inline section headers (e.g. "SOCIAL HISTORY:"), if split_headers
+'''
+
+NON_WHITESPACE = re.compile(r'\S+')
+
+# kept as single tokens
+SPECIAL_CASES = set([
+    "Dr.", "Drs.", "Mr.", "Mrs.", "Ms.", "Jr.", "Sr.", "St.", "Mt.", "vs.", "etc.",
+    "e.g.", "i.e.", "a.m.", "p.m.", "approx.", "appt.", "dept.", "no.", "No.",
+    "Jan.", "Feb.", "Mar.", "Apr.", "Jun.", "Jul.", "Aug.", "Sep.", "Sept.", "Oct.", "Nov.", "Dec.",
+    "Inc.", "Co.", "Corp.", "Ltd.",
+    ":)", ":(", ":-)", "<3", "...",
+    ])
+
+TOKEN_MATCH = re.compile(r'''^(?:https?://\S+|www\.\S+|[\w.+-]+@[\w-]+\.[\w.-]+|(?:[A-Za-z]\.){2,})$''')
+
+PREFIX = re.compile(r'''^(?:\.\.+|…|[\[\(\{<"'`“‘«$£€#&*~+=%§]|-(?=[^\d]))''')
+
+UNITS = r'km|cm|mm|m|kg|mg|mcg|g|lbs|lb|ml|mL|cc|l|L|oz'
+SUFFIX = re.compile(r'''(?:\.\.+|…|[\]\)\}>"'”’»,;:!?%°]|'s|'S|’s|n't|N'T|'ll|'re|'ve|'d|'m|'LL|'RE|'VE|'D|'M''' +
+                    r'''|(?<=[0-9])(?:''' + UNITS + r''')|(?<=[a-z0-9\)\]"'%+\-])\.|(?<=[A-Z][A-Z])\.)$''')
+
+INFIX = re.compile(r'''\.\.+|…|(?<=[0-9])[+\-*^](?=[0-9-])|(?<=[a-z'"])\.(?=[A-Z'"])''' +
+                    r'''|(?<=[A-Za-z]),(?=[A-Za-z])|(?<=[A-Za-z0-9])(?:---|--|-|–|—|~)(?=[A-Za-z])''' +
+                    r'''|(?<=[A-Za-z0-9])[:<>=/](?=[A-Za-z])''')
+
+SENT_END = set(['.', '!', '?', '...', '…', '!!', '??'])
+SENT_CLOSE = set([')', ']', '"', "'", '”', '’'])
+
+# all caps (e.g. "SOCIAL HISTORY:") or title case (e.g. "Tobacco:", "Drug Use:") header
+# matched at line starts with pattern.match(text, pos), so not anchored with ^
+HEADER = re.compile(r'''(?:[A-Z][A-Z0-9 /&,()'-]*[A-Z)]''' +
+                    r'''|[A-Z][a-z0-9]*(?:[ /&-]+(?:[A-Z][A-Za-z0-9]*|and|of|or)){0,3})\s*:''')
+LIST_ITEM = re.compile(r'''(?:[-*•]|\d{1,2}[.)]|[a-zA-Z][.)])\s''')
+
+
+class RegexToken(object):
+    '''
+    Token with the spaCy Token attributes used in this repository
+    '''
+    __slots__ = ['text', 'idx', 'i', 'is_sent_start']
+
+    def __init__(self, text, idx, i, is_sent_start=False):
+        self.text = text
+        self.idx = idx
+        self.i = i
+        self.is_sent_start = is_sent_start
+
+    def __len__(self):
+        return len(self.text)
+
+    def __str__(self):
+        return self.text
+
+    def __repr__(self):
+        return f'RegexToken({self.text!r}, idx={self.idx})'
+
+
+class RegexSpan(object):
+    '''
+    Sentence span with the spaCy Span attributes used in this repository
+    '''
+
+    def __init__(self, doc, start, end):
+        self.doc = doc
+        self.start = start
+        self.end = end
+
+    @property
+    def start_char(self):
+        return self.doc.tokens[self.start].idx
+
+    @property
+    def end_char(self):
+        token = self.doc.tokens[self.end - 1]
+        return token.idx + len(token.text)
+
+    @property
+    def text(self):
+        return self.doc.text[self.start_char:self.end_char]
+
+    def __iter__(self):
+        return iter(self.doc.tokens[self.start:self.end])
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __getitem__(self, i):
+        return self.doc.tokens[self.start:self.end][i]
+
+
+class RegexDoc(object):
+    '''
+    Tokenized document with the spaCy Doc attributes used in this repository
+    '''
+
+    def __init__(self, text, tokens, sent_starts):
+        self.text = text
+        self.tokens = tokens
+        self.sent_starts = sent_starts
+
+    @property
+    def sents(self):
+        bounds = self.sent_starts + [len(self.tokens)]
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            if end > start:
+                yield RegexSpan(self, start, end)
+
+    def __iter__(self):
+        return iter(self.tokens)
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def __getitem__(self, i):
+        return self.tokens[i]
+
+
+def split_affixes(chunk):
+    '''
+    Split whitespace delimited chunk into (start, end) token offsets relative to chunk
+    '''
+
+    start = 0
+    end = len(chunk)
+    prefixes = []
+    suffixes = []
+
+    # strip prefixes and suffixes, until special case or no match
+    while start < end:
+        s = chunk[start:end]
+        if (s in SPECIAL_CASES) or TOKEN_MATCH.match(s):
+            break
+
+        m = PREFIX.search(s)
+        if (m is not None) and (0 < m.end() < len(s)):
+            prefixes.append((start, start + m.end()))
+            start += m.end()
+            continue
+
+        m = SUFFIX.search(s)
+        if (m is not None) and (0 < m.start() < len(s)):
+            suffixes.append((start + m.start(), end))
+            end = start + m.start()
+            continue
+
+        break
+
+    # split infixes
+    middle = []
+    if start < end:
+        s = chunk[start:end]
+        if (s in SPECIAL_CASES) or TOKEN_MATCH.match(s):
+            middle.append((start, end))
+        else:
+            i = 0
+            for m in INFIX.finditer(s):
+                if m.start() == m.end() or m.start() == 0:
+                    continue
+                if m.start() > i:
+                    middle.append((start + i, start + m.start()))
+                middle.append((start + m.start(), start + m.end()))
+                i = m.end()
+            if i < len(s):
+                middle.append((start + i, end))
+
+    return prefixes + middle + suffixes[::-1]
+
+
+class RegexTokenizer(object):
+    '''
+    Regex tokenizer and rule-based sentence splitter
+
+    Parameters
+    ----------
+    split_headers: start a new sentence after inline section headers (e.g. "SOCIAL HISTORY:")
+    cache_size: maximum number of cached chunk splits
+    '''
+
+    def __init__(self, split_headers=False, cache_size=100000):
+        self.split_headers = split_headers
+        self.cache_size = cache_size
+        self.cache = {}
+
+    def tokenize(self, text):
+        '''
+        Tokenize text as list of (start, end) offsets, including whitespace tokens
+
+        As with spaCy, a single space following a token is not a token,
+        all other whitespace is.
+        '''
+
+        offsets = []
+        i = 0
+        for m in NON_WHITESPACE.finditer(text):
+
+            # whitespace before chunk
+            ws_start = i
+            if offsets and (m.start() > i) and (text[i] == ' '):
+                ws_start += 1
+            if m.start() > ws_start:
+                offsets.append((ws_start, m.start()))
+
+            chunk = m.group()
+            split = self.cache.get(chunk)
+            if split is None:
+                split = split_affixes(chunk)
+                if len(self.cache) >= self.cache_size:
+                    self.cache.clear()
+                self.cache[chunk] = split
+            offsets.extend([(m.start() + s, m.start() + e) for s, e in split])
+
+            i = m.end()
+
+        # trailing whitespace
+        ws_start = i
+        if offsets and (len(text) > i) and (text[i] == ' '):
+            ws_start += 1
+        if len(text) > ws_start:
+            offsets.append((ws_start, len(text)))
+
+        return offsets
+
+    def sent_starts(self, text, tokens):
+        '''
+        Indices of tokens that start a sentence
+        '''
+
+        starts = [0] if tokens else []
+
+        prev = None
+        for i, token in enumerate(tokens):
+            t = token.text
+
+            if t.isspace():
+                continue
+
+            if (prev is not None) and (starts[-1] != i):
+
+                between = text[tokens[prev].idx + len(tokens[prev].text):token.idx]
+                prev_text = tokens[prev].text
+
+                # sentence final punctuation, possibly followed by closing bracket/quote
+                sent_end = (prev_text in SENT_END) or \
+                     ((prev_text in SENT_CLOSE) and (prev > 0) and (tokens[prev - 1].text in SENT_END))
+                sent_end = sent_end and (t[0].isupper() or t[0].isdigit() or (t[0] in '([{"\'“‘'))
+
+                boundary = False
+
+                # blank line
+                if between.count('\n') > 1:
+                    boundary = True
+
+                # line break after sentence final punctuation or colon, or before header or list item
+                elif '\n' in between:
+                    line_start = text.rfind('\n', 0, token.idx) + 1
+                    boundary = sent_end or (prev_text == ':') or \
+                               (HEADER.match(text, line_start) is not None) or \
+                               (LIST_ITEM.match(text, line_start) is not None)
+
+                # sentence final punctuation
+                elif sent_end:
+                    boundary = True
+
+                # inline section header
+                elif self.split_headers and (prev_text == ':'):
+                    line_start = text.rfind('\n', 0, tokens[prev].idx) + 1
+                    boundary = HEADER.match(text, line_start, tokens[prev].idx + 1) is not None
+
+                if boundary:
+                    # leading whitespace tokens stay with the previous sentence
+                    starts.append(i)
+
+            prev = i
+
+        for i in starts:
+            tokens[i].is_sent_start = True
+
+        return starts
+
+    def __call__(self, text):
+
+        offsets = self.tokenize(text)
+        tokens = [RegexToken(text[s:e], s, i) for i, (s, e) in enumerate(offsets)]
+        starts = self.sent_starts(text, tokens)
+
+        return RegexDoc(text, tokens, starts)
+
+    def pipe(self, texts):
+        for text in texts:
+            yield self(text)
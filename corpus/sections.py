@@ -0,0 +1,300 @@
+import re
+from bisect import bisect_right
+from collections import OrderedDict
+
+'''
+Social history section locator
+
+Finds section headers in raw note text in a single pass and keeps only the
+social history sections, so inference runs on the text the model was
+trained on. An offset map records where each kept segment came from, so
+annotations predicted on the extracted text can be mapped back to the
+original note.
+
+Usage:
+    locator = SectionLocator()
+    section_text, offset_map = locator.extract(text)
+    ...
+    start, end = offset_map.map_span(start, end)
+
+With gold annotation spans (e.g. from BRAT files), extract also counts the
+annotations inside the kept text, and summary reports their recall (see
+benchmarks/benchmark_sections.py).
+'''
+
+# social history headers and common social history subsection headers
+SOCIAL_HISTORY_HEADERS = [
+    "social history", "social hx", "soc hx", "sh", "shx", "social",
+    "social and family history", "social/family history", "family and social history",
+    "family/social history", "psychosocial history", "personal history", "personal and social history",
+    "habits", "social habits", "substance use", "substance abuse", "substance use history",
+    "personal/social history", "health-related behaviors", "health related behaviors", "health habits",
+    "tobacco", "tobacco use", "tobacco history", "smoking", "smoking history", "smoking status",
+    "alcohol", "alcohol use", "etoh", "ethanol", "drugs", "drug use", "illicit drugs", "recreational drugs",
+    "occupation", "occupational history", "employment", "work", "work history",
+    "exposure", "exposures", "environmental exposure", "occupational exposure",
+    "living situation", "lives with", "living arrangements", "marital status", "sexual history",
+    ]
+
+# other note sections, which end a social history section even in title case
+# (e.g. "Family History:"). Other title case headers within a social history
+# section (e.g. "Children:", "Hobbies:") are treated as subsections
+OTHER_SECTION_HEADERS = [
+    "chief complaint", "cc", "reason for visit", "reason for consultation", "reason for referral",
+    "history of present illness", "hpi", "present illness", "history", "interval history",
+    "past medical history", "pmh", "past history", "medical history", "past surgical history", "psh",
+    "surgical history", "past medical/surgical history", "past medical and surgical history",
+    "family history", "fh", "fhx", "family hx",
+    "medications", "current medications", "medications on admission", "meds", "allergies", "drug allergies",
+    "review of systems", "ros", "systems review",
+    "physical examination", "physical exam", "exam", "examination", "pe", "vital signs", "vitals",
+    "general", "heent", "neck", "chest", "lungs", "heart", "cardiovascular", "abdomen", "extremities",
+    "neurologic", "neurological", "skin", "psychiatric",
+    "laboratory data", "laboratory", "labs", "imaging", "radiology", "studies", "diagnostic studies",
+    "assessment", "impression", "assessment and plan", "impression and plan", "plan", "a/p",
+    "diagnosis", "diagnoses", "recommendations", "disposition", "procedure", "procedures",
+    "hospital course", "immunizations", "pregnancy history", "obstetric history", "gynecologic history",
+    ]
+
+# header at line start (or after sentence final punctuation), either all caps
+# or title case, followed by a colon
+HEADER_RE = re.compile( \
+        r"(?:^|(?<=[.!?] )|(?<=[.!?]  ))[ \t]*" +
+        r"(?P<header>" +
+            r"[A-Z][A-Z0-9/&'()-]*(?:[ \t]+[A-Z0-9/&'()-]+){0,5}" +
+            r"|[A-Z][a-z0-9/&'()-]*(?:[ \t]+(?:[A-Z][A-Za-z0-9/&'()-]*|and|of|or|the|&)){0,5}" +
+        r")[ \t]*:", re.M)
+
+# all caps header on its own line
+HEADER_LINE_RE = re.compile(r"^[ \t]*(?P<header>[A-Z][A-Z0-9/&'()-]*(?:[ \t]+[A-Z0-9/&'()-]+){0,5})[ \t]*$", re.M)
+
+SEPARATOR = "\n\n"
+
+FALLBACK_FULL = "full"
+FALLBACK_DROP = "drop"
+
+DOCS = "docs"
+DOCS_WITH_SECTION = "docs_with_section"
+DOCS_FULL = "docs_kept_full"
+DOCS_DROPPED = "docs_dropped"
+SECTIONS = "sections"
+CHARS = "chars"
+CHARS_KEPT = "chars_kept"
+CHARS_DROPPED = "chars_dropped"
+FRACTION_DROPPED = "fraction_dropped"
+GOLD_SPANS = "gold_spans"
+GOLD_SPANS_KEPT = "gold_spans_kept"
+GOLD_RECALL = "gold_recall"
+
+
+def header_alternation(headers):
+    '''
+    Compiled alternation of headers, longest first, matched against normalized header text
+    '''
+    headers = sorted(set([normalize_header(h) for h in headers]), key=len, reverse=True)
+    return re.compile(r'(?:' + '|'.join([re.escape(h) for h in headers]) + r')$')
+
+
+def normalize_header(header):
+    header = ' '.join(header.lower().split())
+    return re.sub(r' ?/ ?', '/', header)
+
+
+def is_line_start(text, start):
+    line_start = text.rfind('\n', 0, start) + 1
+    return text[line_start:start].strip() == ''
+
+
+def is_all_caps(header):
+    return header.upper() == header
+
+
+def count_kept(spans, gold_spans):
+    '''
+    Number of gold spans (start, end) fully within a kept span
+    '''
+    starts = [s for s, _ in spans]
+    kept = 0
+    for start, end in gold_spans:
+        j = bisect_right(starts, start) - 1
+        if (j >= 0) and (end <= spans[j][1]):
+            kept += 1
+    return kept
+
+
+class OffsetMap(object):
+    '''
+    Map from extracted text offsets to original text offsets
+
+    segments: list of (extracted start, original start, length)
+    '''
+
+    def __init__(self, segments=None):
+        self.segments = [] if segments is None else segments
+        self.starts = [s[0] for s in self.segments]
+
+    def add(self, extracted_start, original_start, length):
+        self.segments.append((extracted_start, original_start, length))
+        self.starts.append(extracted_start)
+
+    def map_offset(self, i, end=False):
+        '''
+        Map extracted offset to original offset
+
+        Offsets in separators between segments map to the end of the
+        preceding segment. end indicates an exclusive end offset.
+        '''
+
+        if len(self.segments) == 0:
+            return i
+
+        j = bisect_right(self.starts, i - 1 if end else i) - 1
+        j = max(j, 0)
+        extracted_start, original_start, length = self.segments[j]
+        return original_start + min(max(i - extracted_start, 0), length)
+
+    def map_span(self, start, end):
+        return (self.map_offset(start), self.map_offset(end, end=True))
+
+
+class SectionLocator(object):
+    '''
+    Locate and extract social history sections
+
+    Parameters
+    ----------
+    headers: header names (case insensitive) that start a kept section
+    section_headers: other section names (case insensitive) that end a kept section
+        in title case. All caps headers end a kept section regardless
+    fallback: for documents without a kept section, FALLBACK_FULL keeps the
+        full text and FALLBACK_DROP drops the document
+    separator: text inserted between extracted sections
+    '''
+
+    def __init__(self, headers=SOCIAL_HISTORY_HEADERS, section_headers=OTHER_SECTION_HEADERS, \
+                        fallback=FALLBACK_FULL, separator=SEPARATOR):
+
+        assert fallback in [FALLBACK_FULL, FALLBACK_DROP]
+
+        self.header_re = header_alternation(headers)
+        self.section_header_re = header_alternation(section_headers)
+        self.fallback = fallback
+        self.separator = separator
+
+        self.stats = OrderedDict([(k, 0) for k in \
+                    [DOCS, DOCS_WITH_SECTION, DOCS_FULL, DOCS_DROPPED, SECTIONS, CHARS, CHARS_KEPT,
+                     GOLD_SPANS, GOLD_SPANS_KEPT]])
+
+    def headers(self, text):
+        '''
+        All section headers as list of (start, header, starts kept section, ends kept section)
+
+        Kept headers start a section if all caps or at line start, so inline
+        title case headers (e.g. "Work:" within HPI) do not. Other headers end
+        a kept section if all caps or known section names (e.g. "Family History:")
+        '''
+
+        found = {}
+        for pattern in [HEADER_RE, HEADER_LINE_RE]:
+            for m in pattern.finditer(text):
+                start = m.start('header')
+                header = m.group('header')
+                normalized = normalize_header(header)
+                caps = is_all_caps(header)
+                keep = self.header_re.match(normalized) is not None
+                opens = keep and (caps or is_line_start(text, start))
+                closes = (not keep) and (caps or (self.section_header_re.match(normalized) is not None))
+                found[start] = (start, header, opens, closes)
+
+        return [found[k] for k in sorted(found)]
+
+    def locate(self, text):
+        '''
+        Character spans of kept sections, from kept header to the next header
+        ending the section
+        '''
+
+        spans = []
+        for start, _, opens, closes in self.headers(text):
+
+            in_section = spans and (spans[-1][1] is None)
+
+            # close current section; other title case headers (e.g. "Children:")
+            # are subsections
+            if closes and in_section:
+                spans[-1][1] = start
+
+            # adjacent kept headers (e.g. "Tobacco:" within social history) extend the section
+            elif opens and not in_section:
+                spans.append([start, None])
+
+        if spans and (spans[-1][1] is None):
+            spans[-1][1] = len(text)
+
+        # trim trailing white space
+        spans = [(s, s + len(text[s:e].rstrip())) for s, e in spans]
+
+        return [(s, e) for s, e in spans if e > s]
+
+    def extract(self, text, gold_spans=None):
+        '''
+        Extract kept sections
+
+        gold_spans: optional list of gold annotation spans (start, end), counted
+            as kept if fully within the kept text, for summary recall
+
+        returns (extracted text, OffsetMap), or (None, None) if the document is dropped
+        '''
+
+        spans = self.locate(text)
+
+        self.stats[DOCS] += 1
+        self.stats[CHARS] += len(text)
+        self.stats[SECTIONS] += len(spans)
+
+        if gold_spans is not None:
+            self.stats[GOLD_SPANS] += len(gold_spans)
+
+        if len(spans) == 0:
+            if self.fallback == FALLBACK_DROP:
+                self.stats[DOCS_DROPPED] += 1
+                return (None, None)
+
+            self.stats[DOCS_FULL] += 1
+            self.stats[CHARS_KEPT] += len(text)
+            if gold_spans is not None:
+                self.stats[GOLD_SPANS_KEPT] += len(gold_spans)
+            return (text, OffsetMap([(0, 0, len(text))]))
+
+        self.stats[DOCS_WITH_SECTION] += 1
+        if gold_spans is not None:
+            self.stats[GOLD_SPANS_KEPT] += count_kept(spans, gold_spans)
+
+        offset_map = OffsetMap()
+        pieces = []
+        n = 0
+        for start, end in spans:
+            if pieces:
+                pieces.append(self.separator)
+                n += len(self.separator)
+            offset_map.add(n, start, end - start)
+            pieces.append(text[start:end])
+            n += end - start
+            self.stats[CHARS_KEPT] += end - start
+
+        return (''.join(pieces), offset_map)
+
+    def summary(self):
+
+        summary = OrderedDict(self.stats)
+        summary[CHARS_DROPPED] = summary[CHARS] - summary[CHARS_KEPT]
+        summary[FRACTION_DROPPED] = summary[CHARS_DROPPED]/summary[CHARS] if summary[CHARS] > 0 else 0.0
+
+        # recall of gold annotations, if provided to extract
+        if summary[GOLD_SPANS] > 0:
+            summary[GOLD_RECALL] = summary[GOLD_SPANS_KEPT]/summary[GOLD_SPANS]
+        else:
+            del summary[GOLD_SPANS]
+            del summary[GOLD_SPANS_KEPT]
+
+        return summary
@@ -0,0 +1,290 @@
+import os
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from config.constants import (
+    ARG_1,
+    ARG_2,
+    ATTRIBUTE,
+    COUNT,
+    ENTITIES,
+    EVENT,
+    EVENT_TYPE,
+    EVENTS,
+    RELATION,
+    RELATIONS,
+    ROLE,
+    SUBTYPE,
+    TEXTBOUND,
+    TYPE,
+)
+from utils.lazy_import import lazy_import
+
+pd = lazy_import('pandas')
+
+'''
+Single-pass corpus statistics
+
+CorpusStatistics accumulates any subset of the annotation summary, label
+summary, tag summary, span histogram, word count, and sentence count in one
+traversal of the documents, building entities, relations, and events once
+per document and updating shared counters in place. corpus_statistics can
+shard the documents across processes and merge the shards in document
+order, so outputs match a serial pass.
+'''
+
+ANNOTATION_SUMMARY = "annotation_summary"
+LABEL_SUMMARY = "label_summary"
+TAG_SUMMARY = "tag_summary"
+SPAN_HISTOGRAM = "span_histogram"
+WORD_COUNT = "word_count"
+SENTENCE_COUNT = "sentence_count"
+
+STATISTICS = [ANNOTATION_SUMMARY, LABEL_SUMMARY, TAG_SUMMARY, SPAN_HISTOGRAM, WORD_COUNT, SENTENCE_COUNT]
+
+LABEL_COLUMNS = OrderedDict()
+LABEL_COLUMNS[ENTITIES] = [TYPE, SUBTYPE, COUNT]
+LABEL_COLUMNS[RELATIONS] = [ARG_1, ARG_2, ROLE, COUNT]
+LABEL_COLUMNS[EVENTS] = [EVENT_TYPE, TYPE, SUBTYPE, COUNT]
+
+SPAN_HISTOGRAM_FILE = "span_histogram.csv"
+
+
+def counter2df(counter, columns=None):
+
+    X = []
+
+    for k, counts in counter.items():
+        if isinstance(k, (list, tuple)):
+            k = list(k)
+        else:
+            k = [k]
+        X.append(k + [counts])
+
+    df = pd.DataFrame(X, columns=columns)
+
+    return df
+
+
+class CorpusStatistics(object):
+    '''
+    Accumulator for corpus statistics
+
+    Parameters
+    ----------
+    statistics: list of statistics to compute (see STATISTICS). None will compute all
+    entity_types: entity types to include in the span histogram. None will include all
+    '''
+
+    def __init__(self, statistics=None, entity_types=None):
+
+        if statistics is None:
+            statistics = STATISTICS
+        for s in statistics:
+            if s not in STATISTICS:
+                raise ValueError(f"Invalid statistic: {s}. Valid statistics: {STATISTICS}")
+
+        self.statistics = set(statistics)
+        self.entity_types = entity_types
+
+        self.doc_count = 0
+        self.annotations = Counter()
+        self.labels = OrderedDict([(k, Counter()) for k in LABEL_COLUMNS])
+        self.tags_by_doc = []
+        self.tags_joint = Counter()
+        self.tags_individual = Counter()
+        self.spans = Counter()
+        self.word_count = 0
+        self.sentence_count = 0
+
+    def add_doc(self, doc):
+
+        stats = self.statistics
+        self.doc_count += 1
+
+        if ANNOTATION_SUMMARY in stats:
+            # only add types present, so row order matches merging per-document counters
+            for k, d in [(EVENT, doc.event_dict), (RELATION, doc.relation_dict), \
+                         (TEXTBOUND, doc.tb_dict), (ATTRIBUTE, doc.attr_dict)]:
+                if len(d) > 0:
+                    self.annotations[k] += len(d)
+
+        # entities are shared by the label summary and span histogram
+        entities = None
+        if (LABEL_SUMMARY in stats) or (SPAN_HISTOGRAM in stats):
+            entities = doc.entities()
+
+        if LABEL_SUMMARY in stats:
+
+            counter = self.labels[ENTITIES]
+            for a in entities:
+                counter[(a.type_, a.subtype)] += 1
+
+            counter = self.labels[RELATIONS]
+            for a in doc.relations():
+                counter[(a.entity_a.type_, a.entity_b.type_, a.role)] += 1
+
+            counter = self.labels[EVENTS]
+            for a in doc.events():
+                for arg in a.arguments:
+                    counter[(a.type_, arg.type_, arg.subtype)] += 1
+
+        if SPAN_HISTOGRAM in stats:
+            for entity in entities:
+                if (self.entity_types is None) or (entity.type_ in self.entity_types):
+                    self.spans[(entity.type_, entity.subtype, entity.text.lower())] += 1
+
+        if TAG_SUMMARY in stats:
+            self.add_tags(doc)
+
+        if WORD_COUNT in stats:
+            self.word_count += doc.word_count()
+
+        if SENTENCE_COUNT in stats:
+            self.sentence_count += doc.sentence_count()
+
+    def add_tags(self, doc):
+        self.tags_by_doc.append((doc.id, doc.tags))
+        self.tags_joint[tuple(doc.tags)] += 1
+        self.tags_individual.update(doc.tags)
+
+    def add_docs(self, docs):
+        for doc in docs:
+            self.add_doc(doc)
+        return self
+
+    def update(self, other):
+        '''
+        Merge statistics from another accumulator (e.g. a later shard of
+        documents), which may compute a subset of the statistics
+        '''
+
+        assert other.statistics <= self.statistics
+
+        self.doc_count += other.doc_count
+        self.annotations.update(other.annotations)
+        for k, v in other.labels.items():
+            self.labels[k].update(v)
+        self.tags_by_doc.extend(other.tags_by_doc)
+        self.tags_joint.update(other.tags_joint)
+        self.tags_individual.update(other.tags_individual)
+        self.spans.update(other.spans)
+        self.word_count += other.word_count
+        self.sentence_count += other.sentence_count
+
+        return self
+
+    def annotation_summary(self):
+        return counter2df(self.annotations)
+
+    def label_summary(self):
+
+        dfs = OrderedDict()
+        if self.doc_count > 0:
+            for k, columns in LABEL_COLUMNS.items():
+                dfs[k] = counter2df(self.labels[k], columns=columns)
+
+        return dfs
+
+    def tag_summary(self):
+
+        dfs = OrderedDict()
+        dfs["tag_by_doc"] = pd.DataFrame(self.tags_by_doc, columns=["id", "tags"])
+        dfs["tag_summary_joint"] = pd.DataFrame(self.tags_joint.items(), columns=["tag", "count"])
+        dfs["tag_summary_individual"] = pd.DataFrame(self.tags_individual.items(), columns=["tag", "count"])
+
+        return dfs
+
+    def span_histogram(self):
+
+        counts = [(type, subtype, text, count) for (type, subtype, text), count in self.spans.items()]
+        df = pd.DataFrame(counts, columns=["type", "subtype", "text", "count"])
+
+        df.sort_values('count', ascending=False, inplace=True)
+
+        return df
+
+    def results(self):
+        '''
+        Requested statistics by name
+        '''
+
+        output = OrderedDict()
+        for s in STATISTICS:
+            if s in self.statistics:
+                if s == WORD_COUNT:
+                    output[s] = self.word_count
+                elif s == SENTENCE_COUNT:
+                    output[s] = self.sentence_count
+                else:
+                    output[s] = getattr(self, s)()
+
+        return output
+
+    def write(self, path, results=None, span_filename=SPAN_HISTOGRAM_FILE):
+        '''
+        Write statistics with the same file names and formats as the
+        corresponding CorpusBrat methods
+        '''
+
+        if results is None:
+            results = self.results()
+
+        if ANNOTATION_SUMMARY in results:
+            f = os.path.join(path, "annotation_summary.csv")
+            results[ANNOTATION_SUMMARY].to_csv(f)
+
+        if LABEL_SUMMARY in results:
+            for k, df in results[LABEL_SUMMARY].items():
+                f = os.path.join(path, f"label_summary_{k}.csv")
+                df.to_csv(f)
+
+        if TAG_SUMMARY in results:
+            for k, df in results[TAG_SUMMARY].items():
+                f = os.path.join(path, f"{k}.csv")
+                df.to_csv(f, index=False)
+
+        if SPAN_HISTOGRAM in results:
+            f = os.path.join(path, span_filename)
+            results[SPAN_HISTOGRAM].to_csv(f)
+
+
+def shard_statistics(docs, statistics=None, entity_types=None):
+    return CorpusStatistics(statistics=statistics, entity_types=entity_types).add_docs(docs)
+
+def corpus_statistics(docs, statistics=None, entity_types=None, n_jobs=1):
+    '''
+    Compute statistics for docs in a single pass, optionally sharded
+    across n_jobs processes
+    '''
+
+    docs = list(docs)
+
+    if (n_jobs is None) or (n_jobs <= 1) or (len(docs) <= 1):
+        return shard_statistics(docs, statistics, entity_types)
+
+    stats = CorpusStatistics(statistics=statistics, entity_types=entity_types)
+
+    # tags are sets, whose iteration order depends on the string hash seed of
+    # the process, so the tag summary is computed here rather than in the shards
+    shard_stats = [s for s in stats.statistics if s != TAG_SUMMARY]
+
+    # contiguous shards, merged in order, so first-seen order of counter keys
+    # (and row order of outputs) matches a serial pass
+    if shard_stats:
+        shard_size = (len(docs) + n_jobs - 1)//n_jobs
+        shards = [docs[i:i + shard_size] for i in range(0, len(docs), shard_size)]
+
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            for shard in executor.map(shard_statistics, shards, \
+                                        [shard_stats]*len(shards),
+                                        [entity_types]*len(shards)):
+                stats.update(shard)
+    else:
+        stats.doc_count = len(docs)
+
+    if TAG_SUMMARY in stats.statistics:
+        for doc in docs:
+            stats.add_tags(doc)
+
+    return stats
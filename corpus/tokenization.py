@@ -1,11 +1,18 @@
 
 import logging
 import re
+import threading
+import time
+from collections import OrderedDict
 
-import spacy
-from spacy.tokenizer import Tokenizer
 from tqdm import tqdm
 
+from config.constants import REGEX_TOKENIZER
+from corpus.regex_tokenizer import RegexTokenizer
+from utils.lazy_import import lazy_import
+
+spacy = lazy_import('spacy')
+
 LANG = 'en_core_web_sm'
 
 DISABLE = ["tagger", "ner", "lemmatizer"]
@@ -82,9 +89,93 @@ def line_break_boundary(doc):
             doc[token.i+1].is_sent_start = True
     return doc
 
+
+# process-wide registry of loaded spaCy pipelines, keyed by (model, disabled components)
+_PIPELINES = OrderedDict()
+_PIPELINE_STATS = OrderedDict()
+_PIPELINE_LOCK = threading.Lock()
+
+
+def pipeline_key(model=LANG, disable=None):
+    return (model, tuple(sorted(disable or [])))
+
+
+def get_pipeline(model=LANG, disable=None):
+    '''
+    Get warm spaCy pipeline, loading it on first request
+
+    Pipelines are shared across callers and threads, so callers
+    must not add, remove, or reconfigure pipeline components.
+
+    model: spaCy model name, or REGEX_TOKENIZER for the regex tokenizer
+        and rule-based sentence splitter (disable is ignored)
+    '''
+
+    key = pipeline_key(model, disable)
+
+    with _PIPELINE_LOCK:
+        if key not in _PIPELINES:
+            t0 = time.perf_counter()
+            if model == REGEX_TOKENIZER:
+                _PIPELINES[key] = RegexTokenizer()
+            else:
+                _PIPELINES[key] = spacy.load(model, disable=list(key[1]))
+            load_sec = time.perf_counter() - t0
+            _PIPELINE_STATS[key] = OrderedDict([("load_sec", load_sec), ("requests", 0)])
+            logging.info(f"Loaded spaCy pipeline {model} (disable={list(key[1])}) in {load_sec:.2f}s")
+
+        _PIPELINE_STATS[key]["requests"] += 1
+
+        return _PIPELINES[key]
+
+
+def preload_pipelines(specs=None):
+    '''
+    Load pipelines ahead of first use (e.g. at server start up)
+
+    specs: list of (model, disable) tuples. None loads the pipelines used by
+        corpus import and tokenization
+    '''
+
+    if specs is None:
+        specs = [(LANG, None), (LANG, DISABLE)]
+
+    return [get_pipeline(model, disable) for model, disable in specs]
+
+
+def pipeline_stats():
+    '''
+    Load count, load time, and load time saved by reuse for each pipeline
+    '''
+
+    with _PIPELINE_LOCK:
+        pipelines = []
+        for (model, disable), stats in _PIPELINE_STATS.items():
+            d = OrderedDict()
+            d["model"] = model
+            d["disable"] = list(disable)
+            d["load_sec"] = stats["load_sec"]
+            d["requests"] = stats["requests"]
+            d["saved_sec"] = stats["load_sec"]*(stats["requests"] - 1)
+            pipelines.append(d)
+
+    total = OrderedDict()
+    total["loads"] = len(pipelines)
+    total["requests"] = sum([d["requests"] for d in pipelines])
+    total["load_sec"] = sum([d["load_sec"] for d in pipelines])
+    total["saved_sec"] = sum([d["saved_sec"] for d in pipelines])
+
+    return OrderedDict([("pipelines", pipelines), ("total", total)])
+
+
+def clear_pipelines():
+    with _PIPELINE_LOCK:
+        _PIPELINES.clear()
+        _PIPELINE_STATS.clear()
+
+
 def get_tokenizer():
-    nlp = spacy.load(LANG, disable=DISABLE)
-    return nlp
+    return get_pipeline(LANG, DISABLE)
 
 
 def get_tokenizer_OLD( \
@@ -118,6 +209,7 @@ def get_tokenizer_OLD( \
     #suffix_re = spacy.util.compile_suffix_regex(suffixes_all)
 
     # Create tokenizer
+    from spacy.tokenizer import Tokenizer
     tokenizer = Tokenizer(nlp.vocab,
                     nlp.Defaults.tokenizer_exceptions,
                      #prefix_search = prefixes_re.search,
@@ -1,10 +1,12 @@
 from __future__ import division, print_function, unicode_literals
 
 import argparse
+import json
 import logging
 import os
 import shutil
 import sys
+import time
 from collections import OrderedDict
 
 import joblib
@@ -13,9 +15,15 @@ from brat_scoring.scoring import micro_average_subtypes, score_docs
 
 import config.constants as C
 from corpus.corpus_brat import CorpusBrat
+from corpus.sections import SectionLocator
+from corpus.tokenization import pipeline_stats
 from spert_utils.config_setup import dict_to_config_file, get_dataset_stats
+from spert_utils.spert_cache import PredictionCache, checkpoint_hash, memoized_predict
 from spert_utils.spert_io import merge_spert_files
+from spert_utils.spert_prefilter import TriggerLexicon, expand_predictions_file, prefilter_file
+from spert_utils.spert_shard import run_sharded, spert_command
 from utils.misc import get_include
+from utils.profiling import Profiler
 
 pd.set_option('display.max_columns', None)
 pd.set_option('display.width', None)
@@ -43,6 +51,121 @@ def get_scoring_def():
     return scoring
 
 
+def run_spert(model_config, config_path, mspert_path, cpu_quantized=False, cpu_threads=None, quantized_cache_dir=None):
+    '''
+    Run mspert evaluation on model_config["dataset_path"]
+
+    returns path to predictions
+    '''
+
+    # create configuration file
+    dict_to_config_file(model_config, config_path)
+
+    if os.path.exists(model_config["log_path"]) and os.path.isdir(model_config["log_path"]):
+        shutil.rmtree(model_config["log_path"])
+
+    cmd = spert_command(config_path, cpu_quantized=cpu_quantized, cpu_threads=cpu_threads, \
+                            quantized_cache_dir=quantized_cache_dir)
+
+    cwd = os.getcwd()
+    os.chdir(mspert_path)
+    out = os.system(cmd)
+    os.chdir(cwd)
+    print("out", out)
+    if out != 0:
+        raise ValueError(f"python call error: {out}")
+
+    return os.path.join(model_config["log_path"], C.PREDICTIONS_JSON)
+
+
+def get_throughput(dataset_path, elapsed):
+    '''
+    Sentence and token throughput for inference over dataset_path
+    '''
+
+    sentences = json.load(open(dataset_path, 'r'))
+    sent_count = len(sentences)
+    token_count = sum([len(sent["tokens"]) for sent in sentences])
+
+    throughput = OrderedDict()
+    throughput["sentences"] = sent_count
+    throughput["tokens"] = token_count
+    throughput["seconds"] = elapsed
+    throughput["sentences_per_sec"] = sent_count/elapsed if elapsed > 0 else 0.0
+    throughput["tokens_per_sec"] = token_count/elapsed if elapsed > 0 else 0.0
+
+    return throughput
+
+
+def import_predictions(merged_file, label_definition, path):
+    '''
+    Import merged spert predictions as corpus
+    '''
+
+    predict_corpus = CorpusBrat()
+    predict_corpus.import_spert_corpus_multi( \
+                                    path = merged_file,
+                                    subtype_layers = label_definition["subtype_layers"],
+                                    subtype_default = label_definition["subtype_default"],
+                                    event_types = label_definition["event_types"],
+                                    swapped_spans = label_definition["swapped_spans"],
+                                    arg_role_map = label_definition["arg_role_map"],
+                                    attr_type_map = label_definition["attr_type_map"],
+                                    skip_dup_trig = label_definition["skip_dup_trig"])
+
+    #predict_corpus.map_roles(role_map, path=destination)
+    predict_corpus.prune_invalid_connections(label_definition["args_by_event_type"], path=path)
+
+    return predict_corpus
+
+
+def score_predictions(predict_corpus, gold_docs, label_definition, scoring, path, suffix=''):
+    '''
+    Score predictions against gold documents
+
+    returns dictionary of micro-averaged score data frames by scoring definition
+    '''
+
+    predict_docs = predict_corpus.docs(as_dict=True)
+
+    dfs = OrderedDict()
+    for description, score_def in scoring.items():
+
+        df = score_docs( \
+            gold_docs = gold_docs,
+            predict_docs = predict_docs,
+            labeled_args = label_definition["score_labeled_args"], \
+            score_trig = score_def["score_trig"],
+            score_span = score_def["score_span"],
+            score_labeled = score_def["score_labeled"],
+            output_path = path,
+            description = f"{description}{suffix}",
+            argument_types = label_definition["score_argument_types"])
+
+        df = micro_average_subtypes(df)
+        f = os.path.join(path, f"scores_{description}{suffix}_micro.csv")
+        df.to_csv(f, index=False)
+
+        dfs[description] = df
+
+    return dfs
+
+
+def overall_f1(df):
+    '''
+    Overall F1, micro-averaged from counts if no overall row present
+    '''
+
+    overall = df[df[C.EVENT] == C.OVERALL]
+    if len(overall) == 1:
+        return float(overall[C.F1].iloc[0])
+
+    nt, np_, tp = df[C.NT].sum(), df[C.NP].sum(), df[C.TP].sum()
+    p = tp/float(np_) if np_ else 0.0
+    r = tp/float(nt) if nt else 0.0
+    return 2*p*r/(p + r) if (p + r) else 0.0
+
+
 def main(args):
 
 
@@ -58,6 +181,12 @@ def main(args):
 
     scoring = get_scoring_def()
 
+    profiler = Profiler( \
+                    path = args.destination,
+                    trace_memory = args.trace_memory,
+                    profile_stages = args.profile_stages,
+                    use_pyinstrument = args.pyinstrument)
+
     model_config = OrderedDict()
     model_config["model_path"] = args.model_path
     model_config["tokenizer_path"] = args.model_path
@@ -75,26 +204,40 @@ def main(args):
     model_config["log_path"] = log_path
 
 
-    if args.mode == C.EVAL:
-        assert args.source_file is not None, '''if mode == "eval", then args.source_file cannot be None'''
-        assert os.path.exists(args.source_file), f'''args.source_file does not exist: {args.source_file}'''
-        if args.source_dir is not None:
-            logging.warn('''if mode == "eval", then args.source_dir must be None. ignoring args.source_dir''')
+    with profiler.stage("load_corpus") as stage:
+        if args.mode == C.EVAL:
+            assert args.source_file is not None, '''if mode == "eval", then args.source_file cannot be None'''
+            assert os.path.exists(args.source_file), f'''args.source_file does not exist: {args.source_file}'''
+            if args.source_dir is not None:
+                logging.warn('''if mode == "eval", then args.source_dir must be None. ignoring args.source_dir''')
 
-        # load corpus
-        corpus = joblib.load(args.source_file)
+            # load corpus
+            corpus = joblib.load(args.source_file)
 
-    elif args.mode == C.PREDICT:
-        if args.source_file is not None:
-            logging.warn('''if mode == "predict", then args.source_file must be None. ignoring_args.source_file''')
-        assert args.source_dir is not None,          '''if mode == "predict", then args.source_dir cannot be None'''
-        assert os.path.exists(args.source_dir),  f'''args.source_dir does not exist: {args.source_dir}'''
+        elif args.mode == C.PREDICT:
+            if args.source_file is not None:
+                logging.warn('''if mode == "predict", then args.source_file must be None. ignoring_args.source_file''')
+            assert args.source_dir is not None,          '''if mode == "predict", then args.source_dir cannot be None'''
+            assert os.path.exists(args.source_dir),  f'''args.source_dir does not exist: {args.source_dir}'''
 
-        corpus = CorpusBrat()
-        corpus.import_text_dir(args.source_dir)
+            section_locator = None
+            if args.social_history_only:
+                section_locator = SectionLocator(fallback=args.section_fallback)
 
-    else:
-        raise ValueError(f"Invalid mode: {args.mode}")
+            corpus = CorpusBrat(spacy_model=args.tokenizer)
+            corpus.import_text_dir(args.source_dir, section_locator=section_locator)
+
+            if section_locator is not None:
+                section_summary = section_locator.summary()
+                logging.info(f"Section extraction: {section_summary}")
+                df = pd.DataFrame(section_summary.items(), columns=["metric", "value"])
+                f = os.path.join(args.destination, "section_stats.csv")
+                df.to_csv(f, index=False)
+                profiler.add_info("sections", section_summary)
+
+        else:
+            raise ValueError(f"Invalid mode: {args.mode}")
+        stage.items = corpus.doc_count()
 
 
     f = os.path.join(model_config["model_path"], C.LABEL_DEFINITION_FILE)
@@ -105,58 +248,127 @@ def main(args):
     '''
 
     # use trigger spans for all arguments and the list to use _trigger_span
-    for arg in label_definition["swapped_spans"]:
-        c = corpus.swap_spans( \
-                        source = arg,
-                        target = C.TRIGGER,
-                        use_role = False)
+    with profiler.stage("swap_spans"):
+        for arg in label_definition["swapped_spans"]:
+            c = corpus.swap_spans( \
+                            source = arg,
+                            target = C.TRIGGER,
+                            use_role = False)
 
     # create formatted data
-    fast_count = args.fast_count if args.fast_run else None
-    corpus.events2spert_multi( \
-                include = eval_include,
-                entity_types = label_definition["entity_types"],
-                subtype_layers = label_definition["subtype_layers"],
-                subtype_default = label_definition["subtype_default"],
-                path = dataset_path,
-                sample_count = fast_count,
-                include_doc_text = True)
-
-    if eval_include is None:
-        include_name = 'None'
-    else:
-        include_name = '_'.join(list([x for x in eval_include if x is not None]))
-    get_dataset_stats(dataset_path=dataset_path, dest_path=args.destination, name=include_name)
-
-    # create configuration file
-    dict_to_config_file(model_config, config_path)
+    with profiler.stage("spert_conversion") as stage:
+        fast_count = args.fast_count if args.fast_run else None
+        spert_sentences = corpus.events2spert_multi( \
+                    include = eval_include,
+                    entity_types = label_definition["entity_types"],
+                    subtype_layers = label_definition["subtype_layers"],
+                    subtype_default = label_definition["subtype_default"],
+                    path = dataset_path,
+                    sample_count = fast_count,
+                    include_doc_text = True)
+
+        if eval_include is None:
+            include_name = 'None'
+        else:
+            include_name = '_'.join(list([x for x in eval_include if x is not None]))
+        get_dataset_stats(dataset_path=dataset_path, dest_path=args.destination, name=include_name)
+        stage.items = len(spert_sentences)
 
     '''
     Call Spert
     '''
     logging.info("Destination = {}".format(args.destination))
 
-    if os.path.exists(model_config["log_path"]) and os.path.isdir(model_config["log_path"]):
-        shutil.rmtree(model_config["log_path"])
-
-    cwd = os.getcwd()
-    os.chdir(args.mspert_path)
-    out = os.system(f'python ./spert.py eval --config {config_path}')
-    os.chdir(cwd)
-    print("out", out)
-    if out != 0:
-        raise ValueError(f"python call error: {out}")
-        assert False
+    if args.cpu_quantized or (args.shards > 0):
+        model_config["cpu"] = True
+
+    # quantized model cache also kept out of the checkpoint directory
+    quantized_cache_dir = args.quantized_cache_dir
+    if quantized_cache_dir is None:
+        quantized_cache_dir = args.destination
+
+    def predict_fn(path):
+        model_config["dataset_path"] = path
+        t0 = time.time()
+        with profiler.stage("model_execution"):
+            if args.shards > 0:
+                predict_file = run_sharded(model_config, path, \
+                            destination = os.path.join(args.destination, "shards"),
+                            mspert_path = args.mspert_path,
+                            num_shards = args.shards,
+                            cpu_quantized = args.cpu_quantized,
+                            quantized_cache_dir = quantized_cache_dir,
+                            predict_file = os.path.join(args.destination, "predictions_sharded.json"))
+            else:
+                predict_file = run_spert(model_config, config_path, args.mspert_path, \
+                            cpu_quantized = args.cpu_quantized,
+                            cpu_threads = args.cpu_threads,
+                            quantized_cache_dir = quantized_cache_dir)
+        timing.append(get_throughput(path, time.time() - t0))
+        return predict_file
 
     '''
     Post process output
     '''
 
-
+    # only run spert on unique sentences not found in the prediction cache
+    cache = None
+    if args.prediction_cache_size > 0:
+        cache_path = args.prediction_cache
+        if cache_path is None:
+            # keep the checkpoint directory read-only (see models/quantization.py)
+            cache_path = os.path.join(args.destination, C.PREDICTION_CACHE_FILE)
+        settings = {k: model_config[k] for k in ["rel_filter_threshold", "max_span_size", "max_pairs", "no_overlapping"]}
+        settings["cpu_quantized"] = args.cpu_quantized
+        cache = PredictionCache( \
+                        path = cache_path,
+                        checkpoint = checkpoint_hash(args.model_path, settings=settings),
+                        max_size = args.prediction_cache_size)
+
+    # only run spert on sentences with (or near) a trigger lexicon hit
+    inference_path = dataset_path
+    if args.prefilter:
+        with profiler.stage("prefilter") as stage:
+            lexicon_path = args.prefilter_lexicon
+            if lexicon_path is None:
+                lexicon_path = os.path.join(args.model_path, C.TRIGGER_LEXICON_FILE)
+            lexicon = TriggerLexicon.load(lexicon_path)
+            if args.prefilter_window is not None:
+                lexicon.window = args.prefilter_window
+
+            inference_path = os.path.join(args.destination, 'data_eval_prefiltered.json')
+            all_sentences, keep, prefilter_summary = prefilter_file(dataset_path, inference_path, lexicon)
+            stage.items = len(all_sentences)
+
+            df = pd.DataFrame(list(prefilter_summary.items()), columns=["metric", "value"])
+            logging.info(f"Prefilter summary:\n{df}")
+            df.to_csv(os.path.join(args.destination, "prefilter_summary.csv"), index=False)
+            profiler.add_info("prefilter", prefilter_summary)
+
+    timing = []
     predict_file = os.path.join(model_config["log_path"], C.PREDICTIONS_JSON)
-
+    unique_path = os.path.join(args.destination, 'data_eval_unique.json')
     merged_file = os.path.join(args.destination, C.PREDICTIONS_JSON)
-    merge_spert_files(model_config["dataset_path"], predict_file, merged_file)
+    with profiler.stage("inference") as stage:
+        _, memo_summary = memoized_predict( \
+                        dataset_path = inference_path,
+                        unique_path = unique_path,
+                        merged_file = merged_file,
+                        predict_fn = predict_fn,
+                        cache = cache,
+                        summary_path = os.path.join(args.destination, C.PREDICTION_CACHE_SUMMARY))
+        stage.items = memo_summary["sentences"]
+
+        # skipped sentences get empty predictions
+        if args.prefilter:
+            expand_predictions_file(all_sentences, keep, merged_file)
+    model_config["dataset_path"] = dataset_path
+
+    if len(timing) > 0:
+        df = pd.DataFrame(timing)
+        df.insert(0, "mode", "int8" if args.cpu_quantized else "fp32")
+        logging.info(f"Inference throughput:\n{df}")
+        df.to_csv(os.path.join(args.destination, "throughput.csv"), index=False)
 
 
     logging.info("Scoring predictions")
@@ -164,44 +376,66 @@ def main(args):
     logging.info(f"Prediction file, original:     {predict_file}")
     logging.info(f"Prediction file, merged_file:  {merged_file}")
 
-    predict_corpus = CorpusBrat()
-    predict_corpus.import_spert_corpus_multi( \
-                                    path = merged_file,
-                                    subtype_layers = label_definition["subtype_layers"],
-                                    subtype_default = label_definition["subtype_default"],
-                                    event_types = label_definition["event_types"],
-                                    swapped_spans = label_definition["swapped_spans"],
-                                    arg_role_map = label_definition["arg_role_map"],
-                                    attr_type_map = label_definition["attr_type_map"],
-                                    skip_dup_trig = label_definition["skip_dup_trig"])
+    with profiler.stage("import_prune") as stage:
+        predict_corpus = import_predictions(merged_file, label_definition, path=args.destination)
+        stage.items = predict_corpus.doc_count()
 
-    #predict_corpus.map_roles(role_map, path=destination)
-    predict_corpus.prune_invalid_connections(label_definition["args_by_event_type"], path=args.destination)
+        # map predictions on extracted sections back to original note offsets
+        if (args.mode == C.PREDICT) and args.social_history_only:
+            predict_corpus.map_to_original(corpus.section_maps)
 
 
     if args.mode == C.EVAL:
 
-        predict_docs = predict_corpus.docs(as_dict=True)
+        with profiler.stage("scoring") as stage:
+            gold_corpus = joblib.load(args.source_file)
+            gold_docs = gold_corpus.docs(include=eval_include, as_dict=True)
+
+            dfs = score_predictions(predict_corpus, gold_docs, label_definition, scoring, path=args.destination)
+            stage.items = len(gold_docs)
 
-        gold_corpus = joblib.load(args.source_file)
-        gold_docs = gold_corpus.docs(include=eval_include, as_dict=True)
+        # compare quantized predictions to fp32 predictions, with both modes
+        # run on the full data set (no prediction cache or prefilter), so
+        # throughput and F1 are measured on the same sentences
+        if args.cpu_quantized and args.fp32_reference:
 
-        for description, score_def in scoring.items():
+            def reference_run(mode, cpu_quantized):
 
-            df = score_docs( \
-                gold_docs = gold_docs,
-                predict_docs = predict_docs,
-                labeled_args = label_definition["score_labeled_args"], \
-                score_trig = score_def["score_trig"],
-                score_span = score_def["score_span"],
-                score_labeled = score_def["score_labeled"],
-                output_path = args.destination,
-                description = description,
-                argument_types = label_definition["score_argument_types"])
+                logging.info(f"Running {mode} reference")
+                ref_path = os.path.join(args.destination, mode)
+                if not os.path.exists(ref_path):
+                    os.makedirs(ref_path)
 
-            df = micro_average_subtypes(df)
-            f = os.path.join(args.destination, f"scores_{description}_micro.csv")
-            df = df.to_csv(f, index=False)
+                ref_config = OrderedDict(model_config)
+                ref_config["log_path"] = os.path.join(ref_path, "log")
+
+                t0 = time.time()
+                ref_predict_file = run_spert(ref_config, os.path.join(ref_path, "config.conf"), args.mspert_path, \
+                                        cpu_quantized = cpu_quantized,
+                                        cpu_threads = args.cpu_threads,
+                                        quantized_cache_dir = quantized_cache_dir)
+                throughput = get_throughput(dataset_path, time.time() - t0)
+
+                ref_merged_file = os.path.join(ref_path, C.PREDICTIONS_JSON)
+                merge_spert_files(dataset_path, ref_predict_file, ref_merged_file)
+                ref_corpus = import_predictions(ref_merged_file, label_definition, path=ref_path)
+                ref_dfs = score_predictions(ref_corpus, gold_docs, label_definition, scoring, path=ref_path)
+
+                return (ref_dfs, throughput)
+
+            int8_dfs, int8_throughput = reference_run("int8", cpu_quantized=True)
+            fp32_dfs, fp32_throughput = reference_run("fp32", cpu_quantized=False)
+
+            rows = []
+            for description in scoring:
+                f1_int8 = overall_f1(int8_dfs[description])
+                f1_fp32 = overall_f1(fp32_dfs[description])
+                rows.append((description, f1_fp32, f1_int8, f1_int8 - f1_fp32))
+            df = pd.DataFrame(rows, columns=["scoring", "F1_fp32", "F1_int8", "F1_delta"])
+            df["tokens_per_sec_fp32"] = fp32_throughput["tokens_per_sec"]
+            df["tokens_per_sec_int8"] = int8_throughput["tokens_per_sec"]
+            logging.info(f"Quantization summary:\n{df}")
+            df.to_csv(os.path.join(args.destination, "quantization_summary.csv"), index=False)
 
     elif args.mode == C.PREDICT:
 
@@ -213,7 +447,11 @@ def main(args):
     if args.save_brat:
         brat_dir = os.path.join(args.destination, "brat")
         logging.info("fSaving brat: {brat_dir}")
-        predict_corpus.write_brat(brat_dir)
+        with profiler.stage("write_brat", items=predict_corpus.doc_count()):
+            predict_corpus.write_brat(brat_dir)
+
+    profiler.add_info("spacy_pipelines", pipeline_stats())
+    profiler.save()
 
     return 'Successful completion'
 
@@ -245,6 +483,22 @@ if __name__ == '__main__':
     arg_parser.add_argument('--max_pairs', type=int, default=1000, help="maximum relation pairs")
     arg_parser.add_argument('--no_overlapping', default=True, action='store_false', help="disallow overlapping spans")
     arg_parser.add_argument('--device', type=int, default=0, help="GPU device")
+    arg_parser.add_argument('--cpu_quantized', default=False, action='store_true', help="run inference on cpu with dynamic int8 quantization of linear layers")
+    arg_parser.add_argument('--cpu_threads', type=int, default=None, help="intra-op threads for cpu inference. None will use all available cores")
+    arg_parser.add_argument('--quantized_cache_dir', type=str, default=None, help="directory for the quantized model cache. None will place the cache in the destination directory")
+    arg_parser.add_argument('--fp32_reference', default=False, action='store_true', help="with --cpu_quantized and mode 'eval', also run int8 and fp32 inference on the full data set (no prediction cache or prefilter) and report the F1 delta and throughput")
+    arg_parser.add_argument('--shards', type=int, default=0, help="number of parallel cpu inference processes, with documents split across processes. 0 disables sharding")
+    arg_parser.add_argument('--prediction_cache', type=str, default=None, help="path to persistent sentence prediction cache. None will place the cache in the destination directory")
+    arg_parser.add_argument('--prediction_cache_size', type=int, default=100000, help="maximum number of cached sentence predictions (LRU eviction). 0 disables the cache")
+    arg_parser.add_argument('--trace_memory', default=False, action='store_true', help="track peak python allocations per stage with tracemalloc (slower)")
+    arg_parser.add_argument('--profile_stages', type=str, default=None, nargs='+', help="stages to profile with cProfile, e.g. 'scoring import_prune'")
+    arg_parser.add_argument('--pyinstrument', default=False, action='store_true', help="use pyinstrument instead of cProfile for --profile_stages")
+    arg_parser.add_argument('--tokenizer', type=str, default=C.SPACY_MODEL, help=f"tokenizer for mode 'predict': spaCy model name or '{C.REGEX_TOKENIZER}' for the regex tokenizer and rule-based sentence splitter")
+    arg_parser.add_argument('--social_history_only', default=False, action='store_true', help="for mode 'predict', only run inference on social history sections. predictions are mapped back to the original text")
+    arg_parser.add_argument('--section_fallback', type=str, default='full', help="for --social_history_only, handling of documents without a social history section: 'full' keeps the full text and 'drop' skips the document")
+    arg_parser.add_argument('--prefilter', default=False, action='store_true', help="only run inference on sentences near a trigger lexicon hit (see spert_utils/build_trigger_lexicon.py)")
+    arg_parser.add_argument('--prefilter_lexicon', type=str, default=None, help="path to trigger lexicon. None will use the lexicon in the model directory")
+    arg_parser.add_argument('--prefilter_window', type=int, default=None, help="prefilter context window (sentences). None will use the window saved with the lexicon")
     arg_parser.add_argument('--save_brat', default=True, action='store_false', help="save predictions in brat format")
     args, _ = arg_parser.parse_known_args()
 
@@ -1,4 +1,5 @@
 import logging
+import math
 from collections import OrderedDict
 
 import pandas as pd
@@ -18,6 +19,28 @@ from models.training import cross_entropy_soft_labels, get_loss
 from models.utils import loss_reduction
 
 
+LIN_OUTPUT = "lin_output"
+OUTPUT_WEIGHT = "output_weight"
+OUTPUT_BIAS = "output_bias"
+
+
+def convert_lin_output_state_dict(state_dict, prefix, num_tags):
+    '''
+    Convert per-tag output layers (lin_output.{i}.weight/bias) from
+    checkpoints saved before the output layers were batched into stacked
+    output_weight/output_bias tensors. The state dict is modified in place.
+    '''
+
+    weight_keys = [f'{prefix}{LIN_OUTPUT}.{i}.weight' for i in range(num_tags)]
+    bias_keys = [f'{prefix}{LIN_OUTPUT}.{i}.bias' for i in range(num_tags)]
+
+    if all([k in state_dict for k in weight_keys + bias_keys]):
+        state_dict[f'{prefix}{OUTPUT_WEIGHT}'] = torch.stack([state_dict.pop(k) for k in weight_keys])
+        state_dict[f'{prefix}{OUTPUT_BIAS}'] = torch.stack([state_dict.pop(k) for k in bias_keys])
+
+    return state_dict
+
+
 def argmax(vec):
     # return the argmax as a python int
     _, idx = torch.max(vec, 1)
@@ -53,10 +76,11 @@ class MultiHeadAttention(nn.Module):
         # Package with AllenNLP
         self.attn = TimeDistributed(linear_attn)
 
-        # Create output layer
-        self.lin_output = nn.ModuleDict(OrderedDict())
-        for i in range(self.num_tags):
-            self.lin_output[str(i)] = torch.nn.Linear(input_dim, output_dim, bias=True)
+        # Create output layer, a separate linear layer for each tag
+        # packed as a single weight tensor (num_tags, output_dim, input_dim)
+        self.output_weight = Parameter(torch.empty(num_tags, output_dim, input_dim))
+        self.output_bias = Parameter(torch.empty(num_tags, output_dim))
+        self.reset_output_parameters()
 
         # Dropout
         self.drop_layer = nn.Dropout(p=dropout)
@@ -68,6 +92,19 @@ class MultiHeadAttention(nn.Module):
         self.softmax = torch.nn.Softmax(dim=-1)
 
 
+    def reset_output_parameters(self):
+        '''
+        Initialize each tag's output layer as torch.nn.Linear does
+        '''
+        bound = 1/math.sqrt(self.input_dim) if self.input_dim > 0 else 0
+        for i in range(self.num_tags):
+            nn.init.kaiming_uniform_(self.output_weight[i], a=math.sqrt(5))
+        nn.init.uniform_(self.output_bias, -bound, bound)
+
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        convert_lin_output_state_dict(state_dict, prefix, self.num_tags)
+        super(MultiHeadAttention, self)._load_from_state_dict(state_dict, prefix, *args, **kwargs)
+
     def forward(self, seq_embed, seq_mask=None, \
                     seq_labels=None, seq_weights=None, verbose=False):
 
@@ -109,11 +146,8 @@ class MultiHeadAttention(nn.Module):
         attended_do = self.drop_layer(attended)
 
         # Calculate logits, using a separate linear layer for each tag
-        logits = []
-        for i, x in enumerate(attended_do.split(1, -1)):
-            logits_tmp = self.lin_output[str(i)](x.squeeze(-1)).unsqueeze(1)
-            logits.append(logits_tmp)
-        logits = torch.cat(logits, dim=1)
+        # shape (batch_size, num_tags, output_dim)
+        logits = torch.einsum('bht,toh->bto', attended_do, self.output_weight) + self.output_bias
 
 
         # Cross entropy loss
@@ -0,0 +1,127 @@
+import torch
+from torch.utils.data import Sampler
+from torch.utils.data.dataloader import default_collate
+
+import config.constants as C
+
+'''
+Length-bucketed batching
+
+BucketBatchSampler groups sentences of similar length into batches, and
+trim_collate trims each batch to its longest sentence, so the recurrent
+encoder and CRF process little padding.
+'''
+
+
+class BucketBatchSampler(Sampler):
+    '''
+    Batch sampler that groups sentences of similar length
+
+    Sentences are shuffled and split into buckets of bucket_size batches.
+    Each bucket is sorted by length and cut into batches, and the order of
+    all batches is shuffled, so batches are shuffled within and across
+    buckets.
+
+    Parameters
+    ----------
+    lengths: sequence length of each sentence
+    batch_size: sentences per batch
+    bucket_size: batches per bucket
+    shuffle: shuffle sentences and batches for each epoch
+    drop_last: drop incomplete batches
+    seed: random seed. None will use the default torch generator
+    '''
+
+    def __init__(self, lengths, batch_size, bucket_size=50, shuffle=True, drop_last=False, seed=None):
+
+        assert batch_size > 0
+        assert bucket_size > 0
+
+        self.lengths = [int(n) for n in lengths]
+        self.batch_size = batch_size
+        self.bucket_size = bucket_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+
+        self.generator = None
+        if seed is not None:
+            self.generator = torch.Generator()
+            self.generator.manual_seed(seed)
+
+    def batches(self):
+
+        n = len(self.lengths)
+        if self.shuffle:
+            order = torch.randperm(n, generator=self.generator).tolist()
+        else:
+            order = list(range(n))
+
+        chunk = self.batch_size*self.bucket_size
+
+        batches = []
+        for i in range(0, n, chunk):
+            bucket = sorted(order[i:i + chunk], key=lambda j: self.lengths[j])
+            batches.extend([bucket[k:k + self.batch_size] for k in range(0, len(bucket), self.batch_size)])
+
+        if self.drop_last:
+            batches = [b for b in batches if len(b) == self.batch_size]
+
+        if self.shuffle:
+            batches = [batches[i] for i in torch.randperm(len(batches), generator=self.generator).tolist()]
+
+        return batches
+
+    def __iter__(self):
+        return iter(self.batches())
+
+    def __len__(self):
+        # only the last bucket may have an incomplete batch
+        if self.drop_last:
+            return len(self.lengths)//self.batch_size
+        return (len(self.lengths) + self.batch_size - 1)//self.batch_size
+
+
+def sequence_label_names(label_def):
+    '''
+    Names of the token-level (SEQ) labels in label_def, e.g. [C.ENTITY]
+    '''
+    return [name for name, lab_def in label_def.items() if lab_def[C.LAB_TYPE] == C.SEQ]
+
+
+def trim_collate(batch, sequence_names=None):
+    '''
+    Collate (X, mask) or (X, mask, y) samples, trimming the sequence
+    dimension to the longest sentence in the batch
+
+    Only the sequence tensors are trimmed: X (batch, max_len, embed_size),
+    mask (batch, max_len), and the token-level labels y[name][event_type]
+    (batch, max_len) for name in sequence_names. Sentence-level labels are
+    left as is.
+
+    Parameters
+    ----------
+    batch: list of (X, mask) or (X, mask, y) samples
+    sequence_names: names of token-level labels in y. None will use the
+                    SEQ labels of MULTITASK_LABEL_DEF
+    '''
+
+    batch = default_collate(batch)
+
+    X, mask = batch[0], batch[1]
+    length = max(int(mask.sum(1).max()), 1)
+
+    X = X[:, :length].contiguous()
+    mask = mask[:, :length].contiguous()
+
+    if len(batch) == 2:
+        return (X, mask)
+
+    if sequence_names is None:
+        sequence_names = sequence_label_names(C.MULTITASK_LABEL_DEF)
+
+    y = batch[2].copy()
+    for name in sequence_names:
+        y[name] = y[name].__class__([(event_type, labels[:, :length].contiguous()) \
+                                            for event_type, labels in y[name].items()])
+
+    return (X, mask, y)
@@ -5,6 +5,7 @@ from collections import OrderedDict
 import numpy as np
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 from allennlp.modules.conditional_random_field import ConditionalRandomField
 from allennlp.modules.span_extractors import EndpointSpanExtractor
 
@@ -18,6 +19,9 @@ BIO_DEFAULT = True
 PAD_START = True
 PAD_END = True
 
+# Score for disallowed transitions and padded tags, as in ConditionalRandomField.viterbi_tags
+NEG_FILL = -10000.0
+
 
 def strip_BIO_tok(x, begin=C.BEGIN, inside=C.INSIDE):
 
@@ -142,78 +146,58 @@ def BIO_to_span_seq(seq, check_count=False, as_Span=True):
         indices = [list(s.indices) for s in spans]
         return (types_, indices)
 
-def seq_tags_to_spans(y, map_fn):
-
-
-    # Number of spans per sequence
-    count_ = []
-
-    # Span labels (variable length)
-    labels = []
-
-    # Indices of spans (variable length)
-    indices_tmp = []
-
-    # Loop on sequences
-    for seq in y:
-
-        # At least one nonnegative label found
-        if any(seq):
-
-            # Map IDs to labels
-            labs = [map_fn(s) for s in seq]
-
-            # Get spans as labels in indices
-            labs, idx = BIO_to_span_seq(labs, \
-                                        end_exclusive = False,
-                                        as_Span = False)
-
-            # Number of spans per sequence
-            cnt = len(labs)
+def seq_tags_to_spans(y, id_to_label, lookup=None):
+    '''
+    Get spans from batch of tag sequences
 
-        # Only negative labels found
-        else:
-            labs = []
-            idx = []
-            cnt = 0
+    Parameters
+    ----------
+    y: batch of tag ID sequences (list of variable length sequences, array, or tensor)
+    id_to_label: map of tag ID to (prefix, tag) tuple
+    lookup: BIOLookup for id_to_label. None will build from id_to_label
+
+    returns
+        labels: list of span labels by sequence
+        indices: span start and end (inclusive) token indices, (batch_size, max_span_count, 2)
+        mask: span mask, (batch_size, max_span_count)
+    '''
 
-        # Append to batch results
-        labels.append(labs)
-        indices_tmp.append(idx)
-        count_.append(cnt)
+    if lookup is None:
+        lookup = BIOLookup.from_id_to_label(id_to_label)
 
     # Batch size
     batch_size = len(y)
+    assert batch_size > 0
 
-    # Maximum span count per sequence
-    max_span_count = max(max(count_), 1)
-    count_ = np.array(count_)
-
-    # Initialize span indices
-    indices = np.zeros((batch_size, max_span_count, 2), dtype=np.int32)
+    # Decode all sequences at once
+    batch_idx, type_idx, starts, ends = BIO_to_span_arrays(y, lookup)
 
-    # Initialize span indices mask
-    mask = np.zeros((batch_size, max_span_count), dtype=np.int32)
+    # Number of spans per sequence
+    count_ = np.bincount(batch_idx, minlength=batch_size)
 
-    # Loop on sequences in batch
-    assert batch_size > 0
-    for i in range(batch_size):
+    # Maximum span count per sequence
+    max_span_count = max(int(count_.max()), 1)
 
-        # Number of spans in sequence
-        c = count_[i]
+    # Position of each span within its sequence
+    first = np.cumsum(count_) - count_
+    position = np.arange(len(batch_idx)) - first[batch_idx]
 
-        # Only update if span(s) present
-        if c > 0:
+    # Span indices (end inclusive) and span mask
+    indices = np.zeros((batch_size, max_span_count, 2), dtype=np.int64)
+    indices[batch_idx, position, 0] = starts
+    indices[batch_idx, position, 1] = ends - 1
 
-            # Update span indices
-            indices[i,:c,:] = np.array(indices_tmp[i])
+    mask = np.zeros((batch_size, max_span_count), dtype=np.int64)
+    mask[batch_idx, position] = 1
 
-            # Update span mask
-            mask[i,:c] = 1
+    # Span labels (variable length)
+    labels = [[] for _ in range(batch_size)]
+    for b, t in zip(batch_idx.tolist(), type_idx.tolist()):
+        labels[b].append(lookup.types[t])
 
     # Convert to Tensor
-    indices = torch.LongTensor(indices)
-    mask = torch.LongTensor(mask)
+    indices = torch.from_numpy(indices)
+    mask = torch.from_numpy(mask)
 
     return (labels, indices, mask)
 
@@ -416,6 +400,280 @@ def BIO_to_span(labels, id_to_label=None, lab_is_tuple=True,
 
 
 
+class BIOLookup(object):
+    '''
+    Tag ID lookup tables for vectorized BIO decoding
+
+    Parameters
+    ----------
+    is_begin: bool array, tag ID is a begin (B-) tag
+    is_inside: bool array, tag ID is an inside (I-) tag
+    type_ids: int array, span type index of tag ID
+    types: list of span types, indexed by type_ids
+    '''
+
+    def __init__(self, is_begin, is_inside, type_ids, types):
+        self.is_begin = np.asarray(is_begin, dtype=bool)
+        self.is_inside = np.asarray(is_inside, dtype=bool)
+        self.type_ids = np.asarray(type_ids, dtype=np.int64)
+        self.types = list(types)
+
+    @classmethod
+    def from_id_to_label(cls, id_to_label):
+        '''
+        Lookup from map of tag ID to (prefix, tag) tuple, e.g. from get_label_map
+        '''
+
+        n = max(id_to_label) + 1
+        is_begin = np.zeros(n, dtype=bool)
+        is_inside = np.zeros(n, dtype=bool)
+        type_ids = np.zeros(n, dtype=np.int64)
+        types = []
+        type_index = {}
+        for id, (prefix, tag) in id_to_label.items():
+            if prefix not in [C.OUTSIDE, C.BEGIN, C.INSIDE]:
+                raise ValueError("could not assign label")
+            if tag not in type_index:
+                type_index[tag] = len(types)
+                types.append(tag)
+            is_begin[id] = prefix == C.BEGIN
+            is_inside[id] = prefix == C.INSIDE
+            type_ids[id] = type_index[tag]
+
+        return cls(is_begin, is_inside, type_ids, types)
+
+    @classmethod
+    def from_num_tags(cls, num_tags_orig):
+        '''
+        Lookup for integer labels resolved by tag_to_span_lab
+        '''
+
+        n = 2*num_tags_orig - 1
+        is_begin = np.zeros(n, dtype=bool)
+        is_inside = np.zeros(n, dtype=bool)
+        type_ids = np.zeros(n, dtype=np.int64)
+        for lab in range(n):
+            span_label, _, is_B, is_I = tag_to_span_lab(lab, num_tags_orig)
+            is_begin[lab] = is_B
+            is_inside[lab] = is_I
+            type_ids[lab] = span_label
+
+        return cls(is_begin, is_inside, type_ids, list(range(num_tags_orig)))
+
+
+def BIO_to_span_arrays(y, lookup, lengths=None):
+    '''
+    Vectorized BIO decoding for a batch of tag ID sequences
+
+    Produces the same spans as BIO_to_span, including ill-formed
+    inside tags, which end the active span and are otherwise ignored.
+
+    A token continues a span if it is an inside tag with the same type as
+    the previous token, so the sequence splits into segments at every token
+    that does not continue the previous one. A segment is a span if it
+    starts with a begin tag.
+
+    Parameters
+    ----------
+    y: tag IDs as (batch_size, seq_len) array or tensor, or list of
+        variable length sequences
+    lookup: BIOLookup
+    lengths: sequence lengths. None will use the full sequence (or list lengths)
+
+    returns (batch index, type index, start, end) arrays, end exclusive
+    '''
+
+    # pad variable length sequences
+    if isinstance(y, (list, tuple)):
+        if lengths is None:
+            lengths = [len(seq) for seq in y]
+        seq_len = max(list(lengths) + [1])
+        y_pad = np.zeros((len(y), seq_len), dtype=np.int64)
+        for i, seq in enumerate(y):
+            y_pad[i, :len(seq)] = seq
+        y = y_pad
+    elif isinstance(y, torch.Tensor):
+        y = y.detach().cpu().numpy()
+    y = np.asarray(y, dtype=np.int64)
+
+    batch_size, seq_len = y.shape
+
+    valid = np.ones((batch_size, seq_len), dtype=bool)
+    if lengths is not None:
+        if isinstance(lengths, torch.Tensor):
+            lengths = lengths.detach().cpu().numpy()
+        valid = np.arange(seq_len)[None, :] < np.asarray(lengths)[:, None]
+
+    # sequences without any nonzero label have no spans (as in BIO_to_span)
+    valid &= ((y != 0) & valid).any(axis=1, keepdims=True)
+
+    is_B = lookup.is_begin[y] & valid
+    is_I = lookup.is_inside[y] & valid
+    types = lookup.type_ids[y]
+
+    # inside token continuing previous token
+    cont = np.zeros((batch_size, seq_len), dtype=bool)
+    cont[:, 1:] = is_I[:, 1:] & (types[:, 1:] == types[:, :-1])
+
+    # segment heads, in flattened coordinates (rows always start a segment)
+    heads = np.flatnonzero(~cont.ravel())
+    seg_ends = np.append(heads[1:], cont.size)
+
+    is_span = is_B.ravel()[heads]
+    flat_starts = heads[is_span]
+    flat_ends = seg_ends[is_span]
+
+    batch_idx = flat_starts//seq_len
+    starts = flat_starts - batch_idx*seq_len
+    ends = flat_ends - batch_idx*seq_len
+    type_idx = types.ravel()[flat_starts]
+
+    return (batch_idx, type_idx, starts, ends)
+
+
+def BIO_to_span_batch(y, lookup, lengths=None):
+    '''
+    Vectorized equivalent of [BIO_to_span(seq, ...) for seq in y]
+
+    returns list of list of (tag, start, end) by sequence
+    '''
+
+    batch_idx, type_idx, starts, ends = BIO_to_span_arrays(y, lookup, lengths=lengths)
+
+    batch_size = len(y)
+    spans = [[] for _ in range(batch_size)]
+    for b, t, s, e in zip(batch_idx.tolist(), type_idx.tolist(), starts.tolist(), ends.tolist()):
+        spans[b].append((lookup.types[t], s, e))
+
+    return spans
+
+
+def stack_crf_transitions(crfs, num_tags, constrained=False):
+    '''
+    Stack ConditionalRandomField transition parameters, padding tags to num_tags
+
+    Parameters
+    ----------
+    crfs: list of ConditionalRandomField
+    num_tags: padded tag count, at least the tag count of each CRF
+    constrained: apply the constraint mask, as in ConditionalRandomField.viterbi_tags
+
+    returns
+        transitions: (num_crfs, num_tags, num_tags)
+        start: start transitions, (num_crfs, num_tags)
+        end: end transitions, (num_crfs, num_tags)
+    '''
+
+    transitions = []
+    start = []
+    end = []
+    for crf in crfs:
+
+        n = crf.num_tags
+        trans = crf.transitions
+        if crf.include_start_end_transitions:
+            start_ = crf.start_transitions
+            end_ = crf.end_transitions
+        else:
+            start_ = trans.new_zeros(n)
+            end_ = trans.new_zeros(n)
+
+        if constrained:
+            mask = crf._constraint_mask
+            trans = trans*mask[:n, :n] + NEG_FILL*(1 - mask[:n, :n])
+            start_ = start_*mask[n, :n] + NEG_FILL*(1 - mask[n, :n])
+            end_ = end_*mask[:n, n + 1] + NEG_FILL*(1 - mask[:n, n + 1])
+
+        pad = num_tags - n
+        transitions.append(F.pad(trans, (0, pad, 0, pad), value=NEG_FILL))
+        start.append(F.pad(start_, (0, pad), value=NEG_FILL))
+        end.append(F.pad(end_, (0, pad), value=NEG_FILL))
+
+    return (torch.stack(transitions), torch.stack(start), torch.stack(end))
+
+def batched_crf_log_likelihood(logits, tags, mask, transitions, start, end):
+    '''
+    Log likelihood of tag sequences for several CRFs at once
+
+    Follows ConditionalRandomField.forward, including its handling of the
+    last tag, with the CRFs stacked along the first dimension.
+
+    Parameters
+    ----------
+    logits: (num_crfs, batch_size, seq_len, num_tags)
+    tags: (num_crfs, batch_size, seq_len)
+    mask: (batch_size, seq_len)
+    transitions, start, end: from stack_crf_transitions
+
+    returns log likelihood summed over batch, (num_crfs)
+    '''
+
+    num_crfs, batch_size, seq_len, num_tags = logits.size()
+    mask = mask.bool()
+    mask_float = mask.to(logits.dtype)
+    tags = tags.long()
+
+    # Partition function (forward algorithm)
+    alpha = start.unsqueeze(1) + logits[:, :, 0]
+    for i in range(1, seq_len):
+        inner = alpha.unsqueeze(-1) + transitions.unsqueeze(1) + logits[:, :, i].unsqueeze(2)
+        alpha = torch.where(mask[:, i].view(1, batch_size, 1), torch.logsumexp(inner, 2), alpha)
+    denominator = torch.logsumexp(alpha + end.unsqueeze(1), -1)
+
+    # Score of tag sequences
+    crf_idx = torch.arange(num_crfs, device=logits.device).view(num_crfs, 1, 1)
+    emit = logits.gather(3, tags.unsqueeze(-1)).squeeze(-1)
+    trans = transitions[crf_idx, tags[:, :, :-1], tags[:, :, 1:]]
+
+    numerator = start.gather(1, tags[:, :, 0]) + \
+                (trans*mask_float[:, 1:]).sum(-1) + \
+                (emit[:, :, :-1]*mask_float[:, :-1]).sum(-1)
+
+    last_index = mask.sum(1).long() - 1
+    last_tags = tags.gather(2, last_index.view(1, batch_size, 1).expand(num_crfs, batch_size, 1)).squeeze(-1)
+    numerator = numerator + end.gather(1, last_tags) + \
+                logits[:, :, -1].gather(2, last_tags.unsqueeze(-1)).squeeze(-1)*mask_float[:, -1]
+
+    return (numerator - denominator).sum(-1)
+
+def batched_viterbi(logits, mask, transitions, start, end):
+    '''
+    Best tag sequences for several CRFs at once
+
+    Parameters
+    ----------
+    logits: (num_crfs, batch_size, seq_len, num_tags)
+    mask: (batch_size, seq_len), left aligned
+    transitions, start, end: from stack_crf_transitions with constrained=True
+
+    returns best paths, (num_crfs, batch_size, seq_len). Positions beyond
+    the sequence length repeat the last tag.
+    '''
+
+    num_crfs, batch_size, seq_len, num_tags = logits.size()
+    mask = mask.bool()
+
+    identity = torch.arange(num_tags, device=logits.device).view(1, 1, num_tags).expand(num_crfs, batch_size, num_tags)
+
+    # Forward pass, keeping back pointers
+    score = start.unsqueeze(1) + logits[:, :, 0]
+    backpointers = []
+    for i in range(1, seq_len):
+        best, index = (score.unsqueeze(-1) + transitions.unsqueeze(1)).max(2)
+        m = mask[:, i].view(1, batch_size, 1)
+        score = torch.where(m, best + logits[:, :, i], score)
+        backpointers.append(torch.where(m, index, identity))
+
+    # Backtrack
+    best_tag = (score + end.unsqueeze(1)).argmax(-1)
+    path = [best_tag]
+    for index in reversed(backpointers):
+        best_tag = index.gather(2, best_tag.unsqueeze(-1)).squeeze(-1)
+        path.append(best_tag)
+    path.reverse()
+
+    return torch.stack(path, -1)
+
 class CRF(nn.Module):
     '''
     CRF
@@ -563,6 +821,9 @@ class SpanExtractor(nn.Module):
         self.incl_start_end = incl_start_end
         self.span_rep = span_rep
 
+        # Tag ID lookup tables for span decoding
+        self.bio_lookup = BIOLookup.from_id_to_label(id_to_label)
+
         # Linear projection layer
         self.projection = nn.Linear(embed_size, num_tags)
 
@@ -616,7 +877,9 @@ class SpanExtractor(nn.Module):
 
         # Get spans from sequence tags
         span_labels, span_indices, span_mask = \
-                            seq_tags_to_spans(y_pred, self.id_to_label)
+                            seq_tags_to_spans(y_pred, self.id_to_label, lookup=self.bio_lookup)
+        span_indices = span_indices.to(X.device)
+        span_mask = span_mask.to(X.device)
 
         # Get span representations
         span_embed = self.endpoint_extractor( \
@@ -635,7 +898,8 @@ class MultitaskSpanExtractor(nn.Module):
     def __init__(self, events, entity, num_tags, embed_size, id_to_label,
             constraints = None,
             incl_start_end = True,
-            span_rep = "x,y,x*y"):
+            span_rep = "x,y,x*y",
+            fused = False):
         super(MultitaskSpanExtractor, self).__init__()
 
 
@@ -648,6 +912,9 @@ class MultitaskSpanExtractor(nn.Module):
         self.incl_start_end = incl_start_end
         self.span_rep = span_rep
 
+        # Evaluate all events together (see forward_fused)
+        self.fused = fused
+
 
 
         # Initialize dictionaries for CRF
@@ -668,11 +935,17 @@ class MultitaskSpanExtractor(nn.Module):
             logging.info('')
             logging.info('{}-{}'.format(event, entity))
 
+        logging.info('\tfused: {}'.format(fused))
+
 
     def forward(self, X, y=None, mask=None):
         '''
         Generate predictions
         '''
+
+        if self.fused:
+            return self.forward_fused(X, y=y, mask=mask)
+
         # Batch size
         batch_size = batch_size = len(mask)
 
@@ -698,6 +971,72 @@ class MultitaskSpanExtractor(nn.Module):
 
         return (loss, y_pred, span_labels, span_embed)
 
+    def forward_fused(self, X, y=None, mask=None):
+        '''
+        Generate predictions for all events at once
+
+        The event projections are stacked into one matmul, the CRF loss and
+        Viterbi decoding run on all events as batched tensor ops, and the
+        spans of all events share one endpoint extractor call. Tags are
+        padded to the largest event tag count, with padded tags scored at
+        NEG_FILL. Parameters are those of the per-event SpanExtractor
+        modules, so checkpoints are interchangeable with the unfused
+        forward, which gives the same output.
+        '''
+
+        extractors = [self.span_extractors[event] for event in self.events]
+        crfs = [ext.crf for ext in extractors]
+        max_tags = max([ext.num_tags for ext in extractors])
+
+        mask = mask.bool()
+        lengths = mask.sum(1).tolist()
+
+        # Stacked projections, (events, batch_size, seq_len, max_tags)
+        weight = torch.stack([F.pad(ext.projection.weight, (0, 0, 0, max_tags - ext.num_tags)) \
+                                                                            for ext in extractors])
+        bias = torch.stack([F.pad(ext.projection.bias, (0, max_tags - ext.num_tags), value=NEG_FILL) \
+                                                                            for ext in extractors])
+        logits = torch.einsum('blh,eth->eblt', X, weight) + bias[:, None, None, :]
+
+        # Get loss (negative log likely)
+        if y is None:
+            loss = {event: None for event in self.events}
+        else:
+            tags = torch.stack([y[event][self.entity] for event in self.events])
+            log_likelihood = batched_crf_log_likelihood(logits, tags, mask, \
+                                            *stack_crf_transitions(crfs, max_tags))
+            loss = {event: -log_likelihood[i] for i, event in enumerate(self.events)}
+
+        # Best path
+        with torch.no_grad():
+            paths = batched_viterbi(logits.detach(), mask, \
+                                *stack_crf_transitions(crfs, max_tags, constrained=True))
+        paths = paths.tolist()
+
+        # Get spans from sequence tags
+        y_pred = {}
+        span_labels = {}
+        span_indices = []
+        span_mask = []
+        for i, (event, ext) in enumerate(zip(self.events, extractors)):
+            y_pred[event] = [p[:n] for p, n in zip(paths[i], lengths)]
+            span_labels[event], indices, mask_ = \
+                        seq_tags_to_spans(y_pred[event], ext.id_to_label, lookup=ext.bio_lookup)
+            span_indices.append(indices)
+            span_mask.append(mask_)
+
+        # Get span representations for all events at once
+        # (endpoint extractors have no parameters, as no width embeddings are used)
+        span_counts = [indices.size(1) for indices in span_indices]
+        span_embed = extractors[0].endpoint_extractor( \
+                sequence_tensor = X,
+                span_indices = torch.cat(span_indices, 1).to(X.device),
+                sequence_mask = mask,
+                span_indices_mask = torch.cat(span_mask, 1).to(X.device))
+        span_embed = dict(zip(self.events, span_embed.split(span_counts, dim=1)))
+
+        return (loss, y_pred, span_labels, span_embed)
+
 #def BIO_to_spanOLD(seq, num_tags):
 #    '''
 #
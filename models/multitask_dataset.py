@@ -1,16 +1,19 @@
 
 
+import hashlib
 import json
 import logging
+import os
 from collections import Counter, OrderedDict
 
 #torch.multiprocessing.set_start_method("spawn")
+import numpy as np
 import pandas as pd
 import torch
 from torch.utils.data import Dataset
 
 import config.constants as C
-from models.crf import BIO_to_span
+from models.crf import BIO_to_span, BIO_to_span_arrays, BIOLookup
 
 # from utils.seq_prep import preprocess_tokens_doc
 # from corpus.event import Event, Span, events2sent_labs, events2seq_tags
@@ -18,10 +21,10 @@ from models.utils import (
     create_mask,
     map_2D,
     map_dict_builder,
-    pad_embedding_seq,
     pad_sequences,
 )
 from models.xfmrs import embed_len_check, get_embeddings, tokens2wordpiece
+from spert_utils.spert_io import ENTITIES, RELATIONS, SUBTYPES, TOKENS, create_entity, create_relation
 
 START_TOKEN = '<c>'
 END_TOKEN = '<e>'
@@ -322,6 +325,8 @@ def preprocess_X( \
                 num_workers = 6,
                 get_last = True,
                 batch_size = 50,
+                embed_dtype = np.float32,
+                embed_path = None,
                 ):
 
     '''
@@ -331,6 +336,8 @@ def preprocess_X( \
     ----------
     X: list of tokenized sentences,
             e.g.[['Patient', 'denies', 'tobacco', '.'], [...]]
+    embed_path: .npy file to write embeddings to, batch by batch. If provided,
+            embeddings are returned as a read-only memory-mapped array
 
     '''
 
@@ -358,22 +365,24 @@ def preprocess_X( \
     seq_lengths = [len(x) for x in tok_idx]
 
 
-    # X as embedding
+    # X as embedding, padded/truncated to max_len
     embed = get_embeddings( \
                             word_piece_ids = wp_ids,
                             tok_idx = tok_idx,
                             pretrained_path = pretrained_path,
                             num_workers = num_workers,
                             batch_size = batch_size,
-                            device = device)
+                            device = device,
+                            output_len = max_len,
+                            dtype = embed_dtype,
+                            output_path = embed_path)
     # Check lengths
-    embed_len_check(tokens, embed)
+    embed_len_check(tokens, tok_idx)
 
-    # Pad sequences of embedding
-    embed = [pad_embedding_seq(x, max_len) for x in embed]
-
-    # Convert embeddings to tensor
-    embed = torch.tensor(embed)
+    # Convert embeddings to tensor (no copy)
+    # memory-mapped embeddings are read lazily in MultitaskDataset.__getitem__
+    if embed_path is None:
+        embed = torch.from_numpy(embed)
 
     logging.info('Sequence length min:\t{}'.format(min(seq_lengths)))
     logging.info('Sequence length max:\t{}'.format(max(seq_lengths)))
@@ -582,168 +591,149 @@ def seq_tag_entities(labels, pad_start, id_to_label):
     return entities
 
 
-def decode_(y, tokens, id_to_label, pad_start, label_def):
+def get_span_lookups(label_def, id_to_label):
     '''
-    Postprocess predictions
+    BIOLookup for each sequence label and event type
     '''
 
+    lookups = OrderedDict()
+    for name, lab_def in label_def.items():
+        if lab_def[C.LAB_TYPE] == C.SEQ:
+            lookups[name] = OrderedDict([(event_type, BIOLookup.from_id_to_label(id2lab)) \
+                                        for event_type, id2lab in id_to_label[name].items()])
 
-    event_types = list(label_def[C.TRIGGER][C.LAB_MAP])
+    return lookups
 
-    assert len(y) == len(tokens)
-    sentences = []
-    for i, (y_, toks) in enumerate(zip(y, tokens)):
-        sentence = {}
-        sentence["tokens"] = toks
 
-        print()
+def sent_label_positions(pred, event_types):
+    '''
+    Sentence-level labels and their positions for a batch
 
-        print(toks)
+    Parameters
+    ----------
+    pred: predictions by event type as sequence, (batch_size, seq_len), with
+          the label at the position of maximum attention and zeros elsewhere
+    event_types: event types to stack
+
+    returns (labels, positions), each (batch_size, event count)
+    '''
 
+    P = torch.stack([pred[event_type] for event_type in event_types], 1).long()
+    positions = (P != 0).long().argmax(-1)
+    labels = P.gather(-1, positions.unsqueeze(-1)).squeeze(-1)
 
+    return (labels, positions)
 
-        trigger_dict = {event_type:None for event_type in event_types}
-        entity_dict =  {event_type:[] for   event_type in event_types}
-        subtype_dict = {event_type:{} for   event_type in event_types}
 
-        for name, labels_by_event in y_.items():
-            print(name)
+def decode_batch(pred, sentences, id_to_label, label_def, pad_start, \
+                                    lookups=None, subtype_default=C.SUBTYPE_DEFAULT):
+    '''
+    Decode a batch of multitask predictions to SpERT sentences
 
-            # Label type (e.g. 'sentence' or 'sequence')
-            label_type = label_def[name][C.LAB_TYPE]
+    Each predicted trigger becomes an entity, with the sentence-level
+    labels of the same event type (e.g. StatusTime) as its subtypes.
+    Sequence-tagged arguments become entities related to the trigger of
+    the same event type. The output can be read by import_spert_corpus_multi.
 
-            for event_type, labels in labels_by_event.items():
-                print(event_type, labels)
+    Parameters
+    ----------
+    pred: predictions by label name and event type from MultitaskModel.
+          Sentence-level labels are tensors, (batch_size, seq_len), and
+          sequence labels are lists of tag ID sequences
+    sentences: input SpERT sentences for the batch
+    id_to_label: ID to label maps from get_label_map
+    label_def: label definition
+    pad_start: sequences start with a start token
+    lookups: BIOLookup by label name and event type. None will build from id_to_label
+    subtype_default: subtype label for entities without a predicted subtype
+
+    returns list of SpERT sentences
+    '''
 
-                id2lab = id_to_label[name][event_type]
+    if lookups is None:
+        lookups = get_span_lookups(label_def, id_to_label)
 
-                if label_type == C.SENT:
-                    entity = sent_lab_to_entity( \
-                                    labels = labels,
-                                    tokens = toks,
-                                    pad_start = pad_start,
-                                    id_to_label = id2lab,
-                                    )
-                    if entity is not None:
-                        if name == C.TRIGGER:
-                            trigger_dict[event_type] = entity
-                        else:
-                            subtype_dict[event_type][name] = entity
+    offset = int(pad_start)
+    event_types = list(label_def[C.TRIGGER][C.LAB_MAP])
 
-                elif label_type == C.SEQ:
+    # Sentence-level labels, for all event types at once
+    # sent_labels[name][event_type] = (labels by sentence, positions by sentence)
+    sent_labels = OrderedDict()
+    for name, lab_def in label_def.items():
+        if lab_def[C.LAB_TYPE] == C.SENT:
+            types_ = list(lab_def[C.LAB_MAP])
+            labels, positions = sent_label_positions(pred[name], types_)
+            labels = labels.t().tolist()
+            positions = positions.t().tolist()
+            sent_labels[name] = OrderedDict([(t, (labels[i], positions[i])) for i, t in enumerate(types_)])
+
+    # Subtype layers, from sentence-level labels other than the trigger
+    subtype_layers = OrderedDict([(name, label_def[name].get(C.ARGUMENT, name)) \
+                                                        for name in sent_labels if name != C.TRIGGER])
+
+    # Sequence labels, for all sentences at once
+    # arguments[(sentence index, event type)] = [(type, start, end),...]
+    arguments = {}
+    for name, lab_def in label_def.items():
+        if lab_def[C.LAB_TYPE] == C.SEQ:
+            for event_type, y in pred[name].items():
+                lookup = lookups[name][event_type]
+                batch_idx, type_idx, starts, ends = BIO_to_span_arrays(y, lookup)
+                for b, t, start, end in zip(batch_idx.tolist(), type_idx.tolist(), \
+                                            (starts - offset).tolist(), (ends - offset).tolist()):
+                    arguments.setdefault((b, event_type), []).append((lookup.types[t], start, end))
 
-                    entity_dict[event_type] = seq_tag_entities(labels, pad_start, id2lab)
+    trigger_labels = sent_labels[C.TRIGGER]
 
-                else:
-                    raise ValueError(f"Invalid label type: \t {label}")
-
-        print('trigger', trigger_dict)
-        print('subtype', subtype_dict)
-        print('entity ', entity_dict)
-
-        X = START_HERE
-        #
-        # # Loop on label types (e.g. Trigger, Status, etc.)
-        # for name, evt_labs in y_.items():
-        #
-        #     # Label type (e.g. 'sentence' or 'sequence')
-        #     lab_typ = label_def[name][LAB_TYPE]
-        #
-        #     # Loop on event types for label type (e.g. Alcohol, Drug, etc.)
-        #     for evt_typ, labs in evt_labs.items():
-        #
-        #         id2lab = id_to_label[name][evt_typ]
-        #
-        #         if lab_typ == SENT:
-        #             span = sent_lab_span( \
-        #                             labels = labs,
-        #                             tokens = toks,
-        #                             pad_start = pad_start,
-        #                             id_to_label = id2lab,
-        #                             type_ = name,
-        #                             sent_idx = i,
-        #                             )
-        #
-        #             if span is not None:
-        #                 evt_spans[evt_typ].append(span)
-        #
-        #         elif lab_typ == SEQ:
-        #             spans = seq_tag_spans( \
-        #                             labels = labs,
-        #                             tokens = toks,
-        #                             pad_start = pad_start,
-        #                             id_to_label = id2lab,
-        #                             sent_idx = i,
-        #                             )
-        #             evt_spans[evt_typ].extend(spans)
-        #         else:
-        #             raise ValueError("invalid label type:\t{}".format(lab_typ))
-
-
-
-    a = START_HERE
-
-    # All possible event types
-    evt_types = list(set([evt_typ for name, evt_labs in y[0].items() \
-                                             for evt_typ in evt_labs]))
-    # Loop on sentences
-    assert len(y) == len(tokens)
-    events_doc = []
-    for i, (y_, toks) in enumerate(zip(y, tokens)):
-
-        # Spans by event
-        evt_spans = OrderedDict([(evt_typ, []) for evt_typ in evt_types])
-
-        # Loop on label types (e.g. Trigger, Status, etc.)
-        for name, evt_labs in y_.items():
-
-            # Label type (e.g. 'sentence' or 'sequence')
-            lab_typ = label_def[name][LAB_TYPE]
-
-            # Loop on event types for label type (e.g. Alcohol, Drug, etc.)
-            for evt_typ, labs in evt_labs.items():
-
-                id2lab = id_to_label[name][evt_typ]
-
-                if lab_typ == SENT:
-                    span = sent_lab_span( \
-                                    labels = labs,
-                                    tokens = toks,
-                                    pad_start = pad_start,
-                                    id_to_label = id2lab,
-                                    type_ = name,
-                                    sent_idx = i,
-                                    )
-
-                    if span is not None:
-                        evt_spans[evt_typ].append(span)
-
-                elif lab_typ == SEQ:
-                    spans = seq_tag_spans( \
-                                    labels = labs,
-                                    tokens = toks,
-                                    pad_start = pad_start,
-                                    id_to_label = id2lab,
-                                    sent_idx = i,
-                                    )
-                    evt_spans[evt_typ].extend(spans)
-                else:
-                    raise ValueError("invalid label type:\t{}".format(lab_typ))
+    output = []
+    for b, sentence in enumerate(sentences):
 
-        # Convert spans into events
-        events_sent = []
-        for evt_typ, spans in evt_spans.items():
+        n = len(sentence[TOKENS])
 
-            # Build event
-            if len(spans) > 0:
-                evt = Event( \
-                        type_ = evt_typ,
-                        arguments = spans)
-                events_sent.append(evt)
+        entities = []
+        subtypes = []
+        relations = []
+        for event_type in event_types:
 
-        events_doc.append(events_sent)
+            labels, positions = trigger_labels[event_type]
+            if (labels[b] == 0) or (n == 0):
+                continue
 
-    return events_doc
+            # Trigger, as the token with maximum attention
+            start = min(max(positions[b] - offset, 0), n - 1)
+            end = start + 1
+
+            subtype_dict = OrderedDict()
+            for name, layer in subtype_layers.items():
+                subtype_dict[layer] = subtype_default
+                if event_type in sent_labels[name]:
+                    label = sent_labels[name][event_type][0][b]
+                    if label > 0:
+                        subtype_dict[layer] = id_to_label[name][event_type][label]
+
+            head = len(entities)
+            entities.append(create_entity(id_to_label[C.TRIGGER][event_type][labels[b]], start, end))
+            subtypes.append(create_entity(subtype_dict, start, end))
+
+            # Arguments
+            for type_, start, end in arguments.get((b, event_type), []):
+                start = max(start, 0)
+                end = min(end, n)
+                if end <= start:
+                    continue
+
+                relations.append(create_relation(head, len(entities)))
+                entities.append(create_entity(type_, start, end))
+                subtypes.append(create_entity( \
+                        OrderedDict([(layer, subtype_default) for layer in subtype_layers.values()]), start, end))
+
+        sent = OrderedDict(sentence)
+        sent[ENTITIES] = entities
+        sent[SUBTYPES] = subtypes
+        sent[RELATIONS] = relations
+        output.append(sent)
+
+    return output
 
 def list_to_counts(X):
 
@@ -752,6 +742,75 @@ def list_to_counts(X):
     df = df.rename(columns={'index':'event', 0:'count'})
     return df
 
+EMBED_CACHE_FILE = "embeddings.npy"
+SEQ_LENGTHS_FILE = "seq_lengths.json"
+
+
+def embedding_cache_key(sentences, pretrained_path, tokenizer_path, get_last, max_len, embed_dtype):
+    '''
+    Hash identifying cached embeddings for a data set and encoder configuration
+    '''
+
+    h = hashlib.sha1()
+    params = [pretrained_path, tokenizer_path, get_last, max_len, np.dtype(embed_dtype).str]
+    h.update(json.dumps(params).encode())
+    for s in sentences:
+        h.update(json.dumps(s['tokens']).encode())
+        h.update(b'\n')
+
+    return h.hexdigest()
+
+
+def load_embedding_cache(path):
+    '''
+    Load cached embeddings as memory-mapped array
+    '''
+
+    f_embed = os.path.join(path, EMBED_CACHE_FILE)
+    f_lengths = os.path.join(path, SEQ_LENGTHS_FILE)
+    if not (os.path.exists(f_embed) and os.path.exists(f_lengths)):
+        return None
+
+    embed = np.load(f_embed, mmap_mode='r')
+    with open(f_lengths, 'r') as f:
+        seq_lengths = json.load(f)
+
+    logging.info(f"Embedding cache loaded:\t{path}")
+    logging.info(f"Embedding dimensions:\t{embed.shape}")
+
+    return (embed, seq_lengths)
+
+
+def save_embedding_cache(path, embed, seq_lengths):
+    '''
+    Save embeddings for memory-mapped access
+
+    embed may be None, if embeddings were already written to the cache
+    (see get_embeddings output_path), in which case only the sequence
+    lengths are saved
+    '''
+
+    if not os.path.exists(path):
+        os.makedirs(path)
+
+    # write to temporary files, so incomplete caches are never loaded
+    # sequence lengths written last, as load_embedding_cache requires both
+    if embed is not None:
+        f_embed = os.path.join(path, EMBED_CACHE_FILE)
+        with open(f_embed + '.tmp', 'wb') as f:
+            np.save(f, np.asarray(embed))
+        os.replace(f_embed + '.tmp', f_embed)
+
+    f_lengths = os.path.join(path, SEQ_LENGTHS_FILE)
+    with open(f_lengths + '.tmp', 'w') as f:
+        json.dump(list(seq_lengths), f)
+    os.replace(f_lengths + '.tmp', f_lengths)
+
+    logging.info(f"Embedding cache saved:\t{path}")
+
+    return True
+
+
 class MultitaskDataset(Dataset):
     """
     """
@@ -766,7 +825,9 @@ class MultitaskDataset(Dataset):
         get_last = True,
         batch_size = 50,
         mode = 'fit',
-        pad_start = True
+        pad_start = True,
+        embed_dtype = np.float32,
+        cache_dir = None
         ):
         super(MultitaskDataset, self).__init__()
 
@@ -796,6 +857,8 @@ class MultitaskDataset(Dataset):
         self.batch_size = batch_size
         self.mode = mode
         self.pad_start = pad_start
+        self.embed_dtype = embed_dtype
+        self.cache_dir = cache_dir
 
 
         with open(dataset_path, "r") as f:
@@ -804,16 +867,48 @@ class MultitaskDataset(Dataset):
         self.sent_count = len(self.sentences)
 
         # Map to embeddings, and get sequence lengths
-        self.tokens, self.X, self.seq_lengths = preprocess_X( \
+        # embeddings cached as memory-mapped array and read lazily in __getitem__
+        cached = None
+        if self.cache_dir is not None:
+            key = embedding_cache_key( \
                 sentences = self.sentences,
                 pretrained_path = self.pretrained_path,
                 tokenizer_path = self.tokenizer_path,
-                device = self.device,
-                max_len = self.max_len,
-                num_workers = self.num_workers,
                 get_last = self.get_last,
-                batch_size = self.batch_size
-                )
+                max_len = self.max_len,
+                embed_dtype = self.embed_dtype)
+            cache_path = os.path.join(self.cache_dir, key)
+            cached = load_embedding_cache(cache_path)
+
+        if cached is None:
+
+            # on first build, write embeddings directly to the cache,
+            # so the full array is never held in memory
+            embed_path = None
+            if self.cache_dir is not None:
+                if not os.path.exists(cache_path):
+                    os.makedirs(cache_path)
+                embed_path = os.path.join(cache_path, EMBED_CACHE_FILE)
+
+            self.tokens, self.X, self.seq_lengths = preprocess_X( \
+                    sentences = self.sentences,
+                    pretrained_path = self.pretrained_path,
+                    tokenizer_path = self.tokenizer_path,
+                    device = self.device,
+                    max_len = self.max_len,
+                    num_workers = self.num_workers,
+                    get_last = self.get_last,
+                    batch_size = self.batch_size,
+                    embed_dtype = self.embed_dtype,
+                    embed_path = embed_path
+                    )
+
+            if self.cache_dir is not None:
+                save_embedding_cache(cache_path, None, self.seq_lengths)
+                self.X, self.seq_lengths = load_embedding_cache(cache_path)
+        else:
+            self.tokens = [s['tokens'] for s in self.sentences]
+            self.X, self.seq_lengths = cached
 
 
         # else:
@@ -833,6 +928,9 @@ class MultitaskDataset(Dataset):
         self.label_to_id, self.id_to_label, self.num_tags = \
                                           get_label_map(self.label_def)
 
+        # Tag ID lookup tables for span decoding
+        self.span_lookups = get_span_lookups(self.label_def, self.id_to_label)
+
 
         if self.mode == "fit":
             # Process labeled input
@@ -858,6 +956,9 @@ class MultitaskDataset(Dataset):
 
         # Current input and mask
         X = self.X[index]
+        if isinstance(X, np.ndarray):
+            X = torch.from_numpy(np.array(X))
+        X = X.float()
         mask = self.mask[index]
 
         #Prediction (input only)
@@ -872,59 +973,16 @@ class MultitaskDataset(Dataset):
 
 
 
-    def decode_(self, y):
-
-
-        # iterate over sentences
-        # pos_lab = []
-        # for sentence in y:
-        #
-        #
-        #     for name, lab_def in sentence.items():
-        #         for event_type, labels in lab_def.items():
-        #             if sum(labels) > 0:
-        #                 pos_lab.append((K, k))
-        # pos_lab = list_to_counts(pos_lab)
-        # logging.info('Label predictions for decoding. Positive counts:\n{}'.format(pos_lab))
-
-
-        events = decode_( \
-                            y = y,
-                            tokens = self.tokens,
-                            id_to_label = self.id_to_label,
-                            pad_start = self.pad_start,
-                            label_def = self.label_def)
-
-        event_counts1 = sum([len(sent) for sent in events])
-
-        get_pos = lambda X: [k for x in X for k, v in x.items() for v_ in v if v_ > 0]
-
-
-
-        logging.info("Multitask data set, decoding")
-        logging.info("Event counts, by sent:\t{}".format(event_counts1))
-
-        # Initialize output
-        events_by_doc = [[[] for _ in range(c)] \
-                                              for c in self.sent_counts]
-
-        # Loop on documents
-        i_sent = 0
-        for j_doc, cnt in enumerate(self.sent_counts):
-
-            tmp = events[i_sent:i_sent + cnt]
-            for j_sent, sent in enumerate(tmp):
-                for evt in sent:
-                    for span in evt.arguments:
-                        span.sent_idx = j_sent
-            events_by_doc[j_doc] = tmp
-
-            i_sent += cnt
-
-
-        event_counts2 = sum([len(sent) for doc in events_by_doc for sent in doc])
-        assert event_counts1 == event_counts2, '{} vs {}'.format(event_counts1, event_counts2)
-
-        z = HERE_HERE
+    def decode_batch(self, pred, indices, subtype_default=C.SUBTYPE_DEFAULT):
+        '''
+        Decode predictions for the sentences at indices to SpERT sentences
+        '''
 
-        return events_by_doc
+        return decode_batch( \
+                        pred = pred,
+                        sentences = [self.sentences[i] for i in indices],
+                        id_to_label = self.id_to_label,
+                        label_def = self.label_def,
+                        pad_start = self.pad_start,
+                        lookups = self.span_lookups,
+                        subtype_default = subtype_default)
@@ -1,6 +1,9 @@
+import json
 import logging
 import os
+import time
 from collections import OrderedDict
+from functools import partial
 
 import joblib
 import pandas as pd
@@ -13,18 +16,23 @@ import torch.optim as optim
 import torch.utils.data as data_utils
 from torch.nn.utils.clip_grad import clip_grad_norm_
 from tqdm import tqdm
-from transformers import AutoConfig
 
 import config.constants as C
 from models.attention import MultitaskAttention
+from models.batching import BucketBatchSampler, sequence_label_names, trim_collate
 from models.crf import MultitaskCRF
 from models.multitask_dataset import MultitaskDataset, get_label_map
 from models.recurrent import Recurrent
+from models.telemetry import TrainingLog
 
 # from models.utils import create_Tensorboard_writer
 # from models.utils import get_device, mem_size
 # from models.multitask_dataset import get_label_map
-from models.utils import loss_reduction, nested_dict_to_list
+from models.utils import loss_reduction
+from spert_utils.spert_io import ENTITIES
+from utils.lazy_import import lazy_import
+
+transformers = lazy_import('transformers')
 
 
 class MultitaskModel(nn.Module):
@@ -91,6 +99,7 @@ class MultitaskModel(nn.Module):
 
         # Logging
         log_dir = None,
+        log_interval = 10,
 
         # Training
         max_len = 50,
@@ -101,9 +110,17 @@ class MultitaskModel(nn.Module):
         grad_max_norm = 1,
         overall_reduction = 'sum',
 
+        # Batching
+        bucket_batches = False,
+        bucket_size = 50,
+        pin_memory = True,
+        persistent_workers = True,
+        tokens_per_step = None,
+
         # Input processing
         pad_start = True,
         pad_end = True,
+        embed_cache_dir = None,
 
 
         ):
@@ -155,7 +172,10 @@ class MultitaskModel(nn.Module):
         self.crf_reduction = crf_reduction
 
         # Logging
+        # log_dir: directory for per-step training log (see TrainingLog), None to disable
+        # log_interval: steps per training log row
         self.log_dir = log_dir
+        self.log_interval = log_interval
 
         # Training
         self.max_len = max_len
@@ -167,15 +187,29 @@ class MultitaskModel(nn.Module):
         self.grad_max_norm = grad_max_norm
         self.overall_reduction = overall_reduction
 
+        # Batching
+        # bucket_batches: group sentences of similar length and trim batches to longest sentence
+        # bucket_size: batches per length bucket
+        # tokens_per_step: accumulate gradients until batches reach this many (unpadded) tokens,
+        #                  None will update after each batch
+        self.bucket_batches = bucket_batches
+        self.bucket_size = bucket_size
+        self.pin_memory = pin_memory
+        self.persistent_workers = persistent_workers
+        self.tokens_per_step = tokens_per_step
+
         # Input processing
         self.pad_start = pad_start
         self.pad_end = pad_end
 
+        # directory for memory-mapped embedding cache, None to disable
+        self.embed_cache_dir = embed_cache_dir
+
 
         # Number of tags per label
         _, _, self.num_tags = get_label_map(self.label_def)
 
-        bert_config = AutoConfig.from_pretrained(self.pretrained_path)
+        bert_config = transformers.AutoConfig.from_pretrained(self.pretrained_path)
         self.bert_size = bert_config.hidden_size
 
         # Recurrent layer
@@ -337,16 +371,14 @@ class MultitaskModel(nn.Module):
                                 device = device,
                                 max_len = self.max_len,
                                 num_workers = self.num_workers,
-                                mode = 'fit'
+                                mode = 'fit',
+                                cache_dir = self.embed_cache_dir
                                 )
 
 
 
         # Create data loader
-        dataloader = data_utils.DataLoader(dataset, \
-                                batch_size = self.batch_size,
-                                shuffle = True,
-                                num_workers = self.num_workers)
+        dataloader = self.get_dataloader(dataset, device=device)
 
         # Create optimizer
         optimizer = optim.Adam(self.parameters(), \
@@ -357,29 +389,51 @@ class MultitaskModel(nn.Module):
         #                             dir_ = self.log_dir,
         #                             use_subfolder = self.log_subfolder)
 
+        # Per-step training log
+        training_log = TrainingLog( \
+                                path = self.log_dir,
+                                interval = self.log_interval,
+                                device = device)
+
         # Loop on epochs
         num_epochs_tot = self.epochs
         pbar = tqdm(total=num_epochs_tot)
         j_bat = 0
         for j in range(num_epochs_tot):
 
+            # Detached tensors, to avoid keeping graphs and device syncs
             loss_epoch_tot = 0
             loss_epoch_sep = OrderedDict([(k, 0) for k in self.label_def])
             grad_norm_orig = 0
             grad_norm_clip = 0
 
+            # Throughput
+            t0 = time.time()
+            t_step = time.perf_counter()
+            token_count = 0
+            padded_count = 0
+            step_tokens = 0
+            step_count = 0
+            batch_count = 0
+
+            # Reset gradients
+            self.zero_grad()
+
             # Loop on mini-batches
             for i, (X_, mask_, y_) in  enumerate(dataloader):
 
-                # Reset gradients
-                self.zero_grad()
+                # Token counts, before moving mask to device
+                batch_tokens = int(mask_.sum())
+                token_count += batch_tokens
+                padded_count += mask_.numel()
+                step_tokens += batch_tokens
 
-                X_ = X_.to(device)
-                mask_ = mask_.to(device)
+                X_ = X_.to(device, non_blocking=True)
+                mask_ = mask_.to(device, non_blocking=True)
 
                 for K, V in y_.items():
                     for k, v in V.items():
-                        V[k] = v.to(device)
+                        V[k] = v.to(device, non_blocking=True)
 
 
                 # Push data through model
@@ -391,39 +445,73 @@ class MultitaskModel(nn.Module):
 
                 # Back probably
                 loss_bat_tot.backward()
-                grad_norm_orig += clip_grad_norm_(self.parameters(), \
-                                                     self.grad_max_norm)
-                grad_norm_clip += clip_grad_norm_(self.parameters(), \
-                                                           100000000.0)
-                optimizer.step()
+
+                # Update once token budget reached (or after each batch)
+                grad_norm = None
+                if (self.tokens_per_step is None) or (step_tokens >= self.tokens_per_step) or \
+                   (i == len(dataloader) - 1):
+
+                    # Norm before clipping. Norm after clipping is at most grad_max_norm
+                    grad_norm = clip_grad_norm_(self.parameters(), \
+                                                         self.grad_max_norm).detach()
+                    grad_norm_orig += grad_norm
+                    grad_norm_clip += grad_norm.clamp(max=self.grad_max_norm)
+                    optimizer.step()
+                    self.zero_grad()
+                    step_tokens = 0
+                    step_count += 1
+
+                # Step latency, including data loading
+                t_now = time.perf_counter()
+                training_log.step( \
+                                epoch = j,
+                                iteration = i,
+                                loss = loss_bat_tot,
+                                losses = loss,
+                                grad_norm = grad_norm,
+                                tokens = batch_tokens,
+                                step_sec = t_now - t_step)
+                t_step = t_now
 
                 # if self.writer is not None:
                 #     self.writer.add_scalar('loss_batch', loss_bat_tot, j_bat)
                 j_bat += 1
 
                 # Epoch loss
-                loss_epoch_tot += loss_bat_tot.item()
+                batch_count += 1
+                loss_epoch_tot += loss_bat_tot.detach()
                 for k in loss_epoch_sep:
-                    loss_epoch_sep[k] += loss[k]
-
+                    loss_epoch_sep[k] += loss[k].detach()
 
+            # Partial sampling interval at end of epoch
+            training_log.flush()
 
-            # Average across epochs
-            loss_epoch_tot = loss_epoch_tot/i
+            # Average across batches (and steps), zero for an empty data loader
+            if batch_count == 0:
+                logging.warn(f"No batches in epoch {j}")
+            loss_epoch_tot = float(loss_epoch_tot)/max(batch_count, 1)
             for k in loss_epoch_sep:
-                loss_epoch_sep[k] += loss_epoch_sep[k]/i
-            grad_norm_orig = grad_norm_orig/i
-            grad_norm_clip = grad_norm_clip/i
+                loss_epoch_sep[k] = float(loss_epoch_sep[k])/max(batch_count, 1)
+            grad_norm_orig = float(grad_norm_orig)/max(step_count, 1)
+            grad_norm_clip = float(grad_norm_clip)/max(step_count, 1)
+
+            elapsed = time.time() - t0
+            tokens_per_sec = token_count/elapsed if elapsed > 0 else 0.0
+            padding = 1 - token_count/float(max(padded_count, 1))
 
             msg = []
             msg.append('epoch={}'.format(j))
             msg.append('{}={:.1e}'.format('Total', loss_epoch_tot))
             for k, v in loss_epoch_sep.items():
                 msg.append('{}={:.1e}'.format(k, v))
+            msg.append('tok/s={:.0f}'.format(tokens_per_sec))
             msg = ", ".join(msg)
             pbar.set_description(desc=msg)
             pbar.update()
 
+            logging.info('epoch={}, tokens={}, tokens/sec={:.1f}, padding={:.3f}, steps={}, grad_norm={:.2e}, grad_norm_clip={:.2e}'.format( \
+                                            j, token_count, tokens_per_sec, padding, step_count, grad_norm_orig, grad_norm_clip))
+
             # https://github.com/lanpa/tensorboard-pytorch-examples/blob/master/imagenet/main.py
             # if self.writer is not None:
             #     self.writer.add_scalar('loss_epoch_tot', loss_epoch_tot, j)
@@ -433,15 +521,55 @@ class MultitaskModel(nn.Module):
             #     self.writer.add_scalar('grad_norm_clip', grad_norm_clip, j)
 
         pbar.close()
+        training_log.close()
 
+        return training_log.rows
 
 
-    def predict(self, dataset_path, device=None, batch_size_pred=200):
+    def get_dataloader(self, dataset, device=None, shuffle=True, batch_size=None):
         '''
-        Train multitask model
+        Data loader for fit, with length-bucketed batches if bucket_batches
         '''
 
+        batch_size = self.batch_size if batch_size is None else batch_size
+
+        # Pinned memory only helps host to GPU copies
+        pin_memory = self.pin_memory and torch.cuda.is_available() and \
+                     (device is not None) and (torch.device(device).type != 'cpu')
 
+        kwargs = dict( \
+                    num_workers = self.num_workers,
+                    pin_memory = pin_memory,
+                    persistent_workers = self.persistent_workers and (self.num_workers > 0))
+
+        if self.bucket_batches:
+            batch_sampler = BucketBatchSampler( \
+                                    lengths = dataset.mask.sum(1),
+                                    batch_size = batch_size,
+                                    bucket_size = self.bucket_size,
+                                    shuffle = shuffle)
+            return data_utils.DataLoader(dataset, \
+                                    batch_sampler = batch_sampler,
+                                    collate_fn = partial(trim_collate, \
+                                            sequence_names = sequence_label_names(self.label_def)),
+                                    **kwargs)
+
+        return data_utils.DataLoader(dataset, \
+                                batch_size = batch_size,
+                                shuffle = shuffle,
+                                **kwargs)
+
+
+
+    def predict(self, dataset_path, device=None, batch_size_pred=200, path=None, \
+                        subtype_default=C.SUBTYPE_DEFAULT):
+        '''
+        Predict events for SpERT sentences in dataset_path
+
+        Predictions are decoded a batch at a time, and returned as SpERT
+        sentences (see decode_batch). If path is not None, the predictions
+        are also saved as JSON, e.g. for import_spert_corpus_multi.
+        '''
 
         # Get/set device
         self.to(device)
@@ -464,7 +592,8 @@ class MultitaskModel(nn.Module):
                                 device = device,
                                 max_len = self.max_len,
                                 num_workers = self.num_workers,
-                                mode = 'predict'
+                                mode = 'predict',
+                                cache_dir = self.embed_cache_dir
                                 )
 
 
@@ -475,41 +604,38 @@ class MultitaskModel(nn.Module):
                                 num_workers = self.num_workers)
 
         # Loop on mini-batches
-        total = len(dataset)/self.batch_size + 1
-        pbar = tqdm(total=total)
-
-        y_pred = []
+        pbar = tqdm(total=len(dataloader))
 
-        for i, (X_, mask_) in enumerate(dataloader):
+        predictions = []
+        i_sent = 0
+        with torch.no_grad():
+            for X_, mask_ in dataloader:
 
-            X_ = X_.to(device)
-            mask_ = mask_.to(device)
-
-            # Push data through model
-            pred, loss = self(X=X_, mask=mask_)
-
-            # Convert from pytorch tensor to list
-            for K, V in pred.items():
-                for k, v in V.items():
-                    if isinstance(v, torch.Tensor):
-                        V[k] = v.tolist()
-
-            # Convert to list of nested dict
-            pred = nested_dict_to_list(pred)
+                X_ = X_.to(device)
+                mask_ = mask_.to(device)
 
-            # Append over batches
-            y_pred.extend(pred)
+                # Push data through model
+                pred, _ = self(X=X_, mask=mask_)
 
+                # Decode batch
+                n = len(X_)
+                predictions.extend(dataset.decode_batch(pred, range(i_sent, i_sent + n), \
+                                                            subtype_default = subtype_default))
+                i_sent += n
 
-            pbar.update()
+                pbar.update()
 
         pbar.close()
 
+        assert len(predictions) == len(dataset)
+
+        entity_count = sum([len(sent[ENTITIES]) for sent in predictions])
+        logging.info(f"Predicted entities:\t{entity_count}")
 
-        # Post process predicitons
-        predictions = dataset.decode_(y_pred)
+        if path is not None:
+            json.dump(predictions, open(path, 'w'))
+            logging.info(f"Predictions saved:\t{path}")
 
-        assert False
         return predictions
 
     def get_summary(self):
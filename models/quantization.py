@@ -0,0 +1,157 @@
+import contextlib
+import hashlib
+import logging
+import os
+import pickle
+
+import torch
+import torch.nn as nn
+
+QUANTIZED_MODEL_FILE = "quantized_int8.pt"
+
+# checkpoint files the quantized cache is derived from. Other files in the
+# checkpoint directory (e.g. prediction caches) do not invalidate the cache
+CHECKPOINT_FILES = ["pytorch_model.bin", "model.safetensors", "config.json", "vocab.txt"]
+
+# from_pretrained loading arguments, which are not model constructor arguments
+FROM_PRETRAINED_ARGS = ["cache_dir", "force_download", "resume_download", "proxies", \
+                        "local_files_only", "revision", "mirror", "use_auth_token", "output_loading_info",
+                        "from_tf", "from_flax", "state_dict", "torch_dtype", "low_cpu_mem_usage",
+                        "ignore_mismatched_sizes", "_fast_init"]
+
+
+def set_cpu_threads(num_threads=None):
+    '''
+    Set intra-op threads for CPU inference, defaulting to all available cores
+    '''
+
+    if num_threads is None:
+        num_threads = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+
+    torch.set_num_threads(num_threads)
+    logging.info(f"CPU threads: {torch.get_num_threads()}")
+
+    return num_threads
+
+
+def quantize_model(model):
+    '''
+    Dynamic int8 quantization of linear layers (weights int8, activations quantized on the fly)
+    '''
+
+    model.eval()
+    model = torch.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+    return model
+
+
+def checkpoint_mtime(path):
+    '''
+    Latest modification time of the checkpoint files in path (0 if none)
+    '''
+
+    files = [os.path.join(path, x) for x in CHECKPOINT_FILES]
+    return max([os.path.getmtime(x) for x in files if os.path.exists(x)], default=0)
+
+
+def cache_file_name(path, cache_file=QUANTIZED_MODEL_FILE):
+    '''
+    Cache file name for checkpoint path, so checkpoints can share a cache directory
+    '''
+
+    key = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()[:16]
+    stem, ext = os.path.splitext(cache_file)
+
+    return f"{stem}_{key}{ext}"
+
+
+def skip_weight_init():
+    '''
+    transformers context manager that skips weight initialization, as
+    weights are loaded afterwards (module location varies by version)
+    '''
+
+    try:
+        from transformers.modeling_utils import no_init_weights
+    except ImportError:
+        try:
+            from transformers.initialization import no_init_weights
+        except ImportError:
+            return contextlib.nullcontext()
+
+    return no_init_weights()
+
+
+def pretrained_builder(cls, *args, **kwargs):
+    '''
+    build_fn for load_quantized, creating the architecture of transformers
+    model class cls from its configuration, without reading or initializing
+    weights. args and kwargs are from_pretrained model arguments
+    '''
+
+    def build_fn(path):
+
+        model_kwargs = dict(kwargs)
+        config = model_kwargs.pop('config', None)
+        for k in FROM_PRETRAINED_ARGS:
+            model_kwargs.pop(k, None)
+        if config is None:
+            config = cls.config_class.from_pretrained(path)
+
+        with skip_weight_init():
+            return cls(config, *args, **model_kwargs)
+
+    return build_fn
+
+
+def load_quantized(path, load_fn, build_fn=None, cache_dir=None, cache_file=QUANTIZED_MODEL_FILE):
+    '''
+    Load quantized model from cache, or load with load_fn, quantize, and cache
+
+    The cache holds the quantized state dict (tensors only). On a cache hit,
+    the state dict is loaded into the quantized architecture from build_fn,
+    so the fp32 weights are not read, and loading does not unpickle
+    arbitrary objects (torch.load defaults to weights_only)
+
+    Parameters
+    ----------
+    path: checkpoint directory
+    load_fn: callable returning fp32 model for path
+    build_fn: callable returning the fp32 architecture for path, without
+        loading weights (e.g. pretrained_builder). None will disable the cache
+    cache_dir: directory for the quantized cache, kept out of the checkpoint
+        directory (read-only). None will disable the cache
+    '''
+
+    f = None
+    if (cache_dir is not None) and (build_fn is not None) and os.path.isdir(path):
+        f = os.path.join(cache_dir, cache_file_name(path, cache_file))
+
+    if (f is not None) and os.path.exists(f) and \
+        (os.path.getmtime(f) >= checkpoint_mtime(path)):
+        logging.info(f"Loading cached quantized model: {f}")
+        try:
+            model = quantize_model(build_fn(path))
+            model.load_state_dict(torch.load(f, map_location='cpu'))
+            model.eval()
+            return model
+        except (OSError, RuntimeError, pickle.UnpicklingError) as e:
+            # e.g. stale cache, or whole model pickled by earlier versions
+            logging.warn(f"Could not load cached quantized model, requantizing: {e}")
+
+    model = quantize_model(load_fn(path))
+    logging.info(f"Model quantized (dynamic int8): {path}")
+
+    if f is not None:
+        try:
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir, exist_ok=True)
+            # write to temporary file, as parallel shards may share the cache
+            tmp = f"{f}.{os.getpid()}.tmp"
+            torch.save(model.state_dict(), tmp)
+            os.replace(tmp, f)
+            logging.info(f"Quantized model cached: {f}")
+        except (OSError, RuntimeError) as e:
+            logging.warn(f"Could not cache quantized model: {e}")
+
+    return model
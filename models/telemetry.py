@@ -0,0 +1,226 @@
+import csv
+import json
+import math
+import os
+import resource
+from collections import OrderedDict
+
+import numpy as np
+import torch
+
+'''
+Training telemetry
+
+Per-step losses, gradient norms, throughput, step latency, and peak memory,
+written every interval steps to CSV and JSONL. The CSV can be plotted with
+spert_io.plot_loss (columns "global_iteration", "loss", and "loss_avg").
+
+Losses and gradient norms are accumulated as detached tensors and only
+converted to floats when a row is written, so logging neither keeps
+autograd graphs alive nor synchronizes the device on every step.
+'''
+
+LOSS_CSV = "loss_train.csv"
+LOSS_JSONL = "loss_train.jsonl"
+
+EPOCH = "epoch"
+ITERATION = "iteration"
+GLOBAL_ITERATION = "global_iteration"
+STEPS = "steps"
+LOSS = "loss"
+LOSS_AVG = "loss_avg"
+GRAD_NORM = "grad_norm"
+TOKENS = "tokens"
+TOKENS_PER_SEC = "tokens_per_sec"
+STEP_MS = "step_ms"
+PEAK_MEMORY = "peak_memory_mb"
+
+PERCENTILES = (50, 90, 99)
+
+MB = 2**20
+
+
+def detach(x):
+    if isinstance(x, torch.Tensor):
+        return x.detach()
+    return x
+
+def to_float(x):
+    if x is None:
+        return math.nan
+    if isinstance(x, torch.Tensor):
+        return x.item()
+    return float(x)
+
+def accumulate(total, x):
+    x = detach(x)
+    return x if total is None else total + x
+
+def peak_memory(device=None):
+    '''
+    Peak memory in MB: allocated CUDA memory for CUDA devices, otherwise process peak RSS
+    '''
+
+    if (device is not None) and torch.cuda.is_available() and (torch.device(device).type == 'cuda'):
+        return torch.cuda.max_memory_allocated(device)/MB
+
+    # ru_maxrss in kB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024/MB
+
+
+class TrainingLog(object):
+    '''
+    Sampled per-step training metrics
+
+    Usage:
+        log = TrainingLog(path=log_dir, interval=10)
+        for ...:
+            ...
+            log.step(epoch, iteration, loss, losses=loss_by_layer, grad_norm=norm, tokens=n, step_sec=t)
+        log.close()
+
+    Parameters
+    ----------
+    path: output directory for loss_train.csv and loss_train.jsonl. None will only keep rows in memory
+    interval: steps per row. Losses and gradient norms are averaged over the
+        steps in each row, and step latency percentiles are computed over them
+    device: training device, for peak memory
+    '''
+
+    def __init__(self, path=None, interval=10, device=None):
+
+        self.path = path
+        self.interval = max(int(interval), 1)
+        self.device = device
+
+        self.rows = []
+        self.global_iteration = 0
+        self.loss_sum = 0.0
+        self.loss_count = 0
+        self.epoch = None
+        self.iteration = None
+
+        self.csv_file = None
+        self.csv_writer = None
+        self.jsonl_file = None
+        if self.path is not None:
+            if not os.path.exists(self.path):
+                os.makedirs(self.path)
+            self.csv_file = open(os.path.join(self.path, LOSS_CSV), 'w', newline='')
+            self.jsonl_file = open(os.path.join(self.path, LOSS_JSONL), 'w')
+
+        self.reset_window()
+
+    def reset_window(self):
+
+        self.window_steps = 0
+        self.window_loss = None
+        self.window_losses = OrderedDict()
+        self.window_grad_norm = None
+        self.window_grad_steps = 0
+        self.window_tokens = 0
+        self.window_times = []
+
+    def step(self, epoch, iteration, loss, losses=None, grad_norm=None, tokens=0, step_sec=None):
+        '''
+        Record one training step
+
+        Parameters
+        ----------
+        loss: total loss
+        losses: dict of loss by output layer
+        grad_norm: gradient norm before clipping. None if no optimizer step was taken
+        tokens: unpadded tokens in the batch
+        step_sec: step latency in seconds, including data loading
+
+        returns the row written, if any
+        '''
+
+        self.epoch = epoch
+        self.iteration = iteration
+        self.global_iteration += 1
+        self.window_steps += 1
+
+        self.window_loss = accumulate(self.window_loss, loss)
+        if losses is not None:
+            for k, v in losses.items():
+                self.window_losses[k] = accumulate(self.window_losses.get(k), v)
+
+        if grad_norm is not None:
+            self.window_grad_norm = accumulate(self.window_grad_norm, grad_norm)
+            self.window_grad_steps += 1
+
+        self.window_tokens += tokens
+        if step_sec is not None:
+            self.window_times.append(step_sec)
+
+        if self.window_steps >= self.interval:
+            return self.flush()
+        return None
+
+    def flush(self):
+        '''
+        Write a row for the steps recorded since the last row
+        '''
+
+        if self.window_steps == 0:
+            return None
+
+        n = self.window_steps
+
+        loss_sum = to_float(self.window_loss)
+        self.loss_sum += loss_sum
+        self.loss_count += n
+
+        row = OrderedDict()
+        row[EPOCH] = self.epoch
+        row[ITERATION] = self.iteration
+        row[GLOBAL_ITERATION] = self.global_iteration
+        row[STEPS] = n
+        row[LOSS] = loss_sum/n
+        row[LOSS_AVG] = self.loss_sum/self.loss_count
+        for k, v in self.window_losses.items():
+            row[f"{LOSS}_{k}"] = to_float(v)/n
+        row[GRAD_NORM] = to_float(self.window_grad_norm)/self.window_grad_steps \
+                                                    if self.window_grad_steps > 0 else math.nan
+
+        seconds = sum(self.window_times)
+        row[TOKENS] = self.window_tokens
+        row[TOKENS_PER_SEC] = self.window_tokens/seconds if seconds > 0 else math.nan
+        if self.window_times:
+            percentiles = np.percentile(np.array(self.window_times)*1e3, PERCENTILES)
+        else:
+            percentiles = [math.nan]*len(PERCENTILES)
+        for p, v in zip(PERCENTILES, percentiles):
+            row[f"{STEP_MS}_p{p}"] = float(v)
+        row[PEAK_MEMORY] = peak_memory(self.device)
+
+        self.write(row)
+        self.rows.append(row)
+        self.reset_window()
+
+        return row
+
+    def write(self, row):
+
+        if self.csv_file is not None:
+            if self.csv_writer is None:
+                self.csv_writer = csv.DictWriter(self.csv_file, fieldnames=list(row.keys()), extrasaction='ignore')
+                self.csv_writer.writeheader()
+            self.csv_writer.writerow(row)
+            self.csv_file.flush()
+
+        if self.jsonl_file is not None:
+            row = OrderedDict([(k, None if (isinstance(v, float) and math.isnan(v)) else v) for k, v in row.items()])
+            self.jsonl_file.write(json.dumps(row) + '\n')
+            self.jsonl_file.flush()
+
+    def close(self):
+
+        self.flush()
+
+        for f in [self.csv_file, self.jsonl_file]:
+            if f is not None:
+                f.close()
+        self.csv_file = None
+        self.jsonl_file = None
@@ -3,7 +3,9 @@
 
 
 
-from transformers import AutoTokenizer, AutoModel
+import os
+from functools import lru_cache, partial
+
 
 import torch
 import torch.utils.data as data_utils
@@ -13,7 +15,12 @@ from tqdm import tqdm
 import numpy as np
 import logging
 
+from models.quantization import load_quantized, set_cpu_threads, skip_weight_init
 from models.utils import trunc_seqs, pad_sequences
+from utils.lazy_import import lazy_import
+
+transformers = lazy_import('transformers')
+
 # from models.utils import get_device
 # from models.similarity import normalize_embed
 
@@ -91,13 +98,18 @@ def docs2wordpiece(docs, xfmr_type, xfmr_dir):
 
     return (word_pieces, word_piece_ids)
 
-def tokens2wordpiece(tokens, tokenizer_path, get_last=True):
+@lru_cache(maxsize=None)
+def load_tokenizer(tokenizer_path):
     '''
-    Get word-word pieces and alignment for sentences
+    Load tokenizer once per path
     '''
+    return transformers.AutoTokenizer.from_pretrained(tokenizer_path)
 
-    # Get tokenizer
-    tokenizer = AutoTokenizer.from_pretrained(tokenizer_path)
+
+def tokens2wordpiece_slow(tokens, tokenizer, get_last=True):
+    '''
+    Word-piece alignment, one token at a time (non-fast tokenizers)
+    '''
 
     # Word piece tokens
     word_pieces = []
@@ -141,6 +153,82 @@ def tokens2wordpiece(tokens, tokenizer_path, get_last=True):
     for wrd_pc in word_pieces:
         word_piece_ids.append(tokenizer.convert_tokens_to_ids(wrd_pc))
 
+    return (word_pieces, word_piece_ids, token_indices)
+
+
+def tokens2wordpiece_fast(tokens, tokenizer, get_last=True, batch_size=2000):
+    '''
+    Word-piece alignment using batched fast (Rust) tokenizer
+
+    Equivalent to tokens2wordpiece_slow, including tokens that
+    produce no word pieces (indices point at the previous piece
+    for get_last and the next piece otherwise)
+    '''
+
+    cls_id, sep_id = tokenizer.convert_tokens_to_ids([CLS, SEP])
+
+    word_pieces = []
+    word_piece_ids = []
+    token_indices = []
+
+    for i in range(0, len(tokens), batch_size):
+        batch = [list(sent) for sent in tokens[i:i + batch_size]]
+
+        # fast tokenizer does not accept empty sentences
+        nonempty = [sent for sent in batch if len(sent) > 0]
+        encodings = []
+        if len(nonempty) > 0:
+            encodings = tokenizer(nonempty, \
+                            is_split_into_words = True,
+                            add_special_tokens = False,
+                            return_attention_mask = False,
+                            return_token_type_ids = False).encodings
+        encodings = iter(encodings)
+
+        for sent in batch:
+
+            if len(sent) == 0:
+                pieces, ids, word_ids = [], [], []
+            else:
+                enc = next(encodings)
+                pieces, ids, word_ids = enc.tokens, enc.ids, enc.word_ids
+
+            # word piece count per token
+            counts = [0]*len(sent)
+            for w in word_ids:
+                counts[w] += 1
+
+            # first or last word piece per token, offset by [CLS]
+            tok_idxs = [0]
+            n = 1
+            for c in counts:
+                if not get_last:
+                    tok_idxs.append(n)
+                n += c
+                if get_last:
+                    tok_idxs.append(n - 1)
+            tok_idxs.append(n)
+
+            word_pieces.append([CLS] + list(pieces) + [SEP])
+            word_piece_ids.append([cls_id] + list(ids) + [sep_id])
+            token_indices.append(tok_idxs)
+
+    return (word_pieces, word_piece_ids, token_indices)
+
+
+def tokens2wordpiece(tokens, tokenizer_path, get_last=True):
+    '''
+    Get word-word pieces and alignment for sentences
+    '''
+
+    # Get tokenizer
+    tokenizer = load_tokenizer(tokenizer_path)
+
+    if tokenizer.is_fast:
+        word_pieces, word_piece_ids, token_indices = tokens2wordpiece_fast(tokens, tokenizer, get_last=get_last)
+    else:
+        word_pieces, word_piece_ids, token_indices = tokens2wordpiece_slow(tokens, tokenizer, get_last=get_last)
+
 
     logging.info('XFMR word pieces generated:')
     for i, (wt, wi, ti) in enumerate(zip(word_pieces, word_piece_ids, token_indices)):
@@ -214,11 +302,99 @@ def get_attn_mask(X, seq_len, dtype=np.int32):
 
 
 
+class WordPieceDataset(data_utils.Dataset):
+    '''
+    Variable length word piece sequences, padded per batch by collate
+    '''
+
+    def __init__(self, word_piece_ids, tok_idx):
+        self.word_piece_ids = word_piece_ids
+        self.tok_idx = tok_idx
+
+    def __len__(self):
+        return len(self.word_piece_ids)
+
+    def __getitem__(self, index):
+        return (index, self.word_piece_ids[index], self.tok_idx[index])
+
+
+def collate_word_pieces(batch, max_len=None, tok_idx_fill=-1):
+    '''
+    Pad batch to its own maximum word piece length
+    '''
+
+    indices, word_piece_ids, tok_idx = zip(*batch)
+
+    seq_len = max([len(w) for w in word_piece_ids])
+    if max_len is not None:
+        seq_len = min(seq_len, max_len)
+    idx_len = max([len(t) for t in tok_idx])
+
+    n = len(batch)
+    wp_ids_bat = torch.zeros((n, seq_len), dtype=torch.long)
+    attn_mask_bat = torch.zeros((n, seq_len), dtype=torch.long)
+    tok_idx_bat = torch.full((n, idx_len), tok_idx_fill, dtype=torch.long)
+    for i, (w, t) in enumerate(zip(word_piece_ids, tok_idx)):
+        k = min(len(w), seq_len)
+        wp_ids_bat[i, :k] = torch.tensor(w[:k], dtype=torch.long)
+        attn_mask_bat[i, :k] = 1
+        tok_idx_bat[i, :len(t)] = torch.tensor(t, dtype=torch.long)
+
+    return (torch.tensor(indices, dtype=torch.long), wp_ids_bat, attn_mask_bat, tok_idx_bat)
+
+
+def length_sorted_order(lengths, window):
+    '''
+    Sort indices by length within windows of consecutive sequences,
+    so batches have similar lengths without reordering the whole data set
+    '''
+    order = []
+    for i in range(0, len(lengths), window):
+        idx = list(range(i, min(i + window, len(lengths))))
+        order.extend(sorted(idx, key=lambda j: lengths[j], reverse=True))
+    return order
+
+
+def build_auto_model(pretrained_path):
+    '''
+    Transformer architecture from the configuration in pretrained_path,
+    without reading or initializing weights (see load_quantized)
+    '''
+    config = transformers.AutoConfig.from_pretrained(pretrained_path)
+    with skip_weight_init():
+        return transformers.AutoModel.from_config(config)
+
+
 def get_embeddings(word_piece_ids, tok_idx, pretrained_path, \
         max_len = None,
         num_workers = 6,
         batch_size = 100,
-        device = None):
+        device = None,
+        output_len = None,
+        dtype = np.float32,
+        sort_window = 50,
+        quantize = False,
+        num_threads = None,
+        output_path = None,
+        quantized_cache_dir = None):
+    '''
+    Get transformer embeddings at token indices
+
+    Batches are padded to their own maximum length and sequences are
+    sorted by length within windows of sort_window batches.
+
+    Returns list of per-sentence arrays or, if output_len is provided,
+    a single preallocated array of shape (seq_count, output_len, embed_dim)
+    with embeddings truncated/zero-padded to output_len
+
+    If output_path (.npy) is provided with output_len, batches are written
+    into a memory-mapped file, which is moved to output_path when complete,
+    and the array is returned memory-mapped (read-only), so the full array
+    is never held in memory
+
+    If quantize, the transformer runs on CPU with dynamic int8 quantization,
+    with the quantized weights cached in quantized_cache_dir, if provided
+    '''
 
     tok_idx_fill = -1
 
@@ -227,13 +403,21 @@ def get_embeddings(word_piece_ids, tok_idx, pretrained_path, \
     logging.info('='*72)
 
     # Get device
-    if device is None:
-        device = get_device()
+    if quantize:
+        device = torch.device('cpu')
+        set_cpu_threads(num_threads)
+    elif device is None:
+        device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 
     # Load pre-trained model (weights)
     logging.info('Loading xfmr...')
     logging.info('pretrained_path:\t{}'.format(pretrained_path))
-    model = AutoModel.from_pretrained(pretrained_path)
+    if quantize:
+        model = load_quantized(pretrained_path, transformers.AutoModel.from_pretrained, \
+                        build_fn = build_auto_model,
+                        cache_dir = quantized_cache_dir)
+    else:
+        model = transformers.AutoModel.from_pretrained(pretrained_path)
     logging.info('xfmr loaded')
 
     # Set model to evaluation mode (as opposed to train mode)
@@ -249,41 +433,39 @@ def get_embeddings(word_piece_ids, tok_idx, pretrained_path, \
     else:
         logging.info('Token indices provided, so outputting subset of word pieces')
 
-    # Get maximum length
-    if max_len is None:
-        max_len = max([len(w) for w in word_piece_ids])
-
-    # Create attention mask, indicating valid token positions
-    attn_mask = get_attn_mask(word_piece_ids, max_len)
-
-    # Pad
-    word_piece_ids = pad_sequences(word_piece_ids, max_len)
-    tok_idx = pad_sequences(tok_idx, max_len, fill=tok_idx_fill)
-
-    # Convert to tensor
-    word_piece_ids = torch.tensor(word_piece_ids)
-    tok_idx = torch.tensor(tok_idx)
-    attn_mask = torch.tensor(attn_mask)
-
-    # Create data set
-    dataset = data_utils.TensorDataset(word_piece_ids, attn_mask, tok_idx)
+    # Create data set, sorted by length within windows
+    dataset = WordPieceDataset(word_piece_ids, tok_idx)
+    lengths = [len(w) for w in word_piece_ids]
+    order = length_sorted_order(lengths, window=batch_size*sort_window)
 
     # Create data loader
     dataloader = data_utils.DataLoader(dataset, \
-                batch_size=batch_size,
-                shuffle = False,
-                num_workers=num_workers)
+                batch_size = batch_size,
+                sampler = order,
+                num_workers = num_workers,
+                collate_fn = partial(collate_word_pieces, max_len=max_len, tok_idx_fill=tok_idx_fill))
+
+    # Preallocate output
+    if output_len is None:
+        embeddings = [None]*len(dataset)
+    else:
+        embed_dim = model.config.hidden_size
+        shape = (len(dataset), output_len, embed_dim)
+        if output_path is None:
+            embeddings = np.zeros(shape, dtype=dtype)
+        else:
+            # new file is zero filled; written to temporary file, so incomplete arrays are never loaded
+            embeddings = np.lib.format.open_memmap(output_path + '.tmp', mode='w+', dtype=dtype, shape=shape)
 
     # Create progress bar
     pbar = tqdm(total=len(dataloader))
 
     # Loop on batches
     # Predict hidden states features for each layer
-    embeddings = []
-    for wp_ids_bat, attn_mask_bat, tok_idx_bat in dataloader:
+    for indices_bat, wp_ids_bat, attn_mask_bat, tok_idx_bat in dataloader:
 
         # Get embeddings (no gradient)
-        with torch.no_grad():
+        with torch.inference_mode():
             embed_bat = model( \
                   input_ids = wp_ids_bat.to(device),
                   token_type_ids = None,
@@ -291,24 +473,33 @@ def get_embeddings(word_piece_ids, tok_idx, pretrained_path, \
 
         # Convert to numpy array
         embed_bat = embed_bat.cpu().numpy()
-        tok_idx_bat = tok_idx_bat.cpu().numpy()
+        tok_idx_bat = tok_idx_bat.numpy()
+        indices_bat = indices_bat.numpy()
 
         # Loop on sequences and extract relevant embeddings
-        for embed_seq, tok_idx_seq in zip(embed_bat, tok_idx_bat):
+        for index, embed_seq, tok_idx_seq in zip(indices_bat, embed_bat, tok_idx_bat):
 
-            # Remove trailing zeros
+            # Remove trailing fill
             tok_idx_seq = tok_idx_seq[tok_idx_seq != tok_idx_fill]
 
             # Get embeddings associated with specific indices
-            embed_seq = embed_seq[tok_idx_seq, :]
-
-            embeddings.append(embed_seq)
+            if output_len is None:
+                embeddings[index] = embed_seq[tok_idx_seq, :]
+            else:
+                tok_idx_seq = tok_idx_seq[:output_len]
+                embeddings[index, :len(tok_idx_seq)] = embed_seq[tok_idx_seq, :]
 
         # Update progress bar
         pbar.update()
 
     pbar.close()
 
+    if (output_len is not None) and (output_path is not None):
+        embeddings.flush()
+        del embeddings
+        os.replace(output_path + '.tmp', output_path)
+        embeddings = np.load(output_path, mmap_mode='r')
+
 
     logging.info('XFMR embeddings generated:')
     for i, y in enumerate(embeddings):
@@ -22,6 +22,7 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')
 
 
 from corpus.corpus_brat import CorpusBrat
+from corpus.statistics import ANNOTATION_SUMMARY, LABEL_SUMMARY, TAG_SUMMARY
 from utils.custom_observer import CustomObserver
 from utils.proj_setup import make_and_clear
 
@@ -60,6 +61,10 @@ def cfg():
 
     id_pattern = None
 
+    # processes for corpus statistics (quality checks run serially, see
+    # benchmarks/benchmark_quality_check.py)
+    n_jobs = 1
+
     skip = None
 
     corpus_object = CorpusBrat
@@ -88,7 +93,7 @@ def cfg():
 
 @ex.automain
 def main(destination, source_file, fast_run,  \
-        labeled_arguments, required_arguments, id_pattern, event_types):
+        labeled_arguments, required_arguments, id_pattern, event_types, n_jobs):
 
     tokenizer = get_tokenizer()
 
@@ -99,15 +104,16 @@ def main(destination, source_file, fast_run,  \
 
     # corpus.span_histogram(path=destination, entity_types=event_types)
     # logging.info(f"Span histograms created")
-    #
-    # corpus.histogram(tokenizer=tokenizer, path=destination)
-    # logging.info(f"Histogram created")
+
+    corpus.histogram(tokenizer=tokenizer, path=destination)
+    logging.info(f"Histogram created")
 
     corpus.quality_check( \
                     path = destination,
                     labeled_arguments = labeled_arguments,
                     required_arguments = required_arguments,
-                    id_pattern = id_pattern)
+                    id_pattern = id_pattern,
+                    return_df = False)
     logging.info(f"Quality checks performed")
 
 
@@ -115,13 +121,11 @@ def main(destination, source_file, fast_run,  \
 
 
 
-    corpus.annotation_summary(path=destination)
-    logging.info(f"Annotation summary created")
-
-    corpus.label_summary(path=destination)
-    logging.info(f"Label summary created")
-
-    corpus.tag_summary(path=destination)
-    logging.info(f"Tag summary created")
+    # annotation, label, and tag summaries in a single pass
+    corpus.statistics( \
+                    path = destination,
+                    statistics = [ANNOTATION_SUMMARY, LABEL_SUMMARY, TAG_SUMMARY],
+                    n_jobs = n_jobs)
+    logging.info(f"Annotation, label, and tag summaries created")
 
     return 'Successful completion'
@@ -29,6 +29,7 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')
 
 from utils.custom_observer import CustomObserver
 from utils.proj_setup import make_and_clear
+from utils.results import SCORE_CACHE_FILE, ScoreCache
 
 from config.constants import CV, FIT, PREDICT, SCORE, PROB, SUBSET, TRAIN, TEST, DEV, CORPUS_FILE, PARAMS_FILE, TYPE, SUBTYPE
 from config.constants import ENTITIES, SCORES_FILE, NT, NP, TP, P, R, F1, SUBTYPE
@@ -67,6 +68,10 @@ def cfg():
 
     params = ["epochs", "prop_drop"]
 
+    # score file cache (outside destination, which is cleared) and read threads
+    cache_file = os.path.join(source_dir, SCORE_CACHE_FILE)
+    n_threads = 16
+
     #target_run = "e10_lr55_d02_bs10_ss1_ctL_ps___pd__"
 
     # Scratch directory
@@ -102,7 +107,8 @@ def cfg():
 @ex.automain
 def main(source_dir, destination, score_files, \
     event_types, argument_types,
-    trigger, labeled_arguments, span_only_arguments, params):
+    trigger, labeled_arguments, span_only_arguments, params,
+    cache_file, n_threads):
 
 
     # get all sub directories
@@ -123,23 +129,26 @@ def main(source_dir, destination, score_files, \
 
     score_file_dict = OrderedDict()
     for name, score_file in score_files.items():
-        dfs = []
         for result_dir in result_dirs:
-
-
             base = os.path.basename(result_dir)
+            k = (name, base)
+            score_file_dict[k] = os.path.join(result_dir, score_file)
 
-            target_file = os.path.join(result_dir, score_file)
+    # read all score files concurrently, reusing cached frames for unchanged files
+    cache = ScoreCache(cache_file, n_threads=n_threads)
+    score_dfs = cache.read(score_file_dict.values())
+    cache.save()
 
-            k = (name, base)
-            score_file_dict[k] = target_file
+    for name, score_file in score_files.items():
+        dfs = []
+        for result_dir in result_dirs:
 
-            df = pd.read_csv(target_file)
+            base = os.path.basename(result_dir)
+
+            df = score_dfs[score_file_dict[(name, base)]]
 
             # df = df[df["event"].isin(event_types)]
             # df = df[df["argument"].isin(argument_types)]
-            df["subtype"] = df["subtype"].fillna(value='na')
-
 
             dirname = result_dir.name
             df.insert(0, "run", dirname)
@@ -41,6 +41,7 @@ from spert_utils.convert_brat import RELATION_DEFAULT
 from spert_utils.spert_io import plot_loss
 
 from models.multitask_model import MultitaskModel
+from models.telemetry import LOSS_CSV
 
 
 import config.constants as C
@@ -366,11 +367,10 @@ def main(source_file, destination, config_path, model_config, spert_path, \
     Post process output
     '''
 
-    # loss_csv_file = os.path.join(model_config["log_path"], 'loss_avg_train.csv')
-    # plot_loss(loss_csv_file, loss_column='loss_avg')
-    #
-    # loss_csv_file = os.path.join(model_config["log_path"], 'loss_train.csv')
-    # plot_loss(loss_csv_file, loss_column='loss')
+    loss_csv_file = os.path.join(model_config["log_dir"], LOSS_CSV)
+    plot_loss(loss_csv_file, loss_column='loss_avg', \
+                destination_file=os.path.join(model_config["log_dir"], 'loss_avg_train.png'))
+    plot_loss(loss_csv_file, loss_column='loss')
     #
     # predict_file = os.path.join(model_config["log_path"], C.PREDICTIONS_JSON)
     #
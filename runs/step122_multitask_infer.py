@@ -202,24 +202,25 @@ def main(mode, source_file, source_dir, destination, config_path, model_path, sp
 
 
 
-    model = load_multitask_model(model_path)
-    model.predict(dataset_path=dataset_path, device=device)
+    predict_file = os.path.join(destination, "predictions_multitask.json")
 
-    assert False
+    model = load_multitask_model(model_path)
+    model.predict( \
+                dataset_path = dataset_path,
+                device = device,
+                path = predict_file,
+                subtype_default = label_definition["subtype_default"])
 
     '''
     Post process output
     '''
 
-
-    predict_file = os.path.join(model_config["log_path"], C.PREDICTIONS_JSON)
-
     merged_file = os.path.join(destination, C.PREDICTIONS_JSON)
-    merge_spert_files(model_config["dataset_path"], predict_file, merged_file)
+    merge_spert_files(dataset_path, predict_file, merged_file)
 
 
     logging.info(f"Scoring predictions")
-    logging.info(f"Gold file:                     {model_config['dataset_path']}")
+    logging.info(f"Gold file:                     {dataset_path}")
     logging.info(f"Prediction file, original:     {predict_file}")
     logging.info(f"Prediction file, merged_file:  {merged_file}")
 
@@ -1,13 +1,13 @@
 import json
-import pandas as pd
 import os
-import numpy as np
 from collections import Counter, OrderedDict
 
 
 import config.constants as C
-from corpus.corpus_brat import CorpusBrat
 from corpus.labels import Entity
+from utils.lazy_import import lazy_import
+
+pd = lazy_import('pandas')
 
 SCORE_TRIG = C.EXACT
 SCORE_SPAN = C.EXACT
@@ -1060,7 +1060,7 @@ def score_docs(gold_docs, predict_docs, labeled_args, \
 
 
 def score_brat(gold_dir, predict_dir, labeled_args, \
-                            corpus_class = CorpusBrat,
+                            corpus_class = None,
                             sample_count = None,
                             score_trig = SCORE_TRIG,
                             score_span = SCORE_SPAN,
@@ -1068,6 +1068,10 @@ def score_brat(gold_dir, predict_dir, labeled_args, \
                             path = None,
                             description = None):
 
+    # deferred, so importing scoring does not load the corpus/spaCy stack
+    if corpus_class is None:
+        from corpus.corpus_brat import CorpusBrat
+        corpus_class = CorpusBrat
 
     gold_corpus = corpus_class()
     gold_corpus.import_dir(gold_dir, n=sample_count)
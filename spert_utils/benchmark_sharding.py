@@ -0,0 +1,91 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from spert_utils.spert_shard import available_cores, run_sharded
+
+'''
+Scaling benchmark for sharded CPU inference
+
+python spert_utils/benchmark_sharding.py --dataset_path /home/lybarger/sdoh_challenge/output/eval/data_eval.json --model_path /home/lybarger/sdoh_challenge/output/model10/save/ --mspert_path /home/lybarger/mspert/ --destination /home/lybarger/sdoh_challenge/output/benchmark_sharding/ --shards 1 2 4 8 16 32 64
+'''
+
+
+def main(args):
+
+    cores = available_cores()
+    if args.cores is not None:
+        cores = cores[:args.cores]
+
+    sentences = json.load(open(args.dataset_path, 'r'))
+    token_count = sum([len(sent["tokens"]) for sent in sentences])
+
+    model_config = OrderedDict()
+    model_config["model_path"] = args.model_path
+    model_config["tokenizer_path"] = args.model_path
+    model_config["eval_batch_size"] = args.eval_batch_size
+    model_config["rel_filter_threshold"] = args.rel_filter_threshold
+    model_config["max_span_size"] = args.max_span_size
+    model_config["store_predictions"] = True
+    model_config["store_examples"] = False
+    model_config["sampling_processes"] = args.sampling_processes
+    model_config["max_pairs"] = args.max_pairs
+    model_config["no_overlapping"] = True
+
+    rows = []
+    for num_shards in args.shards:
+
+        if num_shards > len(cores):
+            logging.warn(f"Skipping {num_shards} shards, only {len(cores)} cores available")
+            continue
+
+        t0 = time.time()
+        run_sharded(model_config, args.dataset_path, \
+                    destination = os.path.join(args.destination, f'shards_{num_shards}'),
+                    mspert_path = args.mspert_path,
+                    num_shards = num_shards,
+                    cores = cores,
+                    cpu_quantized = args.cpu_quantized)
+        elapsed = time.time() - t0
+
+        rows.append((num_shards, len(cores)//num_shards, elapsed, token_count/elapsed))
+        logging.info(f"shards={num_shards}, seconds={elapsed:.1f}, tokens/sec={token_count/elapsed:.1f}")
+
+    df = pd.DataFrame(rows, columns=["shards", "threads_per_shard", "seconds", "tokens_per_sec"])
+    df["speedup"] = df["seconds"].iloc[0]/df["seconds"]
+    df["efficiency"] = df["speedup"]/(df["shards"]/df["shards"].iloc[0])
+    logging.info(f"Sharding benchmark:\n{df}")
+
+    f = os.path.join(args.destination, "benchmark_sharding.csv")
+    df.to_csv(f, index=False)
+
+    return 'Successful completion'
+
+
+if __name__ == '__main__':
+
+    logging.basicConfig(level=logging.INFO)
+
+    arg_parser = argparse.ArgumentParser(add_help=False)
+    arg_parser.add_argument('--dataset_path', type=str, help="path to spert input (data_eval.json)", required=True)
+    arg_parser.add_argument('--destination', type=str, help="path to output directory", required=True)
+    arg_parser.add_argument('--mspert_path', type=str, help="path to mspert", required=True)
+    arg_parser.add_argument('--model_path', type=str, help="fine-tuned mspert model", required=True)
+    arg_parser.add_argument('--shards', type=int, default=[1, 2, 4, 8], nargs='+', help="shard counts to benchmark")
+    arg_parser.add_argument('--cores', type=int, default=None, help="number of cores to use. None will use all available cores")
+    arg_parser.add_argument('--cpu_quantized', default=False, action='store_true', help="use dynamic int8 quantization")
+    arg_parser.add_argument('--eval_batch_size', type=int, default=2, help="evaluation batch size")
+    arg_parser.add_argument('--rel_filter_threshold', type=float, default=0.5, help="relation filter threshold")
+    arg_parser.add_argument('--max_span_size', type=int, default=10, help="maximum span size")
+    arg_parser.add_argument('--sampling_processes', type=int, default=1, help="number of sampling processes per shard")
+    arg_parser.add_argument('--max_pairs', type=int, default=1000, help="maximum relation pairs")
+    args, _ = arg_parser.parse_known_args()
+
+    sys.exit(main(args))
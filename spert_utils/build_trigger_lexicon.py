@@ -0,0 +1,73 @@
+import argparse
+import logging
+import os
+import sys
+
+import joblib
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import config.constants as C
+from spert_utils.spert_prefilter import build_lexicon
+from utils.misc import get_include
+
+'''
+Build the trigger lexicon used by infer_mspert --prefilter
+
+The lexicon is built from the training subset and saved in the model
+directory. Trigger recall and the fraction of sentences skipped are
+estimated on the dev subset for each context window, and the stats for
+the selected window are saved with the lexicon.
+
+python spert_utils/build_trigger_lexicon.py --source_file /home/lybarger/sdoh_challenge/output/corpus.pkl --model_path /home/lybarger/sdoh_challenge/output/model/save/ --windows 0 1 2 --window 1
+'''
+
+
+def main(args):
+
+    corpus = joblib.load(args.source_file)
+
+    f = os.path.join(args.model_path, C.LABEL_DEFINITION_FILE)
+    label_definition = joblib.load(f)
+    event_types = label_definition["event_types"]
+
+    lexicon = build_lexicon(corpus, event_types, \
+                        include = get_include([args.train_subset, args.source]),
+                        min_count = args.min_count,
+                        window = args.window)
+
+    dev_sentences = corpus.events2spert_multi( \
+                        include = get_include([args.dev_subset, args.source]),
+                        entity_types = label_definition["entity_types"],
+                        subtype_layers = label_definition["subtype_layers"],
+                        subtype_default = label_definition["subtype_default"])
+
+    # speed/recall trade-off across context windows
+    rows = [lexicon.evaluate(dev_sentences, event_types, window=w) for w in args.windows]
+    df = pd.DataFrame(rows)
+    logging.info(f"Prefilter trade-off on dev ({len(lexicon.terms)} terms):\n{df}")
+    df.to_csv(os.path.join(args.model_path, "trigger_lexicon_tradeoff.csv"), index=False)
+
+    lexicon.stats = lexicon.evaluate(dev_sentences, event_types)
+    f = lexicon.save(os.path.join(args.model_path, C.TRIGGER_LEXICON_FILE))
+    logging.info(f"Trigger lexicon saved: {f}")
+
+    return 'Successful completion'
+
+
+if __name__ == '__main__':
+
+    logging.basicConfig(level=logging.INFO)
+
+    arg_parser = argparse.ArgumentParser(add_help=False)
+    arg_parser.add_argument('--source_file', type=str, help="path to input corpus object", required=True)
+    arg_parser.add_argument('--model_path', type=str, help="fine-tuned mspert model, where the lexicon is saved", required=True)
+    arg_parser.add_argument('--train_subset', type=str, default=C.TRAIN, help="tag for lexicon subset")
+    arg_parser.add_argument('--dev_subset', type=str, default=C.DEV, help="tag for recall estimation subset")
+    arg_parser.add_argument('--source', type=str, default=None, help="tag for source from {None, 'uw', 'mimic'}. None will use both uw and mimic")
+    arg_parser.add_argument('--min_count', type=int, default=1, help="minimum trigger span count")
+    arg_parser.add_argument('--window', type=int, default=1, help="context window (sentences) saved with the lexicon")
+    arg_parser.add_argument('--windows', type=int, default=[0, 1, 2], nargs='+', help="context windows to evaluate on dev")
+    args, _ = arg_parser.parse_known_args()
+
+    sys.exit(main(args))
@@ -3,7 +3,6 @@ import argparse
 import json
 from collections import OrderedDict
 
-import spacy
 from tqdm import tqdm
 import os
 from pathlib import Path
@@ -12,6 +11,7 @@ import logging
 import re
 import string
 
+from corpus.tokenization import get_pipeline
 
 
 SPERT_ID = "id"
@@ -320,7 +320,7 @@ def get_allowable_types(path):
 
 def convert_brat(source_path, dest_path, spacy_model='en_core_web_sm', types_path=None, sample_count=None):
 
-    tokenizer = spacy.load(spacy_model)
+    tokenizer = get_pipeline(spacy_model)
 
 
     allowable_tb = get_allowable_types(types_path)
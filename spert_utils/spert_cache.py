@@ -0,0 +1,215 @@
+import copy
+import hashlib
+import json
+import logging
+import os
+from collections import OrderedDict
+
+import joblib
+import pandas as pd
+
+from spert_utils.spert_io import TOKENS, merge_spert_encodings
+
+'''
+Sentence-level memoization of SpERT predictions
+
+Clinical notes repeat boilerplate sentences (e.g. "Denies tobacco, alcohol,
+or illicit drug use.") many times, so predictions are computed once per
+unique token sequence and fanned back out to every (id, sent_index).
+'''
+
+CHECKPOINT_FILES = ["pytorch_model.bin", "config.json", "vocab.txt"]
+CHUNK_SIZE = 2**20
+
+
+def checkpoint_hash(model_path, settings=None, files=CHECKPOINT_FILES):
+    '''
+    Hash of model checkpoint files and any inference settings that
+    affect the predictions (e.g. relation filter threshold)
+    '''
+
+    h = hashlib.sha1()
+    for name in files:
+        f = os.path.join(model_path, name)
+        if not os.path.exists(f):
+            continue
+        h.update(name.encode())
+        with open(f, 'rb') as fp:
+            for chunk in iter(lambda: fp.read(CHUNK_SIZE), b''):
+                h.update(chunk)
+
+    if settings is not None:
+        h.update(json.dumps(settings, sort_keys=True, default=str).encode())
+
+    return h.hexdigest()
+
+
+def sent_key(sent):
+    return tuple(sent[TOKENS])
+
+
+def dedup_sentences(sentences):
+    '''
+    Identify unique token sequences
+
+    returns
+        unique: list of sentences, first occurrence of each token sequence
+        index_map: list mapping each input sentence to its position in unique
+    '''
+
+    positions = OrderedDict()
+    unique = []
+    index_map = []
+    for sent in sentences:
+        k = sent_key(sent)
+        if k not in positions:
+            positions[k] = len(unique)
+            unique.append(sent)
+        index_map.append(positions[k])
+
+    return (unique, index_map)
+
+
+def fan_out(sentences, unique_predictions, index_map):
+    '''
+    Map unique sentence predictions back to all sentences
+
+    Token-level spans are shared between duplicates, so only the document
+    specific fields (id, sent_index, offsets, doc_text) are restored from
+    the original sentences via merge_spert_encodings
+    '''
+
+    assert len(sentences) == len(index_map)
+
+    predict = [copy.deepcopy(unique_predictions[i]) for i in index_map]
+
+    return merge_spert_encodings(sentences, predict)
+
+
+class PredictionCache(object):
+    '''
+    Persistent LRU cache of sentence predictions keyed by (checkpoint hash, tokens)
+    '''
+
+    def __init__(self, path, checkpoint, max_size=100000):
+
+        self.path = path
+        self.checkpoint = checkpoint
+        self.max_size = max_size
+
+        self.hits = 0
+        self.misses = 0
+
+        self.cache = OrderedDict()
+        if (self.path is not None) and os.path.exists(self.path):
+            self.cache = joblib.load(self.path)
+            logging.info(f"Prediction cache loaded: {self.path} ({len(self.cache)} entries)")
+
+    def key(self, sent):
+        return (self.checkpoint, sent_key(sent))
+
+    def get(self, sent):
+
+        k = self.key(sent)
+        if k in self.cache:
+            self.cache.move_to_end(k)
+            self.hits += 1
+            return self.cache[k]
+
+        self.misses += 1
+        return None
+
+    def put(self, sent, prediction):
+
+        k = self.key(sent)
+        self.cache[k] = prediction
+        self.cache.move_to_end(k)
+
+        while len(self.cache) > self.max_size:
+            self.cache.popitem(last=False)
+
+    def save(self):
+
+        if self.path is None:
+            return False
+
+        d = os.path.dirname(self.path)
+        if d and not os.path.exists(d):
+            os.makedirs(d)
+
+        # write to temporary file, so an interrupted run does not corrupt the cache
+        f = self.path + '.tmp'
+        joblib.dump(self.cache, f)
+        os.replace(f, self.path)
+
+        return True
+
+    def hit_rate(self):
+        n = self.hits + self.misses
+        return self.hits/float(n) if n else 0.0
+
+
+def memoized_predict(dataset_path, unique_path, merged_file, predict_fn, cache=None, summary_path=None):
+    '''
+    Run SpERT inference once per unique (uncached) sentence
+
+    Parameters
+    ----------
+    dataset_path: path to SpERT input with all sentences
+    unique_path: path for SpERT input with unique, uncached sentences
+    merged_file: path for merged predictions with all sentences
+    predict_fn: callable taking unique_path and returning path to predictions
+    cache: PredictionCache or None
+    summary_path: path for CSV with deduplication and cache statistics
+    '''
+
+    sentences = json.load(open(dataset_path, 'r'))
+
+    unique, index_map = dedup_sentences(sentences)
+
+    # look up unique sentences in cache
+    unique_predictions = [None]*len(unique)
+    to_predict = []
+    for i, sent in enumerate(unique):
+        pred = None if cache is None else cache.get(sent)
+        if pred is None:
+            to_predict.append(i)
+        else:
+            unique_predictions[i] = pred
+
+    # run model on remaining sentences
+    if len(to_predict) > 0:
+        json.dump([unique[i] for i in to_predict], open(unique_path, 'w'))
+
+        predict_file = predict_fn(unique_path)
+        predictions = json.load(open(predict_file, 'r'))
+        assert len(predictions) == len(to_predict)
+
+        for i, pred in zip(to_predict, predictions):
+            assert pred[TOKENS] == unique[i][TOKENS]
+            unique_predictions[i] = pred
+            if cache is not None:
+                cache.put(unique[i], pred)
+
+    if cache is not None:
+        cache.save()
+
+    merged = fan_out(sentences, unique_predictions, index_map)
+    json.dump(merged, open(merged_file, "w"))
+
+    summary = OrderedDict()
+    summary["sentences"] = len(sentences)
+    summary["unique"] = len(unique)
+    summary["dedup_rate"] = 1 - len(unique)/float(len(sentences)) if sentences else 0.0
+    summary["cache_hits"] = 0 if cache is None else cache.hits
+    summary["cache_misses"] = len(to_predict)
+    summary["cache_hit_rate"] = 0.0 if cache is None else cache.hit_rate()
+    summary["cache_size"] = 0 if cache is None else len(cache.cache)
+    summary["predicted"] = len(to_predict)
+
+    df = pd.DataFrame(list(summary.items()), columns=["metric", "value"])
+    logging.info(f"Prediction memoization summary:\n{df}")
+    if summary_path is not None:
+        df.to_csv(summary_path, index=False)
+
+    return (merged, summary)
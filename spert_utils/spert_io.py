@@ -1,15 +1,11 @@
 from collections import Counter, OrderedDict
 import re
 import logging
-import pandas as pd
 import json
 import os
 import copy
 from pathlib import Path
 
-import matplotlib as mpl
-mpl.use('Agg')
-import matplotlib.pyplot as plt
 
 import sys
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -19,8 +15,10 @@ from corpus.document_predict import DocumentPredict
 
 from config.constants import SUBTYPE_DEFAULT
 
-from corpus.tokenization import get_tokenizer
 from corpus.brat import Attribute, Textbound, Event, get_unique_arg
+from utils.lazy_import import lazy_import, get_pyplot
+
+pd = lazy_import('pandas')
 
 
 
@@ -1143,9 +1141,6 @@ def spert_doc2brat_dicts_multi(spert_doc, subtype_default, event_types, swapped_
 
 def spert2doc_dict(input_file):
 
-
-    tokenizer = get_tokenizer()
-
     # load spert output
     spert_corpus = json.load(open(input_file, "r"))
 
@@ -1256,6 +1251,8 @@ def map_type2subtype(file_in, file_out, map_):
 def plot_loss(input_file, destination_file=None, iteration_column='global_iteration', loss_column='loss_avg'):
 
 
+    plt = get_pyplot()
+
     df = pd.read_csv(input_file)
 
     x = df[iteration_column]
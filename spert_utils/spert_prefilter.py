@@ -0,0 +1,222 @@
+import copy
+import json
+import logging
+import re
+from collections import OrderedDict
+
+from spert_utils.spert_io import ENTITIES, ID, RELATIONS, SUBTYPES, TOKENS, TYPE
+
+'''
+Lexicon-gated sentence prefilter for SpERT inference
+
+A trigger lexicon is built from the training corpus span histogram and
+compiled into a single regular expression (a word-level trie, so shared
+prefixes are matched once). Only sentences with a lexicon hit, or within
+a context window of a sentence with a hit in the same document, are sent
+to the model. Skipped sentences receive empty predictions.
+
+Trigger recall and the fraction of sentences skipped are estimated on dev
+data when the lexicon is built, so the speed/recall trade-off is visible.
+'''
+
+WORD_RE = re.compile(r'\w+')
+
+END = ''
+
+SENTENCES = "sentences"
+KEPT = "kept"
+SKIPPED_FRACTION = "skipped_fraction"
+TRIGGERS = "triggers"
+TRIGGERS_KEPT = "triggers_kept"
+TRIGGER_RECALL = "trigger_recall"
+WINDOW = "window"
+
+
+def normalize(text):
+    return tuple(WORD_RE.findall(text.lower()))
+
+
+def trie_regex(terms):
+    '''
+    Compile terms (tuples of words) into a regular expression over space separated words
+    '''
+
+    trie = {}
+    for term in terms:
+        node = trie
+        for word in term:
+            node = node.setdefault(word, {})
+        node[END] = {}
+
+    def continuation(node):
+        branches = [re.escape(word) + continuation(child) \
+                            for word, child in sorted(node.items()) if word != END]
+        if len(branches) == 0:
+            return ''
+        alt = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        if END in node:
+            return '(?: ' + alt + ')?'
+        return ' ' + alt
+
+    branches = [re.escape(word) + continuation(child) \
+                            for word, child in sorted(trie.items()) if word != END]
+    if len(branches) == 0:
+        # matches nothing
+        return re.compile(r'(?!x)x')
+
+    return re.compile(r'(?<!\w)(?:' + '|'.join(branches) + r')(?!\w)')
+
+
+class TriggerLexicon(object):
+    '''
+    Trigger lexicon and sentence prefilter
+
+    Parameters
+    ----------
+    terms: iterable of trigger strings
+    window: number of neighboring sentences (same document) kept around each hit
+    stats: dev set statistics from evaluate, saved with the lexicon
+    '''
+
+    def __init__(self, terms, window=1, stats=None):
+
+        self.terms = sorted(set([t for t in [normalize(term) for term in terms] if len(t) > 0]))
+        self.window = window
+        self.stats = OrderedDict() if stats is None else stats
+        self.pattern = trie_regex(self.terms)
+
+    def hit(self, tokens):
+        return self.pattern.search(' '.join(normalize(' '.join(tokens)))) is not None
+
+    def keep(self, sentences, window=None):
+        '''
+        Indices of sentences to keep, in original order
+        '''
+
+        window = self.window if window is None else window
+
+        hits = [self.hit(sent[TOKENS]) for sent in sentences]
+
+        keep = [False]*len(sentences)
+        for i, h in enumerate(hits):
+            if not h:
+                continue
+            for j in range(max(0, i - window), min(len(sentences), i + window + 1)):
+                if sentences[j].get(ID) == sentences[i].get(ID):
+                    keep[j] = True
+
+        return [i for i, k in enumerate(keep) if k]
+
+    def evaluate(self, sentences, trigger_types, window=None):
+        '''
+        Trigger recall and fraction of sentences skipped, on gold SpERT sentences
+        '''
+
+        window = self.window if window is None else window
+
+        keep = set(self.keep(sentences, window=window))
+
+        triggers = 0
+        triggers_kept = 0
+        for i, sent in enumerate(sentences):
+            n = len([e for e in sent[ENTITIES] if e[TYPE] in trigger_types])
+            triggers += n
+            if i in keep:
+                triggers_kept += n
+
+        stats = OrderedDict()
+        stats[WINDOW] = window
+        stats[SENTENCES] = len(sentences)
+        stats[KEPT] = len(keep)
+        stats[SKIPPED_FRACTION] = 1 - len(keep)/float(len(sentences)) if sentences else 0.0
+        stats[TRIGGERS] = triggers
+        stats[TRIGGERS_KEPT] = triggers_kept
+        stats[TRIGGER_RECALL] = triggers_kept/float(triggers) if triggers else 1.0
+
+        return stats
+
+    def save(self, path):
+        d = OrderedDict()
+        d["window"] = self.window
+        d["stats"] = self.stats
+        d["terms"] = [' '.join(t) for t in self.terms]
+        json.dump(d, open(path, 'w'), indent=4)
+        return path
+
+    @classmethod
+    def load(cls, path):
+        d = json.load(open(path, 'r'), object_pairs_hook=OrderedDict)
+        return cls(d["terms"], window=d["window"], stats=d["stats"])
+
+
+def build_lexicon(corpus, event_types, include=None, min_count=1, window=1):
+    '''
+    Build trigger lexicon from corpus span histogram
+    '''
+
+    df = corpus.span_histogram(include=include, entity_types=event_types)
+    df = df[df["count"] >= min_count]
+
+    logging.info(f"Trigger lexicon: {len(df)} spans with count >= {min_count}")
+
+    return TriggerLexicon(df["text"].tolist(), window=window)
+
+
+def empty_prediction(sent):
+    pred = copy.deepcopy(sent)
+    pred[ENTITIES] = []
+    pred[RELATIONS] = []
+    pred[SUBTYPES] = []
+    return pred
+
+
+def expand_predictions(sentences, keep, predictions):
+    '''
+    Combine predictions on kept sentences with empty predictions for skipped sentences
+    '''
+
+    assert len(keep) == len(predictions)
+
+    merged = [None]*len(sentences)
+    for i, pred in zip(keep, predictions):
+        assert pred[TOKENS] == sentences[i][TOKENS]
+        merged[i] = pred
+
+    return [empty_prediction(sent) if pred is None else pred for sent, pred in zip(sentences, merged)]
+
+
+def prefilter_file(dataset_path, filtered_path, lexicon):
+    '''
+    Write kept sentences to filtered_path
+
+    returns (all sentences, kept indices, summary)
+    '''
+
+    sentences = json.load(open(dataset_path, 'r'))
+    keep = lexicon.keep(sentences)
+    json.dump([sentences[i] for i in keep], open(filtered_path, 'w'))
+
+    summary = OrderedDict()
+    summary[WINDOW] = lexicon.window
+    summary[SENTENCES] = len(sentences)
+    summary[KEPT] = len(keep)
+    summary[SKIPPED_FRACTION] = 1 - len(keep)/float(len(sentences)) if sentences else 0.0
+    for k, v in lexicon.stats.items():
+        summary[f"dev_{k}"] = v
+
+    logging.info(f"Prefilter kept {len(keep)} of {len(sentences)} sentences, " + \
+                 f"estimated dev trigger recall {lexicon.stats.get(TRIGGER_RECALL)}")
+
+    return (sentences, keep, summary)
+
+
+def expand_predictions_file(sentences, keep, merged_file):
+    '''
+    Replace predictions on kept sentences in merged_file with predictions on all sentences
+    '''
+
+    predictions = json.load(open(merged_file, 'r'))
+    merged = expand_predictions(sentences, keep, predictions)
+    json.dump(merged, open(merged_file, 'w'))
+
+    return merged
@@ -0,0 +1,61 @@
+import argparse
+import logging
+import os
+import runpy
+import sys
+
+import torch
+from transformers import PreTrainedModel
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from models.quantization import load_quantized, pretrained_builder, set_cpu_threads
+
+'''
+Run mspert's spert.py with dynamic int8 quantization on CPU
+
+Every transformer model spert.py loads with from_pretrained is quantized
+(or loaded from the quantized cache in --cache_dir, if provided), and the
+whole run executes under torch.inference_mode.
+
+Usage (from the mspert directory):
+python /path/to/spert_quantized.py --threads 16 --cache_dir /path/to/cache eval --config config.conf
+'''
+
+
+def patch_from_pretrained(cache_dir=None):
+    '''
+    Quantize models created through PreTrainedModel.from_pretrained
+    '''
+
+    from_pretrained = PreTrainedModel.from_pretrained.__func__
+
+    def from_pretrained_quantized(cls, path, *args, **kwargs):
+        load_fn = lambda p: from_pretrained(cls, p, *args, **kwargs)
+        build_fn = pretrained_builder(cls, *args, **kwargs)
+        return load_quantized(path, load_fn, build_fn=build_fn, cache_dir=cache_dir)
+
+    PreTrainedModel.from_pretrained = classmethod(from_pretrained_quantized)
+
+
+def main():
+
+    arg_parser = argparse.ArgumentParser(add_help=False)
+    arg_parser.add_argument('--threads', type=int, default=None, help="intra-op threads. None will use all available cores")
+    arg_parser.add_argument('--cache_dir', type=str, default=None, help="directory for quantized model cache. None will disable the cache")
+    arg_parser.add_argument('--spert_script', type=str, default='spert.py', help="path to spert.py")
+    args, spert_args = arg_parser.parse_known_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    set_cpu_threads(args.threads)
+    patch_from_pretrained(args.cache_dir)
+
+    # spert.py expects its own directory on the path
+    sys.path.insert(0, os.path.dirname(os.path.abspath(args.spert_script)))
+    sys.argv = [args.spert_script] + spert_args
+    with torch.inference_mode():
+        runpy.run_path(args.spert_script, run_name='__main__')
+
+
+if __name__ == '__main__':
+    main()
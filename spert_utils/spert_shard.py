@@ -0,0 +1,167 @@
+import json
+import logging
+import os
+import shutil
+import subprocess
+from collections import OrderedDict
+
+import config.constants as C
+from spert_utils.config_setup import dict_to_config_file
+from spert_utils.spert_io import ID, TOKENS
+
+'''
+Sharded multi-process CPU inference for mspert
+
+The SpERT input is split by document into shards, each shard is evaluated
+by a separate spert.py process pinned to its own cores, and predictions
+are merged back in the original sentence order.
+'''
+
+SPERT_QUANTIZED = os.path.abspath(os.path.join(os.path.dirname(__file__), 'spert_quantized.py'))
+
+THREAD_ENV_VARS = ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"]
+
+
+def spert_command(config_path, cpu_quantized=False, cpu_threads=None, quantized_cache_dir=None):
+    '''
+    Command for running mspert evaluation from the mspert directory
+    '''
+
+    if cpu_quantized:
+        threads = '' if cpu_threads is None else f'--threads {cpu_threads}'
+        cache = '' if quantized_cache_dir is None else f'--cache_dir {os.path.abspath(quantized_cache_dir)}'
+        return f'python {SPERT_QUANTIZED} {threads} {cache} eval --config {config_path}'
+    else:
+        return f'python ./spert.py eval --config {config_path}'
+
+
+def available_cores():
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count()))
+
+
+def shard_by_document(sentences, num_shards):
+    '''
+    Partition sentences into shards of whole documents, balanced by token count
+
+    returns list of shards, each a list of sentence indices in original order
+    '''
+
+    # group sentence indices by document
+    by_doc = OrderedDict()
+    for i, sent in enumerate(sentences):
+        by_doc.setdefault(sent[ID], []).append(i)
+
+    num_shards = max(1, min(num_shards, len(by_doc)))
+
+    # assign largest documents first to least loaded shard
+    docs = sorted(by_doc.values(), key=lambda idx: -sum(len(sentences[i][TOKENS]) for i in idx))
+    shards = [[] for _ in range(num_shards)]
+    loads = [0]*num_shards
+    for idx in docs:
+        j = loads.index(min(loads))
+        shards[j].extend(idx)
+        loads[j] += sum(len(sentences[i][TOKENS]) for i in idx)
+
+    return [sorted(shard) for shard in shards if len(shard) > 0]
+
+
+def run_sharded(model_config, dataset_path, destination, mspert_path, num_shards, \
+        cores = None,
+        cpu_quantized = False,
+        quantized_cache_dir = None,
+        predict_file = None):
+    '''
+    Run mspert evaluation in parallel shards on CPU
+
+    Parameters
+    ----------
+    model_config: dict of mspert configuration (dataset_path and log_path are set per shard)
+    dataset_path: path to spert input
+    destination: directory for shard inputs, configurations, and logs
+    mspert_path: path to mspert
+    num_shards: number of worker processes
+    cores: list of cores available for pinning, None will use all available cores
+    cpu_quantized: use dynamic int8 quantization
+    quantized_cache_dir: directory for the quantized model cache, shared by shards
+    predict_file: path for merged predictions
+
+    returns path to merged predictions, in the same order as dataset_path
+    '''
+
+    sentences = json.load(open(dataset_path, 'r'))
+    shards = shard_by_document(sentences, num_shards)
+
+    if cores is None:
+        cores = available_cores()
+    threads = max(1, len(cores)//len(shards))
+
+    logging.info(f"Sharded inference: {len(shards)} shards, {threads} threads per shard")
+
+    if os.path.exists(destination):
+        shutil.rmtree(destination)
+    os.makedirs(destination)
+
+    # launch one process per shard
+    procs = []
+    for j, shard in enumerate(shards):
+
+        shard_dir = os.path.join(destination, f'shard_{j}')
+        os.makedirs(shard_dir)
+
+        shard_path = os.path.join(shard_dir, 'data_eval.json')
+        json.dump([sentences[i] for i in shard], open(shard_path, 'w'))
+
+        config = OrderedDict(model_config)
+        config["dataset_path"] = shard_path
+        config["log_path"] = os.path.join(shard_dir, 'log')
+        config["cpu"] = True
+        config["sampling_processes"] = min(int(config.get("sampling_processes", 1)), threads)
+        config_path = os.path.join(shard_dir, 'config.conf')
+        dict_to_config_file(config, config_path)
+
+        env = dict(os.environ)
+        for k in THREAD_ENV_VARS:
+            env[k] = str(threads)
+
+        # pin shard to its own cores
+        shard_cores = set(cores[j*threads:(j + 1)*threads]) or set(cores)
+        preexec_fn = None
+        if hasattr(os, 'sched_setaffinity'):
+            preexec_fn = lambda c=shard_cores: os.sched_setaffinity(0, c)
+
+        cmd = spert_command(config_path, cpu_quantized=cpu_quantized, cpu_threads=threads, \
+                                quantized_cache_dir=quantized_cache_dir)
+        log_file = open(os.path.join(shard_dir, 'spert.log'), 'w')
+        p = subprocess.Popen(cmd, shell=True, cwd=mspert_path, env=env, \
+                        stdout=log_file, stderr=subprocess.STDOUT, preexec_fn=preexec_fn)
+        procs.append((p, log_file, config["log_path"]))
+
+    # wait for all shards
+    failed = []
+    for j, (p, log_file, _) in enumerate(procs):
+        out = p.wait()
+        log_file.close()
+        if out != 0:
+            failed.append((j, out))
+    if len(failed) > 0:
+        raise ValueError(f"python call error in shards: {failed}")
+
+    # merge predictions in original order
+    merged = [None]*len(sentences)
+    for shard, (_, _, log_path) in zip(shards, procs):
+        f = os.path.join(log_path, C.PREDICTIONS_JSON)
+        predictions = json.load(open(f, 'r'))
+        assert len(predictions) == len(shard)
+        for i, pred in zip(shard, predictions):
+            assert pred[TOKENS] == sentences[i][TOKENS]
+            merged[i] = pred
+
+    assert all(pred is not None for pred in merged)
+
+    if predict_file is None:
+        predict_file = os.path.join(destination, C.PREDICTIONS_JSON)
+    json.dump(merged, open(predict_file, 'w'))
+
+    return predict_file
@@ -0,0 +1,22 @@
+import os
+import sys
+
+import pytest
+
+# modules are imported relative to the repository root, as in the scripts
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+CORPUS_PICKLE = os.path.join(ROOT, 'output', 'corpus.pkl')
+CORPUS_DIR = os.path.join(ROOT, 'output', 'social_history_mtsamples')
+
+
+@pytest.fixture(scope='session')
+def mtsamples_corpus():
+    '''
+    Bundled mtsamples social history corpus, tokenized with spaCy (en_core_web_sm)
+    '''
+    joblib = pytest.importorskip('joblib')
+    if not os.path.exists(CORPUS_PICKLE):
+        pytest.skip(f"corpus not found: {CORPUS_PICKLE}")
+    return joblib.load(CORPUS_PICKLE)
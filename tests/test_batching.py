@@ -0,0 +1,59 @@
+from collections import OrderedDict
+
+import pytest
+
+torch = pytest.importorskip('torch')
+
+import config.constants as C
+from models.batching import BucketBatchSampler, sequence_label_names, trim_collate
+
+MAX_LEN = 8
+
+
+def sample(length, seq_label=1, sent_label=None):
+    X = torch.randn(MAX_LEN, 4)
+    mask = torch.zeros(MAX_LEN, dtype=torch.long)
+    mask[:length] = 1
+    y = OrderedDict()
+    y[C.TRIGGER] = OrderedDict([(C.ALCOHOL, torch.tensor(0) if sent_label is None else sent_label)])
+    y[C.ENTITY] = OrderedDict([(C.ALCOHOL, torch.full((MAX_LEN,), seq_label, dtype=torch.long))])
+    return (X, mask, y)
+
+
+def test_sequence_label_names():
+    assert sequence_label_names(C.MULTITASK_LABEL_DEF) == [C.ENTITY]
+
+def test_trim_collate():
+    X, mask, y = trim_collate([sample(3), sample(5)])
+    assert X.shape == (2, 5, 4)
+    assert mask.shape == (2, 5)
+    assert mask.sum(1).tolist() == [3, 5]
+    assert y[C.ENTITY][C.ALCOHOL].shape == (2, 5)
+    assert y[C.TRIGGER][C.ALCOHOL].shape == (2,)
+
+def test_trim_collate_input_only():
+    X, mask = trim_collate([sample(2)[:2], sample(4)[:2]])
+    assert X.shape == (2, 4, 4)
+    assert mask.shape == (2, 4)
+
+def test_trim_collate_only_sequence_labels():
+    # sentence-level labels are not trimmed, even if their size matches max_len
+    sent_label = torch.arange(MAX_LEN)
+    _, _, y = trim_collate([sample(3, sent_label=sent_label), sample(2, sent_label=sent_label)])
+    assert y[C.TRIGGER][C.ALCOHOL].shape == (2, MAX_LEN)
+    assert y[C.ENTITY][C.ALCOHOL].shape == (2, 3)
+
+    _, _, y = trim_collate([sample(3), sample(2)], sequence_names=[])
+    assert y[C.ENTITY][C.ALCOHOL].shape == (2, MAX_LEN)
+
+def test_bucket_batch_sampler():
+    lengths = [(7*i) % 23 + 1 for i in range(103)]
+    sampler = BucketBatchSampler(lengths, batch_size=10, bucket_size=3, seed=1)
+    batches = list(sampler)
+    assert len(batches) == len(sampler)
+    assert sorted([i for batch in batches for i in batch]) == list(range(len(lengths)))
+
+    sampler = BucketBatchSampler(lengths, batch_size=10, bucket_size=3, drop_last=True, seed=1)
+    batches = list(sampler)
+    assert len(batches) == len(sampler)
+    assert all([len(batch) == 10 for batch in batches])
@@ -0,0 +1,136 @@
+import random
+
+import pytest
+
+torch = pytest.importorskip('torch')
+pytest.importorskip('allennlp')
+
+from allennlp.modules.conditional_random_field import ConditionalRandomField, allowed_transitions
+
+import config.constants as C
+from models.crf import BIOLookup, BIO_to_span, BIO_to_span_batch, MultitaskSpanExtractor, \
+                       batched_crf_log_likelihood, batched_viterbi, seq_tags_to_spans, \
+                       stack_crf_transitions
+
+SPAN_TYPES = ["Type", "Amount", "Frequency"]
+
+
+def get_id_to_label(span_types):
+    id_to_label = {0: (C.OUTSIDE, C.OUTSIDE)}
+    for t in span_types:
+        id_to_label[len(id_to_label)] = (C.BEGIN, t)
+        id_to_label[len(id_to_label)] = (C.INSIDE, t)
+    return id_to_label
+
+def random_sequences(n, num_tags, max_len, seed=0):
+    rng = random.Random(seed)
+    seqs = []
+    for _ in range(n):
+        length = rng.randint(1, max_len)
+        # mostly outside, so all-outside sequences also occur
+        seqs.append([rng.randrange(num_tags) if rng.random() < 0.4 else 0 for _ in range(length)])
+    return seqs
+
+
+def test_bio_decode_tuple_labels():
+    id_to_label = get_id_to_label(SPAN_TYPES)
+    lookup = BIOLookup.from_id_to_label(id_to_label)
+    seqs = random_sequences(2000, len(id_to_label), 12)
+
+    expected = [BIO_to_span(seq, id_to_label=id_to_label) for seq in seqs]
+    assert BIO_to_span_batch(seqs, lookup) == expected
+
+def test_bio_decode_integer_labels():
+    num_tags_orig = 4
+    lookup = BIOLookup.from_num_tags(num_tags_orig)
+    seqs = random_sequences(2000, 2*num_tags_orig - 1, 12, seed=1)
+
+    expected = [BIO_to_span(seq, lab_is_tuple=False, num_tags_orig=num_tags_orig) for seq in seqs]
+    assert BIO_to_span_batch(seqs, lookup) == expected
+
+    # padded tensor with lengths
+    lengths = [len(seq) for seq in seqs]
+    y = torch.zeros(len(seqs), max(lengths), dtype=torch.long)
+    for i, seq in enumerate(seqs):
+        y[i, :len(seq)] = torch.tensor(seq)
+    assert BIO_to_span_batch(y, lookup, lengths=lengths) == expected
+
+def test_seq_tags_to_spans():
+    id_to_label = get_id_to_label(SPAN_TYPES)
+    # B-Type I-Type O B-Amount | O O O O | I-Type B-Frequency
+    y = [[1, 2, 0, 3], [0, 0, 0, 0], [2, 5]]
+
+    labels, indices, mask = seq_tags_to_spans(y, id_to_label)
+    assert labels == [["Type", "Amount"], [], ["Frequency"]]
+    assert indices.tolist() == [[[0, 1], [3, 3]], [[0, 0], [0, 0]], [[1, 1], [0, 0]]]
+    assert mask.tolist() == [[1, 1], [0, 0], [1, 0]]
+
+
+def crf_inputs(num_tags, batch_size=5, seq_len=7, seed=0):
+    torch.manual_seed(seed)
+    crfs = []
+    for n in num_tags:
+        labels = {i: "O" if prefix == C.OUTSIDE else f"{prefix}{t}" \
+                        for i, (prefix, t) in get_id_to_label(SPAN_TYPES[:(n - 1)//2]).items()}
+        crf = ConditionalRandomField(n, constraints=allowed_transitions("BIO", labels))
+        torch.nn.init.normal_(crf.transitions)
+        torch.nn.init.normal_(crf.start_transitions)
+        torch.nn.init.normal_(crf.end_transitions)
+        crfs.append(crf)
+
+    max_tags = max(num_tags)
+    lengths = torch.randint(1, seq_len + 1, (batch_size,))
+    lengths[0] = seq_len
+    mask = torch.arange(seq_len)[None, :] < lengths[:, None]
+    logits = [torch.randn(batch_size, seq_len, n) for n in num_tags]
+    tags = [torch.randint(0, n, (batch_size, seq_len)) for n in num_tags]
+
+    logits_pad = torch.stack([torch.nn.functional.pad(x, (0, max_tags - x.size(-1)), value=-1e4) for x in logits])
+    return crfs, max_tags, mask, logits, tags, logits_pad
+
+def test_batched_crf_log_likelihood():
+    num_tags = [7, 5, 3]
+    crfs, max_tags, mask, logits, tags, logits_pad = crf_inputs(num_tags)
+
+    log_likelihood = batched_crf_log_likelihood(logits_pad, torch.stack(tags), mask, \
+                                                *stack_crf_transitions(crfs, max_tags))
+    expected = torch.stack([crf(x, t, mask) for crf, x, t in zip(crfs, logits, tags)])
+    assert torch.allclose(log_likelihood, expected, atol=1e-4)
+
+def test_batched_viterbi():
+    num_tags = [7, 5, 3]
+    crfs, max_tags, mask, logits, _, logits_pad = crf_inputs(num_tags, seed=1)
+
+    paths = batched_viterbi(logits_pad, mask, *stack_crf_transitions(crfs, max_tags, constrained=True))
+    lengths = mask.sum(1).tolist()
+    for i, (crf, x) in enumerate(zip(crfs, logits)):
+        expected = [path for path, _ in crf.viterbi_tags(x, mask)]
+        assert [p[:n] for p, n in zip(paths[i].tolist(), lengths)] == expected
+
+def test_fused_span_extractor():
+    events = [C.ALCOHOL, C.DRUG, C.TOBACCO]
+    entity = C.TRIGGER
+    span_types = {C.ALCOHOL: SPAN_TYPES, C.DRUG: SPAN_TYPES[:2], C.TOBACCO: SPAN_TYPES[:1]}
+    id_to_label = {event: {entity: get_id_to_label(types)} for event, types in span_types.items()}
+    num_tags = {event: {entity: len(id_to_label[event][entity])} for event in events}
+
+    torch.manual_seed(0)
+    model = MultitaskSpanExtractor(events, entity, num_tags, embed_size=6, id_to_label=id_to_label)
+    model.eval()
+
+    batch_size, seq_len = 4, 9
+    X = torch.randn(batch_size, seq_len, 6)
+    mask = torch.arange(seq_len)[None, :] < torch.tensor([9, 4, 7, 1])[:, None]
+    y = {event: {entity: torch.randint(0, num_tags[event][entity], (batch_size, seq_len))} for event in events}
+
+    with torch.no_grad():
+        model.fused = False
+        loss, y_pred, span_labels, span_embed = model(X, y=y, mask=mask)
+        model.fused = True
+        loss_f, y_pred_f, span_labels_f, span_embed_f = model(X, y=y, mask=mask)
+
+    for event in events:
+        assert torch.allclose(loss_f[event], loss[event], rtol=1e-4)
+        assert y_pred_f[event] == y_pred[event]
+        assert span_labels_f[event] == span_labels[event]
+        assert torch.allclose(span_embed_f[event], span_embed[event], atol=1e-5)
@@ -0,0 +1,95 @@
+import pytest
+
+from corpus.document_brat import tokenize_document
+from corpus.regex_tokenizer import RegexTokenizer
+
+
+def sentences(text, **kwargs):
+    return [sent.text.strip() for sent in RegexTokenizer(**kwargs)(text).sents]
+
+
+def prf(reference, candidate):
+    tp = len(reference & candidate)
+    return (tp/len(candidate), tp/len(reference))
+
+
+def boundaries(token_offsets):
+    '''
+    (token offsets, sentence start offsets) as sets
+    '''
+    tokens = set([o for sent in token_offsets for o in sent])
+    starts = set([sent[0][0] for sent in token_offsets if len(sent) > 0])
+    return (tokens, starts)
+
+
+def test_sentence_final_punctuation():
+    assert sentences('Denies tobacco. Drinks alcohol socially.') == ['Denies tobacco.', 'Drinks alcohol socially.']
+    assert sentences('Denies tobacco.\nDrinks alcohol socially.') == ['Denies tobacco.', 'Drinks alcohol socially.']
+    assert sentences('Quit smoking in 2010 (age 45.)\nDrinks wine.') == ['Quit smoking in 2010 (age 45.)', 'Drinks wine.']
+
+def test_line_break_without_sentence_end():
+    assert sentences('Lives with his wife and\ntwo children.') == ['Lives with his wife and\ntwo children.']
+
+def test_line_headers():
+    assert sentences('Married\nTobacco: denies\nDrug Use: none') == ['Married', 'Tobacco: denies', 'Drug Use: none']
+    assert sentences('Married\nSOCIAL HISTORY: denies') == ['Married', 'SOCIAL HISTORY: denies']
+    assert sentences('Married\n- tobacco\n- alcohol') == ['Married', '- tobacco', '- alcohol']
+    assert sentences('SOCIAL HISTORY: denies tobacco', split_headers=True) == ['SOCIAL HISTORY:', 'denies tobacco']
+
+def test_offsets_match_text():
+    text = 'SOCIAL HISTORY:\nDenies tobacco.\nDrinks 2-3 beers/week, quit 05/2010.'
+    tokens, offsets = tokenize_document(text, RegexTokenizer())
+    for sent_tokens, sent_offsets in zip(tokens, offsets):
+        assert [text[s:e] for s, e in sent_offsets] == sent_tokens
+
+
+def parity(texts, reference_offsets):
+    '''
+    Micro-averaged (precision, recall) of regex token and sentence start
+    offsets against reference token offsets, by document
+    '''
+
+    tokenizer = RegexTokenizer()
+
+    ref_tokens, ref_starts, tokens, starts = set(), set(), set(), set()
+    for i, (text, ref) in enumerate(zip(texts, reference_offsets)):
+        _, offsets = tokenize_document(text, tokenizer)
+        for target, boundary in zip([ref_tokens, ref_starts, tokens, starts], boundaries(ref) + boundaries(offsets)):
+            target.update([(i, o) for o in boundary])
+
+    return (prf(ref_tokens, tokens), prf(ref_starts, starts))
+
+
+def check_parity(token_prf, sent_prf):
+
+    p, r = token_prf
+    assert p > 0.998 and r > 0.998
+
+    # spaCy splits after inline headers inconsistently (only before a single
+    # space), which is not split by default, limiting sentence recall
+    p, r = sent_prf
+    assert p > 0.99 and r > 0.87
+
+
+def test_parity_with_spacy_reference(mtsamples_corpus):
+    '''
+    Token and sentence boundaries against the stored spaCy tokenization of the bundled corpus
+    '''
+
+    docs = list(mtsamples_corpus.docs())
+    check_parity(*parity([doc.text for doc in docs], [doc.token_offsets for doc in docs]))
+
+
+def test_parity_with_spacy_model(mtsamples_corpus):
+    '''
+    Token and sentence boundaries against spaCy on the bundled corpus, if the model is installed
+    '''
+
+    spacy = pytest.importorskip('spacy')
+    try:
+        nlp = spacy.load('en_core_web_sm')
+    except OSError:
+        pytest.skip('en_core_web_sm not installed')
+
+    texts = [doc.text for doc in mtsamples_corpus.docs()]
+    check_parity(*parity(texts, [tokenize_document(text, nlp)[1] for text in texts]))
@@ -0,0 +1,68 @@
+import os
+
+import pytest
+
+pd = pytest.importorskip('pandas')
+pytest.importorskip('pyarrow')
+
+from utils.results import ScoreCache
+
+
+def write_scores(path, rows):
+    df = pd.DataFrame(rows, columns=["event", "subtype", "NT", "NP", "TP"])
+    df.to_csv(path, index=False)
+    return str(path)
+
+
+@pytest.fixture
+def score_files(tmp_path):
+    # integer counts in one file, missing counts (float) in the other
+    a = write_scores(tmp_path / "a.csv", [["Alcohol", "current", 3, 2, 1], ["Drug", None, 1, 0, 0]])
+    b = write_scores(tmp_path / "b.csv", [["Alcohol", "past", 4, None, 2]])
+    return [a, b]
+
+
+def test_round_trip_dtypes(tmp_path, score_files):
+    cache_file = str(tmp_path / "cache.parquet")
+
+    cache = ScoreCache(cache_file, n_threads=2)
+    expected = cache.read(score_files)
+    assert cache.save() == cache_file
+
+    cache = ScoreCache(cache_file, n_threads=2, read_fn=None)
+    assert len(cache.frames) == 2
+    dfs = cache.read(score_files)
+    assert not cache.modified
+    for f in score_files:
+        pd.testing.assert_frame_equal(dfs[f], expected[f])
+    assert dfs[score_files[0]]["NP"].dtype == "int64"
+    assert dfs[score_files[1]]["NP"].dtype == "float64"
+    assert dfs[score_files[0]]["subtype"].tolist() == ["current", "na"]
+
+def test_modified_file_reread(tmp_path, score_files):
+    cache_file = str(tmp_path / "cache.parquet")
+    cache = ScoreCache(cache_file)
+    cache.read(score_files)
+    cache.save()
+
+    write_scores(score_files[0], [["Tobacco", "none", 1, 1, 1]])
+    os.utime(score_files[0], ns=(0, 10**18))
+
+    dfs = ScoreCache(cache_file).read(score_files)
+    assert dfs[score_files[0]]["event"].tolist() == ["Tobacco"]
+
+def test_save_drops_missing_files(tmp_path, score_files):
+    cache_file = str(tmp_path / "cache.parquet")
+    cache = ScoreCache(cache_file)
+    cache.read(score_files)
+    cache.save()
+
+    os.remove(score_files[1])
+    cache = ScoreCache(cache_file)
+    assert cache.save() == cache_file
+    assert list(ScoreCache(cache_file).frames) == score_files[:1]
+
+    os.remove(score_files[0])
+    cache = ScoreCache(cache_file)
+    assert cache.save() is None
+    assert not os.path.exists(cache_file)
@@ -0,0 +1,97 @@
+import os
+import re
+
+import pytest
+
+from corpus.sections import FALLBACK_DROP, GOLD_RECALL, OffsetMap, SectionLocator
+from tests.conftest import CORPUS_DIR
+
+NOTE = \
+    "CHIEF COMPLAINT: Back pain.\n\n" + \
+    "HPI: 55-year-old with chest pain. Work: lifting at a warehouse worsens it.\n\n" + \
+    "SOCIAL HISTORY: Smokes 1 ppd. Work: retired teacher.\n" + \
+    "Children: two.\n" + \
+    "Hobbies: fishing.\n\n" + \
+    "Family History: CAD.\n" + \
+    "MEDICATIONS: none.\n"
+
+
+def extract(text, **kwargs):
+    section_text, _ = SectionLocator(**kwargs).extract(text)
+    return section_text
+
+
+def test_title_case_subsections():
+    text = "SOCIAL HISTORY: Smokes 1 ppd. Work: retired teacher.\nChildren: two.\nMEDICATIONS: none."
+    assert extract(text) == "SOCIAL HISTORY: Smokes 1 ppd. Work: retired teacher.\nChildren: two."
+
+def test_inline_kept_header_in_other_section():
+    text = "HPI: 55-year-old with chest pain. Work: lifting at a warehouse worsens it.\nMEDICATIONS: none."
+    assert extract(text) == text
+    assert extract(text, fallback=FALLBACK_DROP) is None
+
+def test_section_embedded_in_note():
+    assert extract(NOTE) == "SOCIAL HISTORY: Smokes 1 ppd. Work: retired teacher.\nChildren: two.\nHobbies: fishing."
+
+def test_adjacent_kept_sections():
+    text = "HPI: Cough.\nTobacco: 1 ppd.\nAlcohol: none.\nPLAN: Follow up."
+    assert extract(text) == "Tobacco: 1 ppd.\nAlcohol: none."
+
+def test_separate_sections():
+    text = "SOCIAL HISTORY: Smokes.\nMEDICATIONS: none.\nSUBSTANCE USE: Denies."
+    assert extract(text) == "SOCIAL HISTORY: Smokes.\n\nSUBSTANCE USE: Denies."
+
+
+def test_offset_map_round_trip():
+
+    text = "HPI: Cough.\nSOCIAL HISTORY: Smokes.\nMEDICATIONS: none.\nSUBSTANCE USE: Denies cocaine.\nPLAN: Follow up."
+    section_text, offset_map = SectionLocator().extract(text)
+
+    assert len(offset_map.segments) == 2
+
+    # spans of each word in the extracted text map back to the same words
+    for m in re.finditer(r'\S+', section_text):
+        original_start, original_end = offset_map.map_span(m.start(), m.end())
+        assert text[original_start:original_end] == m.group()
+
+    # every character outside separators maps back to the same character
+    for extracted_start, original_start, length in offset_map.segments:
+        for i in range(extracted_start, extracted_start + length):
+            assert text[offset_map.map_offset(i)] == section_text[i]
+
+    # offsets in separators map to the end of the preceding segment
+    extracted_start, original_start, length = offset_map.segments[0]
+    end = extracted_start + length
+    assert offset_map.map_offset(end + 1) == original_start + length
+
+def test_offset_map_identity():
+    offset_map = OffsetMap([(0, 0, 10)])
+    assert offset_map.map_span(2, 7) == (2, 7)
+    assert OffsetMap().map_span(2, 7) == (2, 7)
+
+
+@pytest.mark.parametrize("embed", [False, True])
+def test_gold_recall(embed):
+    '''
+    Gold textbounds of the bundled corpus are kept, including when each
+    note is embedded in a full note
+    '''
+
+    from corpus.brat import get_annotations, get_brat_files
+
+    if not os.path.exists(CORPUS_DIR):
+        pytest.skip(f"corpus not found: {CORPUS_DIR}")
+
+    before, after = NOTE.split("SOCIAL HISTORY")[0], "\n\n" + NOTE.split("\n\n")[-1]
+
+    locator = SectionLocator()
+    for fn_txt, fn_ann in zip(*get_brat_files(CORPUS_DIR)):
+        text = open(fn_txt, 'r').read()
+        _, _, textbounds, _ = get_annotations(open(fn_ann, 'r').read())
+        gold_spans = [(tb.start, tb.end) for tb in textbounds.values()]
+        if embed:
+            gold_spans = [(s + len(before), e + len(before)) for s, e in gold_spans]
+            text = before + text + after
+        locator.extract(text, gold_spans=gold_spans)
+
+    assert locator.summary()[GOLD_RECALL] == 1.0
@@ -0,0 +1,160 @@
+import copy
+import os
+from collections import Counter, OrderedDict
+
+import pytest
+
+pd = pytest.importorskip('pandas')
+
+import config.constants as C
+from config.constants import ARG_1, ARG_2, COUNT, ENTITIES, EVENT_TYPE, EVENTS, RELATIONS, ROLE, SUBTYPE, TYPE
+from corpus.statistics import SENTENCE_COUNT, STATISTICS, WORD_COUNT, counter2df
+from corpus.tokenization import get_pipeline, get_tokens
+
+'''
+Corpus statistics and length histograms against the previous per-statistic
+CorpusBrat implementations, reproduced below
+'''
+
+
+def old_annotation_summary(corpus, path):
+
+    counter = Counter()
+    for doc in corpus.docs(as_dict=False):
+        counter += doc.annotation_summary()
+
+    df = counter2df(counter)
+    df.to_csv(os.path.join(path, "annotation_summary.csv"))
+
+def old_label_summary(corpus, path):
+
+    counters = OrderedDict()
+    for doc in corpus.docs(as_dict=False):
+        for k, v in doc.label_summary().items():
+            if k not in counters:
+                counters[k] = Counter()
+            counters[k] += v
+
+    for k, v in counters.items():
+        if k == ENTITIES:
+            columns = [TYPE, SUBTYPE, COUNT]
+        elif k == RELATIONS:
+            columns = [ARG_1, ARG_2, ROLE, COUNT]
+        elif k == EVENTS:
+            columns = [EVENT_TYPE, TYPE, SUBTYPE, COUNT]
+        else:
+            columns = None
+        counter2df(v, columns=columns).to_csv(os.path.join(path, f"label_summary_{k}.csv"))
+
+def old_span_histogram(corpus, path, entity_types=None):
+
+    counter = Counter()
+    for doc in corpus.entities(entity_types=entity_types):
+        for entity in doc:
+            counter[(entity.type_, entity.subtype, entity.text.lower())] += 1
+
+    counts = [(type, subtype, text, count) for (type, subtype, text), count in counter.items()]
+    df = pd.DataFrame(counts, columns=["type", "subtype", "text", "count"])
+    df.sort_values('count', ascending=False, inplace=True)
+    df.to_csv(os.path.join(path, "span_histogram.csv"))
+
+def old_histogram(corpus, tokenizer_fn):
+
+    sent_lengths = Counter()
+    doc_lengths = Counter()
+    for doc in corpus.docs(as_dict=False):
+        tokens = tokenizer_fn(doc)
+        for sent in tokens:
+            sent_lengths[len(sent)] += 1
+        doc_lengths[len(tokens)] += 1
+
+    df_sent = pd.DataFrame(sent_lengths.items(), columns=["sentence_length", "count"])
+    df_sent.sort_values("sentence_length", ascending=True, inplace=True)
+
+    df_doc = pd.DataFrame(doc_lengths.items(), columns=["document_length", "count"])
+    df_doc.sort_values("document_length", ascending=True, inplace=True)
+
+    return (df_sent.reset_index(drop=True), df_doc.reset_index(drop=True))
+
+
+def read_outputs(path):
+    outputs = {}
+    for fn in sorted(os.listdir(path)):
+        with open(os.path.join(path, fn), 'rb') as f:
+            outputs[fn] = f.read()
+    return outputs
+
+
+@pytest.fixture(scope='module')
+def corpus(mtsamples_corpus):
+    '''
+    Bundled corpus without the documents (3 of 361) with textbounds that do
+    not align with the stored tokens, for which entities cannot be built
+    '''
+
+    corpus = copy.deepcopy(mtsamples_corpus)
+    for doc in corpus.docs(as_dict=False):
+        try:
+            doc.entities()
+        except AssertionError:
+            del corpus[doc.id]
+
+    return corpus
+
+
+@pytest.mark.parametrize("n_jobs", [1, 2])
+def test_statistics_match_previous_outputs(corpus, tmp_path, n_jobs):
+
+    old = tmp_path / "old"
+    new = tmp_path / "new"
+    old.mkdir()
+    new.mkdir()
+
+    old_annotation_summary(corpus, old)
+    old_label_summary(corpus, old)
+    old_span_histogram(corpus, old)
+    corpus.tag_summary(old)
+
+    results = corpus.statistics(path=new, n_jobs=n_jobs)
+
+    assert read_outputs(new) == read_outputs(old)
+    assert list(results) == STATISTICS
+    assert results[WORD_COUNT] == corpus.word_count()
+    assert results[SENTENCE_COUNT] == corpus.sentence_count()
+
+def test_delegated_methods_match_previous_outputs(corpus, tmp_path):
+    entity_types = [C.ALCOHOL, C.DRUG, C.TOBACCO]
+
+    old = tmp_path / "old"
+    new = tmp_path / "new"
+    old.mkdir()
+    new.mkdir()
+
+    old_annotation_summary(corpus, old)
+    old_label_summary(corpus, old)
+    old_span_histogram(corpus, old, entity_types=entity_types)
+
+    corpus.annotation_summary(path=new)
+    corpus.label_summary(path=new)
+    corpus.span_histogram(path=new, entity_types=entity_types)
+
+    assert read_outputs(new) == read_outputs(old)
+
+def test_histogram_from_stored_tokens(mtsamples_corpus):
+    df_sent, df_doc = mtsamples_corpus.histogram()
+    expected_sent, expected_doc = old_histogram(mtsamples_corpus, lambda doc: doc.tokens)
+
+    pd.testing.assert_frame_equal(df_sent, expected_sent)
+    pd.testing.assert_frame_equal(df_doc, expected_doc)
+
+def test_histogram_tokenizer_fallback(mtsamples_corpus):
+    corpus = copy.deepcopy(mtsamples_corpus)
+    for doc in corpus.docs(as_dict=False):
+        doc.tokens = None
+
+    tokenizer = get_pipeline(C.REGEX_TOKENIZER)
+    df_sent, df_doc = corpus.histogram(tokenizer=tokenizer)
+    expected_sent, expected_doc = old_histogram(corpus, lambda doc: get_tokens(doc.text, tokenizer))
+
+    pd.testing.assert_frame_equal(df_sent, expected_sent)
+    pd.testing.assert_frame_equal(df_doc, expected_doc)
@@ -13,10 +13,12 @@ from brat_scoring.scoring import score_docs
 
 import config.constants as C
 from corpus.corpus_brat import CorpusBrat
+from corpus.tokenization import pipeline_stats
 from spert_utils.config_setup import create_event_types_path, dict_to_config_file, get_dataset_stats
 from spert_utils.convert_brat import RELATION_DEFAULT
 from spert_utils.spert_io import merge_spert_files, plot_loss
 from utils.misc import get_include
+from utils.profiling import Profiler
 
 pd.set_option("display.max_columns", None)
 pd.set_option("display.width", None)
@@ -219,6 +221,8 @@ def main(args):
     spert_types_config = get_spert_config(label_definition)
     scoring = get_scoring_def()
 
+    profiler = Profiler(path=args.destination, trace_memory=args.trace_memory, profile_stages=args.profile_stages, use_pyinstrument=args.pyinstrument)
+
     # combine source and subset
     train_include = get_include([args.train_subset, args.train_source])
     valid_include = get_include([args.valid_subset, args.valid_source])
@@ -228,31 +232,36 @@ def main(args):
     """
 
     # load corpus
-    corpus = joblib.load(args.source_file)
+    with profiler.stage("load_corpus") as stage:
+        corpus = joblib.load(args.source_file)
+        stage.items = corpus.doc_count()
 
     # use trigger spans for all arguments and the list to use _trigger_span
-    for arg in label_definition["swapped_spans"]:
-        c = corpus.swap_spans(source=arg, target=C.TRIGGER, use_role=False)
+    with profiler.stage("swap_spans"):
+        for arg in label_definition["swapped_spans"]:
+            c = corpus.swap_spans(source=arg, target=C.TRIGGER, use_role=False)
 
     if valid_include == train_include:
         logging.warn("=" * 200 + "\nValidation set and train set are equivalent\n" + "=" * 200)
 
     # create formatted data
 
-    fast_count = args.fast_count if args.fast_run else None
-    for path, include, sample_count in [(train_path, train_include, fast_count), (valid_path, valid_include, fast_count)]:
-        corpus.events2spert_multi(
-            include=include,
-            entity_types=label_definition["entity_types"],
-            subtype_layers=label_definition["subtype_layers"],
-            subtype_default=label_definition["subtype_default"],
-            path=path,
-            sample_count=sample_count,
-            include_doc_text=True,
-        )
-
-        include_name = "_".join(list(include))
-        get_dataset_stats(dataset_path=path, dest_path=args.destination, name=include_name)
+    with profiler.stage("spert_conversion") as stage:
+        fast_count = args.fast_count if args.fast_run else None
+        for path, include, sample_count in [(train_path, train_include, fast_count), (valid_path, valid_include, fast_count)]:
+            spert_sentences = corpus.events2spert_multi(
+                include=include,
+                entity_types=label_definition["entity_types"],
+                subtype_layers=label_definition["subtype_layers"],
+                subtype_default=label_definition["subtype_default"],
+                path=path,
+                sample_count=sample_count,
+                include_doc_text=True,
+            )
+
+            include_name = "_".join(list(include))
+            get_dataset_stats(dataset_path=path, dest_path=args.destination, name=include_name)
+            stage.items = (stage.items or 0) + len(spert_sentences)
 
     # create spert types file
     create_event_types_path(**spert_types_config, path=types_path)
@@ -269,14 +278,15 @@ def main(args):
         if os.path.exists(dir) and os.path.isdir(dir):
             shutil.rmtree(dir)
 
-    cwd = os.getcwd()
-    os.chdir(args.mspert_path)
-    out = os.system(f"python ./spert.py train --config {config_path}")
-    os.chdir(cwd)
-    print("out", out)
-    if out != 0:
-        raise ValueError(f"python call error: {out}")
-        assert False
+    with profiler.stage("model_execution"):
+        cwd = os.getcwd()
+        os.chdir(args.mspert_path)
+        out = os.system(f"python ./spert.py train --config {config_path}")
+        os.chdir(cwd)
+        print("out", out)
+        if out != 0:
+            raise ValueError(f"python call error: {out}")
+            assert False
 
     """
     Post process output
@@ -290,8 +300,9 @@ def main(args):
 
     predict_file = os.path.join(model_config["log_path"], C.PREDICTIONS_JSON)
 
-    merged_file = os.path.join(args.destination, C.PREDICTIONS_JSON)
-    merge_spert_files(model_config["valid_path"], predict_file, merged_file)
+    with profiler.stage("merge"):
+        merged_file = os.path.join(args.destination, C.PREDICTIONS_JSON)
+        merge_spert_files(model_config["valid_path"], predict_file, merged_file)
 
     logging.info("Scoring predictions")
     logging.info(f"Gold file:                     {model_config['valid_path']}")
@@ -301,38 +312,44 @@ def main(args):
     gold_corpus = joblib.load(args.source_file)
     gold_docs = gold_corpus.docs(include=valid_include, as_dict=True)
 
-    predict_corpus = CorpusBrat()
-    predict_corpus.import_spert_corpus_multi(
-        path=merged_file,
-        subtype_layers=label_definition["subtype_layers"],
-        subtype_default=label_definition["subtype_default"],
-        event_types=label_definition["event_types"],
-        swapped_spans=label_definition["swapped_spans"],
-        arg_role_map=label_definition["arg_role_map"],
-        attr_type_map=label_definition["attr_type_map"],
-        skip_dup_trig=label_definition["skip_dup_trig"],
-    )
-
-    # predict_corpus.map_roles(role_map, path=args.destination)
-    predict_corpus.prune_invalid_connections(label_definition["args_by_event_type"], path=args.destination)
-    predict_docs = predict_corpus.docs(as_dict=True)
-
-    for description, score_def in scoring.items():
-        score_docs(
-            gold_docs=gold_docs,
-            predict_docs=predict_docs,
-            labeled_args=label_definition["score_labeled_args"],
-            score_trig=score_def["score_trig"],
-            score_span=score_def["score_span"],
-            score_labeled=score_def["score_labeled"],
-            output_path=args.destination,
-            description=description,
-            argument_types=label_definition["score_argument_types"],
+    with profiler.stage("import_prune") as stage:
+        predict_corpus = CorpusBrat()
+        predict_corpus.import_spert_corpus_multi(
+            path=merged_file,
+            subtype_layers=label_definition["subtype_layers"],
+            subtype_default=label_definition["subtype_default"],
+            event_types=label_definition["event_types"],
+            swapped_spans=label_definition["swapped_spans"],
+            arg_role_map=label_definition["arg_role_map"],
+            attr_type_map=label_definition["attr_type_map"],
+            skip_dup_trig=label_definition["skip_dup_trig"],
         )
 
+        # predict_corpus.map_roles(role_map, path=args.destination)
+        predict_corpus.prune_invalid_connections(label_definition["args_by_event_type"], path=args.destination)
+        predict_docs = predict_corpus.docs(as_dict=True)
+        stage.items = len(predict_docs)
+
+    with profiler.stage("scoring", items=len(gold_docs)):
+        for description, score_def in scoring.items():
+            score_docs(
+                gold_docs=gold_docs,
+                predict_docs=predict_docs,
+                labeled_args=label_definition["score_labeled_args"],
+                score_trig=score_def["score_trig"],
+                score_span=score_def["score_span"],
+                score_labeled=score_def["score_labeled"],
+                output_path=args.destination,
+                description=description,
+                argument_types=label_definition["score_argument_types"],
+            )
+
     f = os.path.join(model_config["save_path"], C.LABEL_DEFINITION_FILE)
     joblib.dump(label_definition, f)
 
+    profiler.add_info("spacy_pipelines", pipeline_stats())
+    profiler.save()
+
     return "Successful completion"
 
 
@@ -376,6 +393,9 @@ if __name__ == "__main__":
     arg_parser.add_argument("--final_eval", default=True, action="store_false", help="perform final evaluation?")
     arg_parser.add_argument("--no_overlapping", default=True, action="store_false", help="disallow overlapping spans")
     arg_parser.add_argument("--device", type=int, default=0, help="GPU device")
+    arg_parser.add_argument("--trace_memory", default=False, action="store_true", help="track peak python allocations per stage with tracemalloc (slower)")
+    arg_parser.add_argument("--profile_stages", type=str, default=None, nargs="+", help="stages to profile with cProfile, e.g. 'scoring import_prune'")
+    arg_parser.add_argument("--pyinstrument", default=False, action="store_true", help="use pyinstrument instead of cProfile for --profile_stages")
 
     args, _ = arg_parser.parse_known_args()
 
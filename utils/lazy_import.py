@@ -0,0 +1,89 @@
+import importlib
+import sys
+import threading
+import types
+
+'''
+Deferred module imports, for fast command line startup
+
+Usage:
+    pd = lazy_import('pandas')
+    ...
+    df = pd.DataFrame(...)    # pandas imported here, on first attribute access
+
+    when_loaded('pandas', fn)    # fn(pandas) called once pandas is imported
+'''
+
+# callbacks by module name, run once by the first lazy module to import it
+_callbacks = {}
+_callbacks_lock = threading.Lock()
+
+
+def when_loaded(name, fn):
+    '''
+    Call fn(module) now, if module name is already imported, or else when
+    first imported through lazy_import (e.g. to apply module options
+    without importing the module at startup)
+    '''
+
+    with _callbacks_lock:
+        module = sys.modules.get(name)
+        if module is None:
+            _callbacks.setdefault(name, []).append(fn)
+            return None
+
+    fn(module)
+
+    return True
+
+
+def run_callbacks(name, module):
+    with _callbacks_lock:
+        callbacks = _callbacks.pop(name, [])
+    for fn in callbacks:
+        fn(module)
+
+
+class LazyModule(types.ModuleType):
+    '''
+    Module proxy that imports the wrapped module on first attribute access
+    '''
+
+    def __init__(self, name):
+        super(LazyModule, self).__init__(name)
+        self._lazy_name = name
+        self._lazy_module = None
+        self._lazy_lock = threading.Lock()
+
+    def _load(self):
+        if self._lazy_module is None:
+            with self._lazy_lock:
+                if self._lazy_module is None:
+                    module = importlib.import_module(self._lazy_name)
+                    run_callbacks(self._lazy_name, module)
+                    self._lazy_module = module
+        return self._lazy_module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        state = 'loaded' if self._lazy_module is not None else 'not loaded'
+        return f"<lazy module '{self._lazy_name}' ({state})>"
+
+
+def lazy_import(name):
+    return LazyModule(name)
+
+
+def get_pyplot():
+    '''
+    Import pyplot with the non-interactive backend
+    '''
+    import matplotlib as mpl
+    mpl.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
@@ -0,0 +1,275 @@
+import cProfile
+import functools
+import io
+import json
+import logging
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import psutil
+
+PROFILE_FILE = "profile.json"
+
+WALL = "wall_sec"
+CPU = "cpu_sec"
+PEAK_TRACED = "peak_traced_mb"
+PEAK_RSS = "peak_rss_mb"
+RSS_START = "rss_start_mb"
+RSS_END = "rss_end_mb"
+ITEMS = "items"
+ITEMS_PER_SEC = "items_per_sec"
+DEPTH = "depth"
+
+MB = 2**20
+
+
+class RSSSampler(threading.Thread):
+    '''
+    Background thread that records peak resident set size
+    '''
+
+    def __init__(self, interval=0.05):
+        super(RSSSampler, self).__init__(daemon=True)
+        self.interval = interval
+        self.process = psutil.Process()
+        self.peak = self.process.memory_info().rss
+        self.stop_event = threading.Event()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.peak = max(self.peak, self.process.memory_info().rss)
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+        self.peak = max(self.peak, self.process.memory_info().rss)
+        return self.peak
+
+
+class Profiler(object):
+    '''
+    Stage-level wall time, CPU time, memory, and item count instrumentation
+
+    Usage:
+        profiler = Profiler(path=destination)
+        with profiler.stage("load corpus") as s:
+            corpus = ...
+            s.items = corpus.doc_count()
+        profiler.save()
+
+    Parameters
+    ----------
+    path: output directory for profile.json and stage profiles
+    trace_memory: track peak Python allocations with tracemalloc (adds overhead)
+    sample_rss: track peak RSS with a background sampling thread
+    profile_stages: stage names to profile with cProfile (or pyinstrument, if installed and use_pyinstrument)
+    '''
+
+    def __init__(self, path=None, trace_memory=False, sample_rss=True, \
+                        rss_interval=0.05, profile_stages=None, use_pyinstrument=False):
+
+        self.path = path
+        self.trace_memory = trace_memory
+        self.sample_rss = sample_rss
+        self.rss_interval = rss_interval
+        self.profile_stages = set([] if profile_stages is None else profile_stages)
+        self.use_pyinstrument = use_pyinstrument
+
+        self.stages = OrderedDict()
+        self.info = OrderedDict()
+        self.process = psutil.Process()
+        self.depth = 0
+
+        # traced peaks of open stages, outermost first, as tracemalloc has a single peak
+        self.trace_peaks = []
+
+    @contextmanager
+    def stage(self, name, items=None):
+
+        record = StageRecord(name, items)
+
+        # nested stages share tracemalloc, so only the outermost starts it
+        # the peak so far is saved to the parent before resetting for this stage
+        started_trace = False
+        if self.trace_memory:
+            if tracemalloc.is_tracing():
+                _, peak = tracemalloc.get_traced_memory()
+                if self.trace_peaks:
+                    self.trace_peaks[-1] = max(self.trace_peaks[-1], peak)
+                tracemalloc.reset_peak()
+            else:
+                tracemalloc.start()
+                started_trace = True
+            self.trace_peaks.append(0)
+
+        sampler = None
+        if self.sample_rss:
+            sampler = RSSSampler(self.rss_interval)
+            sampler.start()
+
+        stage_profiler = self._start_stage_profile(name)
+
+        depth = self.depth
+        self.depth += 1
+
+        rss_start = self.process.memory_info().rss
+        t0 = time.perf_counter()
+        c0 = time.process_time()
+        try:
+            yield record
+        finally:
+            wall = time.perf_counter() - t0
+            cpu = time.process_time() - c0
+            self.depth -= 1
+
+            self._stop_stage_profile(name, stage_profiler)
+
+            result = OrderedDict()
+            result[DEPTH] = depth
+            result[WALL] = wall
+            result[CPU] = cpu
+            result[RSS_START] = rss_start/MB
+            result[RSS_END] = self.process.memory_info().rss/MB
+            if sampler is not None:
+                result[PEAK_RSS] = sampler.stop()/MB
+            if self.trace_memory:
+                _, peak = tracemalloc.get_traced_memory()
+                peak = max(peak, self.trace_peaks.pop())
+                result[PEAK_TRACED] = peak/MB
+                # fold into the parent, as the next nested stage resets the peak
+                if self.trace_peaks:
+                    self.trace_peaks[-1] = max(self.trace_peaks[-1], peak)
+                if started_trace:
+                    tracemalloc.stop()
+            if record.items is not None:
+                result[ITEMS] = record.items
+                result[ITEMS_PER_SEC] = record.items/wall if wall > 0 else 0.0
+
+            # repeated stages are accumulated under a numbered name
+            k = name
+            i = 1
+            while k in self.stages:
+                i += 1
+                k = f"{name}_{i}"
+            self.stages[k] = result
+
+            logging.info(f"Stage '{k}': wall={wall:.2f}s, cpu={cpu:.2f}s" + \
+                    (f", peak_rss={result[PEAK_RSS]:.0f}MB" if PEAK_RSS in result else "") + \
+                    (f", items={record.items}" if record.items is not None else ""))
+
+    def timed(self, name=None, items_fn=None):
+        '''
+        Decorator version of stage. items_fn maps the return value to an item count
+        '''
+
+        def decorator(fn):
+            stage_name = fn.__name__ if name is None else name
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.stage(stage_name) as s:
+                    out = fn(*args, **kwargs)
+                    if items_fn is not None:
+                        s.items = items_fn(out)
+                return out
+            return wrapper
+
+        return decorator
+
+    def add_info(self, name, value):
+        '''
+        Attach non-stage information (e.g. cache or pipeline statistics) to the profile
+        '''
+        self.info[name] = value
+
+    def _start_stage_profile(self, name):
+
+        if name not in self.profile_stages:
+            return None
+
+        if self.use_pyinstrument:
+            try:
+                from pyinstrument import Profiler as PyinstrumentProfiler
+            except ImportError:
+                logging.warn("pyinstrument not installed, using cProfile")
+            else:
+                p = PyinstrumentProfiler()
+                p.start()
+                return p
+
+        p = cProfile.Profile()
+        p.enable()
+        return p
+
+    def _stop_stage_profile(self, name, p):
+
+        if p is None:
+            return None
+
+        fn = stage_file_name(name)
+        if isinstance(p, cProfile.Profile):
+            p.disable()
+            if self.path is not None:
+                f = os.path.join(self.path, f"profile_{fn}.prof")
+                p.dump_stats(f)
+                logging.info(f"cProfile output: {f}  (view with: python -m pstats {f})")
+            s = io.StringIO()
+            stats = pstats.Stats(p, stream=s).sort_stats('cumulative')
+            stats.print_stats(20)
+            logging.info(f"cProfile top functions, stage '{name}':\n{s.getvalue()}")
+        else:
+            p.stop()
+            if self.path is not None:
+                f = os.path.join(self.path, f"profile_{fn}.html")
+                with open(f, 'w') as fp:
+                    fp.write(p.output_html())
+                logging.info(f"pyinstrument output: {f}")
+
+        return True
+
+    def summary(self):
+
+        # nested stages are already included in their parents
+        top = [v for v in self.stages.values() if v[DEPTH] == 0]
+
+        total = OrderedDict()
+        total[WALL] = sum([v[WALL] for v in top])
+        total[CPU] = sum([v[CPU] for v in top])
+        if self.sample_rss:
+            total[PEAK_RSS] = max([v.get(PEAK_RSS, 0) for v in self.stages.values()] + [0])
+
+        out = OrderedDict([("stages", self.stages), ("total", total)])
+        if len(self.info) > 0:
+            out["info"] = self.info
+
+        return out
+
+    def save(self, path=None):
+
+        path = self.path if path is None else path
+        if path is None:
+            return None
+
+        f = os.path.join(path, PROFILE_FILE)
+        json.dump(self.summary(), open(f, 'w'), indent=4)
+        logging.info(f"Profile saved: {f}")
+
+        return f
+
+
+class StageRecord(object):
+    '''
+    Handle yielded by Profiler.stage, for setting item counts
+    '''
+    def __init__(self, name, items=None):
+        self.name = name
+        self.items = items
+
+
+def stage_file_name(name):
+    return ''.join([c if c.isalnum() else '_' for c in name])
@@ -0,0 +1,168 @@
+import logging
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.lazy_import import lazy_import
+
+pd = lazy_import('pandas')
+
+'''
+Cached, concurrent aggregation of run score files
+
+Score files are read with a thread pool (reads are I/O bound, e.g. on
+network storage) and the parsed frames are kept in a consolidated Parquet
+store keyed by (path, mtime), so re-aggregating after new runs finish only
+reads new or modified files.
+
+Usage:
+    cache = ScoreCache(os.path.join(source_dir, SCORE_CACHE_FILE))
+    dfs = cache.read(files)    # dictionary of data frames by file
+    cache.save()
+'''
+
+SCORE_CACHE_FILE = "score_cache.parquet"
+
+CACHE_PATH = "_cache_path"
+CACHE_MTIME = "_cache_mtime"
+CACHE_COLUMNS = "_cache_columns"
+CACHE_DTYPES = "_cache_dtypes"
+
+COLUMN_SEP = "\t"
+
+
+def get_mtime(f):
+    return os.stat(f).st_mtime_ns
+
+def read_score_file(f):
+    '''
+    Read score file, with missing subtypes as "na"
+    '''
+
+    df = pd.read_csv(f)
+    df["subtype"] = df["subtype"].fillna(value='na')
+
+    return df
+
+
+class ScoreCache(object):
+    '''
+    Score file frames cached in a Parquet store, keyed by (path, mtime)
+
+    The columns and dtypes of each file are stored with its rows, so frames
+    are restored as read (e.g. integer columns are not returned as float
+    where other files have missing values in the same column).
+
+    Parameters
+    ----------
+    path: Parquet cache file. None will disable caching
+    n_threads: threads for reading score files
+    read_fn: function mapping a file name to a data frame
+    '''
+
+    def __init__(self, path=None, n_threads=16, read_fn=read_score_file):
+
+        self.path = path
+        self.n_threads = n_threads
+        self.read_fn = read_fn
+
+        # (data frame, mtime) by file
+        self.frames = OrderedDict()
+        self.modified = False
+
+        if (self.path is not None) and os.path.exists(self.path):
+            self.load()
+
+    def load(self):
+
+        try:
+            df = pd.read_parquet(self.path)
+        except Exception as e:
+            logging.warn(f"Could not load score cache {self.path}: {e}")
+            return
+
+        # caches written before dtypes were stored are re-read
+        if CACHE_DTYPES not in df.columns:
+            logging.warn(f"Score cache without dtypes ignored: {self.path}")
+            return
+
+        for f, df_file in df.groupby(CACHE_PATH, sort=False):
+            mtime = df_file[CACHE_MTIME].iloc[0]
+            # columns of the file, excluding columns only present in other files
+            columns = df_file[CACHE_COLUMNS].iloc[0].split(COLUMN_SEP)
+            dtypes = df_file[CACHE_DTYPES].iloc[0].split(COLUMN_SEP)
+            df_file = df_file[columns].astype(dict(zip(columns, dtypes))).reset_index(drop=True)
+            self.frames[f] = (df_file, mtime)
+
+        logging.info(f"Score cache loaded: {self.path}, {len(self.frames)} files")
+
+    def read(self, files):
+        '''
+        Read score files, using cached frames for files not modified since cached
+
+        returns dictionary of data frames by file, in the order of files
+        '''
+
+        files = [str(f) for f in files]
+        mtimes = OrderedDict([(f, get_mtime(f)) for f in files])
+
+        to_read = [f for f, mtime in mtimes.items() \
+                    if (f not in self.frames) or (self.frames[f][1] != mtime)]
+
+        logging.info(f"Score files: {len(files)}, cached: {len(files) - len(to_read)}, reading: {len(to_read)}")
+
+        if to_read:
+            with ThreadPoolExecutor(max_workers=self.n_threads) as executor:
+                for f, df in zip(to_read, executor.map(self.read_fn, to_read)):
+                    self.frames[f] = (df, mtimes[f])
+            self.modified = True
+
+        return OrderedDict([(f, self.frames[f][0].copy()) for f in files])
+
+    def save(self):
+        '''
+        Write cached frames to the Parquet store, if any were read since loading,
+        dropping files that no longer exist
+        '''
+
+        if self.path is None:
+            return None
+
+        missing = [f for f in self.frames if not os.path.exists(f)]
+        for f in missing:
+            del self.frames[f]
+        if missing:
+            logging.info(f"Score cache, dropping {len(missing)} missing files")
+            self.modified = True
+
+        if not self.modified:
+            return None
+
+        if not self.frames:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self.modified = False
+            return None
+
+        dfs = []
+        for f, (df, mtime) in self.frames.items():
+            columns = COLUMN_SEP.join(map(str, df.columns))
+            dtypes = COLUMN_SEP.join(map(str, df.dtypes))
+            df = df.copy()
+            df[CACHE_PATH] = f
+            df[CACHE_MTIME] = mtime
+            df[CACHE_COLUMNS] = columns
+            df[CACHE_DTYPES] = dtypes
+            dfs.append(df)
+        df = pd.concat(dfs, ignore_index=True)
+
+        try:
+            df.to_parquet(self.path, index=False)
+        except Exception as e:
+            logging.warn(f"Could not save score cache {self.path}: {e}")
+            return None
+
+        self.modified = False
+        logging.info(f"Score cache saved: {self.path}")
+
+        return self.path